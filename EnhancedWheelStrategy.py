@@ -30,7 +30,9 @@ class EnhancedWheelStrategy(BaseStrategy):
         """日內監控：風控與停利"""
         date, S, calls, puts = market_data
         position = context.get('position')
-        print("position", position)
+        journal = context.get('journal') or get_journal()
+        if journal.debug_on:
+            journal.debug(STRATEGY, "position {position}", date=date, position=position)
         signals = []
 
         if not position or not position.get('legs'):
@@ -72,7 +74,8 @@ class EnhancedWheelStrategy(BaseStrategy):
         if current_dt < self.gamma_risk_days and current_delta > 0.4:
             signals.append(TradeSignal('CLOSE', contract, [Leg(my_leg['side'], strike, opt_type)], 
                                      "Gamma_Risk", quantity=qty))
-            print(f">> [{date}] Gamma Risk triggered for {opt_type.capitalize()} {strike}: Delta={current_delta:.2f}, dT={current_dt:.2f}年, Qty={qty}")
+            journal.info(SIGNAL, ">> [{date}] Gamma Risk triggered for {opt_type} {strike}: Delta={delta:.2f}, dT={dt:.2f}年, Qty={qty}",
+                         date=date, opt_type=opt_type.capitalize(), strike=strike, delta=current_delta, dt=current_dt, qty=qty)
             return signals
 
         return signals
@@ -83,6 +86,7 @@ class EnhancedWheelStrategy(BaseStrategy):
         date, S, calls, puts = market_data
         balance = context['balance']
         position = context.get('position')
+        journal = context.get('journal') or get_journal()
         
         signals = []
 
@@ -107,11 +111,14 @@ class EnhancedWheelStrategy(BaseStrategy):
                 if is_itm:
                     self.mode = 'CALL'
                     self.virtual_cost = strike
+                    journal.info(MODE_CHANGE, ">> [{date}] PUT -> CALL, virtual_cost={cost}", date=date,
+                                 mode=self.mode, cost=self.virtual_cost)
                 # else: 保持 PUT
             elif self.mode == 'CALL':
                 if is_itm:
                     self.mode = 'PUT' # 救援失敗或成功被call走，回歸原點
                     self.virtual_cost = 0
+                    journal.info(MODE_CHANGE, ">> [{date}] CALL -> PUT", date=date, mode=self.mode, cost=0)
                 # else: 繼續 CALL (可選擇調整 virtual_cost)
 
         # --- B. 建立新倉 ---
@@ -0,0 +1,192 @@
+"""
+資料與執行路徑的效能基準測試 (使用合成資料，可重現)
+
+用法:
+    python benchmarks/bench.py --scale small
+    python benchmarks/bench.py --scale medium --save            # 存成 baseline
+    python benchmarks/bench.py --scale medium --compare         # 與 baseline 比較，退步超過門檻回傳 1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+from utils import (clean_futures_data, clean_options_data, get_greeks, market_data_generator,
+                   BacktestExecutor)
+from synthetic_data import make_synthetic_market, make_synthetic_intraday
+from intraday import IntradayStore, IntradayBarSource
+from EnhancedWheelStrategy2 import EnhancedWheelStrategy
+
+
+# 規模設定：(起始日, 結束日, 價平上下履約價檔數)
+SCALES = {
+    'small': ('2020-01-01', '2020-06-30', 15),
+    'medium': ('2019-01-01', '2020-12-31', 25),
+    'large': ('2015-01-01', '2022-12-31', 40),
+}
+
+INTRADAY_DAYS = 10  # 盤中基準只跑前幾個交易日 (1 分 K 資料量約為日資料的數百倍)
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def _quiet(fn, *args, **kwargs):
+    """執行時吞掉 print 輸出，避免干擾量測"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def _measure(fn, repeat, memory):
+    """回傳 (最佳耗時秒數, 峰值記憶體 MB, 最後一次的回傳值)"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t)
+    peak_mb = float('nan')
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return best, peak_mb, result
+
+
+def run_benchmarks(scale='small', repeat=3, memory=True, seed=0):
+    start, end, n_strikes = SCALES[scale]
+    df_opt_raw, df_fut_raw = make_synthetic_market(start, end, n_strikes=n_strikes, seed=seed)
+    df_opt = _quiet(clean_options_data, df_opt_raw)
+    df_fut = _quiet(clean_futures_data, df_fut_raw)
+    n_days = df_fut['交易日期'].nunique()
+    n_opt = len(df_opt)
+
+    results = []
+
+    def record(case, seconds, peak_mb, days=None, rows=None):
+        results.append({
+            'case': case,
+            'seconds': seconds,
+            'peak_mb': peak_mb,
+            'days_per_s': days / seconds if days else float('nan'),
+            'rows_per_s': rows / seconds if rows else float('nan'),
+        })
+
+    # 1. 資料清洗
+    sec, mb, _ = _measure(lambda: _quiet(clean_options_data, df_opt_raw), repeat, memory)
+    record('clean_options_data', sec, mb, rows=len(df_opt_raw))
+    sec, mb, _ = _measure(lambda: _quiet(clean_futures_data, df_fut_raw), repeat, memory)
+    record('clean_futures_data', sec, mb, rows=len(df_fut_raw))
+
+    # 2. 單日 get_greeks (DataFrame 版)，取 20 個交易日
+    dates = sorted(df_opt['交易日期'].unique())[:20]
+    spot = df_fut.groupby('交易日期')['開盤價'].first()
+
+    def greeks_days():
+        for d in dates:
+            get_greeks(df_opt, d, spot.loc[d], 0.01)
+    sec, mb, _ = _measure(greeks_days, repeat, memory)
+    rows = int(df_opt['交易日期'].isin(dates).sum())
+    record('get_greeks (20 days)', sec, mb, days=len(dates), rows=rows)
+
+    # 3. 完整跑一次 market_data_generator
+    def generator_pass():
+        return sum(1 for _ in _quiet(lambda: list(market_data_generator(start, end, df_opt, df_fut))))
+    sec, mb, n = _measure(generator_pass, repeat, memory)
+    record('market_data_generator', sec, mb, days=n, rows=n_opt)
+
+    # 4. BacktestExecutor + EnhancedWheelStrategy 完整回測
+    def backtest():
+        executor = BacktestExecutor(EnhancedWheelStrategy(leverage=3.0), start, end, df_opt, df_fut)
+        return _quiet(executor.run)
+    sec, mb, _ = _measure(backtest, repeat, memory)
+    record('backtest EnhancedWheelStrategy', sec, mb, days=n_days, rows=n_opt)
+
+    # 5. 同上，背景行程預先計算快照
+    def backtest_prefetch():
+        executor = BacktestExecutor(EnhancedWheelStrategy(leverage=3.0), start, end, df_opt, df_fut,
+                                    prefetch=4, prefetch_mode='process')
+        return _quiet(executor.run)
+    sec, mb, _ = _measure(backtest_prefetch, repeat, False)
+    record('backtest prefetch=4 (process)', sec, mb, days=n_days, rows=n_opt)
+
+    # 6. 盤中 K 棒：IntradayBarSource 5 分 K (1 分 K 合成資料，前 INTRADAY_DAYS 個交易日，csv 分日檔)
+    intraday_end = sorted(df_fut['交易日期'].unique())[:INTRADAY_DAYS][-1]
+    df_tx, df_txo = make_synthetic_intraday(start, intraday_end, n_strikes=min(n_strikes, 20), seed=seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = IntradayStore(tmp, 'csv')
+        store.write(df_tx, 'TX')
+        store.write(df_txo, 'TXO')
+        source = IntradayBarSource(store, minutes=5)
+
+        def intraday_pass():
+            return sum(1 for _ in _quiet(lambda: list(source(start, intraday_end))))
+        sec, mb, _ = _measure(intraday_pass, repeat, memory)
+    record(f'IntradayBarSource 5min ({INTRADAY_DAYS} days)', sec, mb,
+           days=df_tx['時間'].dt.normalize().nunique(), rows=len(df_txo))
+
+    meta = {
+        'scale': scale, 'seed': seed, 'days': int(n_days), 'option_rows': int(n_opt),
+        'python': platform.python_version(), 'pandas': pd.__version__, 'machine': platform.machine(),
+    }
+    return meta, pd.DataFrame(results)
+
+
+def compare(current: pd.DataFrame, baseline: pd.DataFrame, tolerance: float) -> pd.DataFrame:
+    """與 baseline 比較耗時；ratio > 1 + tolerance 視為退步"""
+    merged = current.merge(baseline[['case', 'seconds', 'peak_mb']], on='case', suffixes=('', '_base'))
+    merged['ratio'] = merged['seconds'] / merged['seconds_base']
+    merged['regressed'] = merged['ratio'] > 1 + tolerance
+    return merged[['case', 'seconds_base', 'seconds', 'ratio', 'peak_mb_base', 'peak_mb', 'regressed']]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Future-Option-Trader 效能基準測試 (合成資料)')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--repeat', type=int, default=3, help='每項重複次數 (取最佳)')
+    parser.add_argument('--no-memory', action='store_true', help='略過 tracemalloc 峰值記憶體量測')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='baseline 檔案路徑 (預設 benchmarks/baselines/<scale>.json)')
+    parser.add_argument('--save', action='store_true', help='將本次結果存為 baseline')
+    parser.add_argument('--compare', action='store_true', help='與 baseline 比較')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='允許的退步比例')
+    args = parser.parse_args(argv)
+
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f'{args.scale}.json')
+    meta, results = run_benchmarks(args.scale, args.repeat, not args.no_memory, args.seed)
+
+    print(f"--- Benchmark | scale={meta['scale']} | {meta['days']} 天 | 選擇權 {meta['option_rows']} 筆 ---")
+    print(results.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+
+    status = 0
+    if args.compare:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = pd.DataFrame(json.load(f)['results'])
+        report = compare(results, baseline, args.tolerance)
+        print(f"\n--- 與 baseline 比較 ({baseline_path}) ---")
+        print(report.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+        if report['regressed'].any():
+            print(f">> 有項目退步超過 {args.tolerance:.0%}")
+            status = 1
+
+    if args.save:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'results': results.to_dict(orient='records')}, f, ensure_ascii=False, indent=2)
+        print(f">> baseline 已寫入 {baseline_path}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
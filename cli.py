@@ -0,0 +1,661 @@
+"""
+命令列回測
+
+    python -m cli backtest --config run.yaml            # 執行回測 (結果快取命中時不載入資料)
+    python -m cli validate --config run.yaml            # 只檢查設定檔
+    python -m cli serve                                 # 常駐程序：清洗後的資料與快照留在記憶體
+    python -m cli backtest --config run.yaml --daemon   # 交給常駐程序執行
+    python -m cli stop                                  # 結束常駐程序
+
+本模組頂層只匯入標準函式庫；pandas / numpy / py_lets_be_rational 等在真正需要回測時才匯入，
+因此 --help、設定檢查與快取命中的回測都能快速啟動。
+"""
+import argparse
+import ast
+import datetime
+import glob
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import pickle
+import secrets
+import stat
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+# 策略簡稱 -> '模組:類別' (也可以在設定檔直接寫 '模組:類別')
+STRATEGIES = {
+    'wheel': 'EnhancedWheelStrategy2:EnhancedWheelStrategy',
+    'wheel_v1': 'EnhancedWheelStrategy:EnhancedWheelStrategy',
+}
+
+# 選用元件：設定檔的 key -> (模組, 預設類別)
+COMPONENTS = {
+    'fill_model': ('fill_model', 'TaifexFillModel'),
+    'hedger': ('hedging', 'DeltaHedger'),
+    'indicators': ('indicators', 'MarketIndicators'),
+    'approx_greeks': ('greeks_grid', 'ApproxGreeks'),
+}
+
+TOP_LEVEL_KEYS = {'data', 'start', 'end', 'balance', 'strategy', 'prefetch', 'registry', 'output', 'log_level',
+                  *COMPONENTS}
+DATA_KEYS = {'options', 'futures', 'drop_columns', 'cleaned', 'cache_dir'}
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+DEFAULT_ADDRESS = ('127.0.0.1', 6543)
+# 常駐程序的連線金鑰：環境變數 FOT_DAEMON_KEY；未設定時使用每個使用者的隨機金鑰檔 (0600)
+KEY_FILE = os.path.join(os.path.expanduser('~'), '.future_option_trader', 'daemon.key')
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ConfigError(ValueError):
+    """設定檔錯誤 (一次列出所有問題)"""
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super().__init__("設定檔錯誤:\n" + "\n".join(f"  - {p}" for p in self.problems))
+
+
+# ==========================================
+# 設定檔
+# ==========================================
+# data:
+#   options: C:/data/option_data/processed_parquet/opt_all.parquet   # 路徑或 glob，可為 list (.parquet / .csv)
+#   futures: C:/data/future_data/processed_parquet/*.parquet
+#   drop_columns: [漲跌價, 漲跌%]      # 讀檔後先刪除的欄位
+#   cleaned: false                      # 檔案已經過 clean_*_data 時設為 true
+#   cache_dir: .backtest_cache          # 清洗後資料與回測結果的快取 (省略則不快取)
+# start: 2015-01-01
+# end: 2022-12-31
+# balance: 150000
+# strategy:
+#   name: wheel                         # STRATEGIES 的簡稱或 '模組:類別'
+#   params: {leverage: 5.0, target_delta: 0.2}
+# fill_model: {name: TaifexFillModel, commission: 25}   # 以下元件皆可省略；true 為預設參數
+# hedger: {band: 2.0, product: MTX}
+# indicators: {rank_window: 252}
+# approx_greeks: {max_error: 0.0005}
+# prefetch: 0
+# registry: {root: D:/backtest_runs, fmt: parquet, tags: {sweep: cli}}
+# output: {dir: results/}               # 寫出 history.csv, equity.csv, hedges.csv, events.csv
+# log_level: WARNING
+def load_config(path: str) -> dict:
+    """讀取設定檔 (.yaml / .yml / .json)，相對路徑以設定檔所在目錄為準"""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    if not isinstance(config, dict):
+        raise ConfigError([f"{path} 的內容必須是 mapping"])
+    config['_base'] = os.path.dirname(os.path.abspath(path))
+    return config
+
+
+def _class_signature(module: str, cls: str):
+    """
+    不匯入模組，以 ast 讀取類別建構子的參數名稱
+    回傳 (是否找到類別, 參數名稱 set 或 None (接受任意參數))
+    """
+    spec = importlib.util.find_spec(module)
+    if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+        return spec is not None, None
+    with open(spec.origin, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == cls:
+            for item in node.body:
+                if isinstance(item, ast.FunctionDef) and item.name == '__init__':
+                    if item.args.kwarg is not None:
+                        return True, None
+                    return True, {a.arg for a in item.args.args[1:] + item.args.kwonlyargs}
+            return True, None  # 繼承的建構子，不檢查
+    return False, None
+
+
+def _check_class(label, module, cls, params, problems):
+    try:
+        found, names = _class_signature(module, cls)
+    except (ImportError, SyntaxError, ValueError) as e:
+        problems.append(f"{label}: 無法讀取模組 {module} ({e})")
+        return
+    if not found:
+        problems.append(f"{label}: 找不到 {module}:{cls}")
+    elif names is not None:
+        unknown = sorted(set(params) - names)
+        if unknown:
+            problems.append(f"{label}: {cls} 沒有參數 {unknown} (可用: {sorted(names)})")
+
+
+def _resolve_files(patterns, base, label, problems):
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    if not isinstance(patterns, list) or not patterns:
+        problems.append(f"data.{label}: 必須是路徑字串或路徑 list")
+        return []
+    files = []
+    for pattern in patterns:
+        pattern = os.path.join(base, os.path.expanduser(str(pattern)))
+        matched = sorted(glob.glob(pattern))
+        if not matched:
+            problems.append(f"data.{label}: 找不到檔案 {pattern}")
+        for path in matched:
+            if not path.endswith(('.parquet', '.csv')):
+                problems.append(f"data.{label}: 只支援 .parquet / .csv ({path})")
+        files.extend(os.path.abspath(p) for p in matched)
+    return files
+
+
+def _parse_date(value, label, problems):
+    try:
+        return datetime.date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        problems.append(f"{label}: 無法解析日期 {value!r}")
+        return None
+
+
+def validate_config(config: dict) -> dict:
+    """
+    檢查設定檔並回傳正規化後的設定 (檔案展開為絕對路徑、策略與元件解析為模組與類別)
+    只讀取檔案清單與原始碼 (ast)，不匯入 pandas 或策略模組；有問題時拋出 ConfigError。
+    """
+    problems = []
+    base = config.get('_base', os.getcwd())
+    unknown = sorted(k for k in config if k not in TOP_LEVEL_KEYS and not k.startswith('_'))
+    if unknown:
+        problems.append(f"未知的設定: {unknown}")
+
+    # 資料
+    data = config.get('data')
+    if not isinstance(data, dict):
+        problems.append("data: 必須指定 options 與 futures")
+        data = {}
+    unknown = sorted(set(data) - DATA_KEYS)
+    if unknown:
+        problems.append(f"data: 未知的設定 {unknown}")
+    for key in ('options', 'futures'):
+        if key not in data:
+            problems.append(f"data.{key}: 必填")
+    cache_dir = data.get('cache_dir')
+    norm_data = {
+        'options': _resolve_files(data['options'], base, 'options', problems) if 'options' in data else [],
+        'futures': _resolve_files(data['futures'], base, 'futures', problems) if 'futures' in data else [],
+        'drop_columns': list(data.get('drop_columns') or []),
+        'cleaned': bool(data.get('cleaned', False)),
+        'cache_dir': os.path.join(base, os.path.expanduser(str(cache_dir))) if cache_dir else None,
+    }
+
+    # 區間與資金
+    start = end = None
+    if 'start' not in config or 'end' not in config:
+        problems.append("start / end: 必填 (YYYY-MM-DD)")
+    else:
+        start = _parse_date(config['start'], 'start', problems)
+        end = _parse_date(config['end'], 'end', problems)
+    if start and end and start > end:
+        problems.append(f"start ({start}) 晚於 end ({end})")
+    balance = config.get('balance', 2_000_000)
+    if not isinstance(balance, (int, float)) or isinstance(balance, bool) or balance <= 0:
+        problems.append(f"balance: 必須是正數 ({balance!r})")
+    prefetch = config.get('prefetch', 0)
+    if not isinstance(prefetch, int) or isinstance(prefetch, bool) or prefetch < 0:
+        problems.append(f"prefetch: 必須是非負整數 ({prefetch!r})")
+    log_level = str(config.get('log_level', 'WARNING')).upper()
+    if log_level not in LOG_LEVELS:
+        problems.append(f"log_level: 必須是 {LOG_LEVELS} 之一")
+
+    # 策略
+    strategy = config.get('strategy')
+    if isinstance(strategy, str):
+        strategy = {'name': strategy}
+    if not isinstance(strategy, dict) or 'name' not in strategy:
+        problems.append("strategy: 必須指定 name")
+        strategy = {'name': ''}
+    target = STRATEGIES.get(strategy['name'], strategy['name'])
+    module, _, cls = str(target).partition(':')
+    params = strategy.get('params') or {}
+    if not cls:
+        problems.append(f"strategy.name: 未知的策略 {strategy['name']!r} (可用: {sorted(STRATEGIES)} 或 '模組:類別')")
+    elif not isinstance(params, dict):
+        problems.append("strategy.params: 必須是 mapping")
+    else:
+        _check_class('strategy', module, cls, params, problems)
+    norm_strategy = {'name': strategy['name'], 'module': module, 'class': cls, 'params': params}
+
+    # 選用元件
+    components = {}
+    for key, (comp_module, default_cls) in COMPONENTS.items():
+        value = config.get(key)
+        if value is None or value is False:
+            components[key] = None
+            continue
+        if value is True:
+            value = {}
+        if not isinstance(value, dict):
+            problems.append(f"{key}: 必須是 mapping 或 true / false")
+            continue
+        comp_params = {k: v for k, v in value.items() if k != 'name'}
+        comp_cls = value.get('name', default_cls)
+        _check_class(key, comp_module, comp_cls, comp_params, problems)
+        components[key] = {'module': comp_module, 'class': comp_cls, 'params': comp_params}
+
+    registry = config.get('registry')
+    if registry is not None and (not isinstance(registry, dict) or 'root' not in registry):
+        problems.append("registry: 必須指定 root")
+        registry = None
+    if registry is not None:
+        registry = {'root': os.path.join(base, os.path.expanduser(str(registry['root']))),
+                    'fmt': registry.get('fmt', 'csv'), 'tags': dict(registry.get('tags') or {})}
+        if registry['fmt'] not in ('parquet', 'csv'):
+            problems.append("registry.fmt: 必須是 parquet 或 csv")
+        elif registry['fmt'] == 'parquet' and not any(importlib.util.find_spec(name)
+                                                      for name in ('pyarrow', 'fastparquet')):
+            # 回測跑完才寫入紀錄庫，先檢查避免白跑
+            problems.append("registry.fmt: parquet 需要 pyarrow 或 fastparquet (或改用 csv)")
+    output = config.get('output')
+    if output is not None and (not isinstance(output, dict) or 'dir' not in output):
+        problems.append("output: 必須指定 dir")
+        output = None
+    if output is not None:
+        output = {'dir': os.path.join(base, os.path.expanduser(str(output['dir'])))}
+
+    if problems:
+        raise ConfigError(problems)
+    return {'data': norm_data, 'start': start, 'end': end, 'balance': balance, 'prefetch': prefetch,
+            'log_level': log_level, 'strategy': norm_strategy, **components, 'registry': registry, 'output': output}
+
+
+# ==========================================
+# 快取鍵 (只看檔案狀態與原始碼，不讀資料)
+# ==========================================
+def _sha1(obj) -> str:
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _file_stats(files):
+    stats = []
+    for path in files:
+        st = os.stat(path)
+        stats.append((path, st.st_size, st.st_mtime_ns))
+    return stats
+
+
+def _source_hash(names) -> str:
+    """原始碼版本 (程式修改後快取自動失效)"""
+    h = hashlib.sha1()
+    for name in sorted(names):
+        with open(os.path.join(_HERE, name), 'rb') as f:
+            h.update(name.encode())
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def data_key(cfg: dict) -> str:
+    """清洗後資料的快取鍵：來源檔案 (路徑、大小、修改時間) + 清洗設定 + 清洗程式碼"""
+    data = cfg['data']
+    return _sha1({'options': _file_stats(data['options']), 'futures': _file_stats(data['futures']),
+                  'drop_columns': data['drop_columns'], 'cleaned': data['cleaned'],
+                  'code': _source_hash(['utils.py'])})
+
+
+def run_key(cfg: dict) -> str:
+    """
+    回測結果的快取鍵：資料 + 回測設定 (不含輸出位置) + 所有模組的原始碼
+    (log_level 會改變快取中的 events 紀錄，因此也在鍵內)
+    """
+    setting = {k: v for k, v in cfg.items() if k not in ('data', 'output', 'registry', 'prefetch')}
+    return _sha1({'data': data_key(cfg), 'setting': setting, 'code': code_version()})
+
+
+def code_version() -> str:
+    """目前磁碟上所有模組的原始碼版本"""
+    return _source_hash([n for n in os.listdir(_HERE) if n.endswith('.py')])
+
+
+# ==========================================
+# 資料與快照 (常駐模式在多次回測間保留)
+# ==========================================
+def _read_files(files, drop_columns):
+    import pandas as pd
+    frames = [pd.read_parquet(p) if p.endswith('.parquet') else pd.read_csv(p) for p in files]
+    df = pd.concat(frames, axis=0, ignore_index=True) if len(frames) > 1 else frames[0]
+    return df.drop(columns=[c for c in drop_columns if c in df.columns])
+
+
+class Workspace:
+    """
+    已清洗資料 (與快照快取) 的存放處
+
+    單次執行時每次建立新的 Workspace；serve 常駐時共用同一個，後續回測不再讀檔與清洗，
+    keep_snapshots=True 時同一份資料的 IV/Greeks 也只計算一次 (optimization.SnapshotCache)。
+
+    參數:
+        max_datasets (int): 記憶體中最多保留幾份資料 (超過時移除最久未使用的)
+        keep_snapshots (bool): 是否保留快照快取
+    """
+    def __init__(self, max_datasets: int = 2, keep_snapshots: bool = False):
+        self.max_datasets = max_datasets
+        self.keep_snapshots = keep_snapshots
+        self._datasets = OrderedDict()   # data_key -> {'df_opt', 'df_fut', 'fingerprint', 'snapshots'}
+
+    def __len__(self):
+        return len(self._datasets)
+
+    def dataset(self, cfg: dict, key: str) -> dict:
+        """取得清洗後的資料：記憶體 -> 磁碟快取 (data.cache_dir) -> 讀檔並清洗"""
+        if key in self._datasets:
+            self._datasets.move_to_end(key)
+            return self._datasets[key]
+        data = cfg['data']
+        cache_path = os.path.join(data['cache_dir'], f"cleaned-{key}.pkl") if data['cache_dir'] else None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                df_opt, df_fut = pickle.load(f)
+        else:
+            from utils import clean_options_data, clean_futures_data
+            df_opt = _read_files(data['options'], data['drop_columns'])
+            df_fut = _read_files(data['futures'], data['drop_columns'])
+            if not data['cleaned']:
+                df_opt, df_fut = clean_options_data(df_opt), clean_futures_data(df_fut)
+            if cache_path:
+                _atomic_pickle((df_opt, df_fut), cache_path)
+
+        self._datasets[key] = {'df_opt': df_opt, 'df_fut': df_fut, 'fingerprint': None, 'snapshots': {}}
+        while len(self._datasets) > self.max_datasets:
+            self._datasets.popitem(last=False)
+        return self._datasets[key]
+
+    def snapshots(self, dataset: dict, approx_greeks):
+        """同一份資料、同一近似設定共用的 SnapshotCache (keep_snapshots=False 時回傳 None)"""
+        if not self.keep_snapshots:
+            return None
+        from optimization import SnapshotCache
+        key = repr(approx_greeks)
+        if key not in dataset['snapshots']:
+            dataset['snapshots'][key] = SnapshotCache(dataset['df_opt'], dataset['df_fut'],
+                                                      approx_greeks=approx_greeks)
+        return dataset['snapshots'][key]
+
+
+def _atomic_pickle(obj, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def _build(spec):
+    """由正規化設定建立元件 (None 則回傳 None)"""
+    if spec is None:
+        return None
+    return getattr(importlib.import_module(spec['module']), spec['class'])(**spec['params'])
+
+
+# ==========================================
+# 回測
+# ==========================================
+def run_backtest(cfg: dict, workspace: Workspace = None, use_cache: bool = True) -> dict:
+    """
+    執行一次回測 (cfg 為 validate_config 的輸出)，回傳摘要 dict
+
+    data.cache_dir 有同一設定的結果時直接使用 (不匯入 pandas 以外的模組、不讀資料)。
+    """
+    t0 = time.perf_counter()
+    key = run_key(cfg)
+    cache_dir = cfg['data']['cache_dir']
+    result_path = os.path.join(cache_dir, 'results', f"{key}.pkl") if cache_dir else None
+    summary_path = os.path.join(cache_dir, 'results', f"{key}.json") if cache_dir else None
+
+    if use_cache and summary_path and os.path.exists(summary_path) and os.path.exists(result_path):
+        with open(summary_path, encoding='utf-8') as f:
+            summary = json.load(f)
+        if cfg['output']:
+            with open(result_path, 'rb') as f:
+                _write_outputs(cfg['output']['dir'], pickle.load(f))
+        summary.update(cached=True, elapsed=time.perf_counter() - t0)
+        return summary
+
+    import event_journal
+    from utils import BacktestExecutor
+    from optimization import BacktestResult, data_fingerprint
+    from run_registry import RunRegistry, run_summary, strategy_params
+
+    if workspace is None:
+        workspace = Workspace()
+    dataset = workspace.dataset(cfg, data_key(cfg))
+    df_opt, df_fut = dataset['df_opt'], dataset['df_fut']
+
+    strategy_cls = getattr(importlib.import_module(cfg['strategy']['module']), cfg['strategy']['class'])
+    strategy = strategy_cls(**cfg['strategy']['params'])
+    approx_greeks = _build(cfg['approx_greeks'])
+    snapshots = workspace.snapshots(dataset, approx_greeks)
+    journal = event_journal.EventJournal(level=getattr(event_journal, cfg['log_level']), console=True)
+    executor = BacktestExecutor(strategy, cfg['start'], cfg['end'], df_opt, df_fut, cfg['balance'],
+                                journal=journal, market_data=snapshots,
+                                prefetch=cfg['prefetch'] if snapshots is None else 0,
+                                fill_model=_build(cfg['fill_model']), indicators=_build(cfg['indicators']),
+                                approx_greeks=approx_greeks if snapshots is None else None,
+                                hedger=_build(cfg['hedger']))
+    history = executor.run()
+    result = BacktestResult(strategy_params(strategy), executor.start_date, executor.end_date,
+                            executor.initial_balance, history, executor.equity_frame(), executor.stopped,
+                            executor.hedge_frame())
+
+    summary = {'strategy': f"{cfg['strategy']['module']}:{cfg['strategy']['class']}", 'start': cfg['start'],
+               'end': cfg['end'], 'stopped': executor.stopped, 'hedge_pnl': executor.hedge_pnl,
+               **run_summary(result)}
+    if cfg['registry']:
+        if dataset['fingerprint'] is None:
+            dataset['fingerprint'] = data_fingerprint(df_opt, df_fut)
+        registry = RunRegistry(cfg['registry']['root'], cfg['registry']['fmt'])
+        summary['run_id'] = registry.record(strategy_cls, result, dataset['fingerprint'], cfg['registry']['tags'])
+    frames = {'history': history, 'equity': result.equity, 'hedges': result.hedges, 'events': journal.to_frame()}
+    if result_path:
+        _atomic_pickle(frames, result_path)
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, default=str)
+    if cfg['output']:
+        _write_outputs(cfg['output']['dir'], frames)
+    summary.update(cached=False, elapsed=time.perf_counter() - t0)
+    return summary
+
+
+def _write_outputs(out_dir, frames):
+    os.makedirs(out_dir, exist_ok=True)
+    for name, df in frames.items():
+        if df is not None:
+            df.to_csv(os.path.join(out_dir, f"{name}.csv"), index=False)
+
+
+def format_summary(summary: dict) -> str:
+    lines = [f"--- 回測結果 | {summary.get('strategy', '')} {summary.get('start')} ~ {summary.get('end')}"
+             f"{' (快取)' if summary.get('cached') else ''} ---",
+             f">> 交易筆數: {summary['n_trades']} | 勝率: {summary['win_rate']:.1%}",
+             f">> 期末權益: {summary['final_equity']:,.0f} | 損益: {summary['total_pnl']:,.0f} "
+             f"| 費用: {summary['fees']:,.0f}",
+             f">> 最大回撤: {summary['max_drawdown']:.1%} | Sharpe: {summary['sharpe']:.2f}"]
+    if summary.get('hedge_pnl'):
+        lines.append(f">> 期貨避險損益: {summary['hedge_pnl']:,.0f}")
+    if summary.get('stopped'):
+        lines.append(f">> 提前結束: {summary['stopped']}")
+    if summary.get('run_id'):
+        lines.append(f">> 紀錄庫 run_id: {summary['run_id']}")
+    lines.append(f">> 耗時: {summary['elapsed']:.2f}s")
+    return "\n".join(lines)
+
+
+# ==========================================
+# 常駐模式 (multiprocessing.connection，僅限本機)
+# ==========================================
+def _parse_address(text):
+    if not text:
+        return DEFAULT_ADDRESS
+    host, _, port = text.rpartition(':')
+    return (host or DEFAULT_ADDRESS[0], int(port))
+
+
+def _authkey() -> bytes:
+    """
+    連線金鑰 (常駐程序以 pickle 收送訊息，只有持有金鑰的行程能連線)
+
+    優先使用環境變數 FOT_DAEMON_KEY；否則讀取 KEY_FILE，不存在時以隨機值建立 (權限 0600)。
+    金鑰檔可被其他使用者讀寫時拒絕使用。
+    """
+    key = os.environ.get('FOT_DAEMON_KEY')
+    if key:
+        return key.encode()
+    os.makedirs(os.path.dirname(KEY_FILE), mode=0o700, exist_ok=True)
+    try:
+        fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    st = os.stat(KEY_FILE)
+    if os.name == 'posix' and (st.st_mode & (stat.S_IRWXG | stat.S_IRWXO) or st.st_uid != os.getuid()):
+        raise PermissionError(f"金鑰檔 {KEY_FILE} 權限不安全 (需為本人所有且權限 0600)，"
+                              f"請執行 chmod 600 或刪除後重新啟動常駐程序")
+    with open(KEY_FILE, encoding='utf-8') as f:
+        key = f.read().strip()
+    if not key:
+        raise PermissionError(f"金鑰檔 {KEY_FILE} 是空的，請刪除後重新啟動常駐程序")
+    return key.encode()
+
+
+def serve(address=DEFAULT_ADDRESS, max_datasets: int = 2):
+    """
+    常駐回測程序：依序處理 backtest 請求，清洗後的資料與快照快取留在記憶體
+    (同一份資料的第二次回測起不再讀檔、清洗與計算 Greeks)
+
+    啟動時記錄原始碼版本並載入回測模組；之後原始碼有修改時，已載入的舊模組與快取鍵不再一致，
+    因此拒絕回測請求，需重新啟動常駐程序。
+    """
+    from multiprocessing import AuthenticationError
+    from multiprocessing.connection import Listener
+    authkey = _authkey()
+    code = code_version()
+    import utils, optimization, run_registry  # noqa: F401  (與 code 同一版本的模組留在記憶體)
+    workspace = Workspace(max_datasets=max_datasets, keep_snapshots=True)
+    n_runs = 0
+    with Listener(address, authkey=authkey) as listener:
+        print(f"--- 常駐程序啟動 {address[0]}:{address[1]} (python -m cli stop 結束) ---", flush=True)
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                print("--- 拒絕金鑰不符的連線 ---", flush=True)
+                continue
+            with conn:
+                message = conn.recv()
+                cmd = message.get('cmd')
+                if cmd == 'stop':
+                    conn.send({'ok': True})
+                    break
+                if cmd == 'status':
+                    conn.send({'ok': True, 'runs': n_runs, 'datasets': len(workspace), 'code': code,
+                               'stale': code_version() != code})
+                    continue
+                if code_version() != code:
+                    conn.send({'ok': False, 'error': "原始碼在常駐程序啟動後已修改，請重新啟動 "
+                                                     "(python -m cli stop 後再 python -m cli serve)"})
+                    continue
+                try:
+                    summary = run_backtest(message['config'], workspace, message.get('use_cache', True))
+                    n_runs += 1
+                    conn.send({'ok': True, 'summary': summary})
+                except Exception:
+                    conn.send({'ok': False, 'error': traceback.format_exc()})
+    print("--- 常駐程序結束 ---", flush=True)
+
+
+def request(message: dict, address=DEFAULT_ADDRESS) -> dict:
+    from multiprocessing import AuthenticationError
+    from multiprocessing.connection import Client
+    try:
+        conn = Client(address, authkey=_authkey())
+    except AuthenticationError:
+        raise PermissionError("金鑰與常駐程序不符 (FOT_DAEMON_KEY 或金鑰檔不同)") from None
+    with conn:
+        conn.send(message)
+        return conn.recv()
+
+
+# ==========================================
+# 命令列
+# ==========================================
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m cli', description='臺指選擇權回測')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('backtest', help='依設定檔執行回測')
+    p.add_argument('--config', required=True, help='設定檔 (.yaml / .json)')
+    p.add_argument('--no-cache', action='store_true', help='忽略 data.cache_dir 中的回測結果快取')
+    p.add_argument('--output-dir', help='覆寫設定檔的 output.dir')
+    p.add_argument('--daemon', nargs='?', const='', metavar='HOST:PORT',
+                   help=f'交給常駐程序執行 (預設 {DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]})')
+
+    p = sub.add_parser('validate', help='只檢查設定檔 (不載入資料)')
+    p.add_argument('--config', required=True)
+
+    p = sub.add_parser('serve', help='啟動常駐程序，資料留在記憶體供後續回測使用')
+    p.add_argument('--address', default='', metavar='HOST:PORT')
+    p.add_argument('--max-datasets', type=int, default=2, help='記憶體中最多保留幾份資料')
+
+    for name, text in (('status', '查詢常駐程序狀態'), ('stop', '結束常駐程序')):
+        p = sub.add_parser(name, help=text)
+        p.add_argument('--address', default='', metavar='HOST:PORT')
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == 'serve':
+        serve(_parse_address(args.address), args.max_datasets)
+        return 0
+    if args.command in ('status', 'stop'):
+        try:
+            reply = request({'cmd': args.command}, _parse_address(args.address))
+        except (ConnectionError, OSError) as e:
+            print(f"無法連線到常駐程序: {e}", file=sys.stderr)
+            return 1
+        print(json.dumps(reply, ensure_ascii=False))
+        return 0
+
+    try:
+        cfg = validate_config(load_config(args.config))
+    except ConfigError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.command == 'validate':
+        print(f"設定檔正確: {args.config} ({len(cfg['data']['options'])} 個選擇權檔案, "
+              f"{len(cfg['data']['futures'])} 個期貨檔案)")
+        return 0
+
+    if args.output_dir:
+        cfg['output'] = {'dir': os.path.abspath(args.output_dir)}
+    if args.daemon is not None:
+        try:
+            reply = request({'cmd': 'backtest', 'config': cfg, 'use_cache': not args.no_cache},
+                            _parse_address(args.daemon))
+        except (ConnectionError, OSError) as e:
+            print(f"無法連線到常駐程序: {e}", file=sys.stderr)
+            return 1
+        if not reply['ok']:
+            print(reply['error'], file=sys.stderr)
+            return 1
+        summary = reply['summary']
+    else:
+        summary = run_backtest(cfg, use_cache=not args.no_cache)
+    print(format_summary(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
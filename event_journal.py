@@ -0,0 +1,141 @@
+from collections import deque
+from typing import Optional
+
+import pandas as pd
+
+
+# ==========================================
+# 等級與事件類型
+# ==========================================
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+FILL = 'fill'                      # 成交 (建倉 / 平倉)
+SIGNAL = 'signal'                  # 策略發出訊號 (停利、止損、Gamma 避險...)
+MODE_CHANGE = 'mode_change'        # 策略狀態切換 (例如 Wheel 的 PUT <-> CALL)
+MISSING_QUOTE = 'missing_quote'    # 查無報價 (下單失敗、缺資料)
+SOLVER_FAILURE = 'solver_failure'  # IV 解算失敗
+HEDGE = 'hedge'                    # 期貨避險 (Delta 調整、轉倉)
+DATA = 'data'                      # 資料清洗 / 生成器進度
+STRATEGY = 'strategy'              # 策略的一般訊息 (選股過程、持倉狀態)
+ERROR_EVENT = 'error'              # 例外
+
+
+class EventJournal:
+    """
+    回測事件日誌 (取代熱路徑中的 print)
+
+    1. 事件存放在固定容量的環狀緩衝區 (deque)，超過容量時丟棄最舊的事件
+    2. 低於 level 的事件在 log() 第一行就返回；格式化字串只在輸出到 console 或匯出時才進行
+    3. 每筆事件： (date, level, kind, template, fields)，匯出時 message = template.format(date=..., **fields)
+
+    熱路徑中若要組合昂貴的參數，先檢查旗標：
+        if journal.debug_on:
+            journal.debug(STRATEGY, "position {position}", date=date, position=position)
+    """
+    def __init__(self, level: int = INFO, capacity: int = 100_000, console: bool = False):
+        """
+        參數:
+            level (int): 最低記錄等級 (DEBUG / INFO / WARNING / ERROR)
+            capacity (int): 環狀緩衝區容量
+            console (bool): 是否同步 print 到 console (互動式使用，例如 Jupyter)
+        """
+        self.capacity = capacity
+        self.console = console
+        self._events = deque(maxlen=capacity)
+        self.set_level(level)
+
+    def set_level(self, level: int):
+        self.level = level
+        # 預先算好的旗標，熱路徑只需檢查屬性
+        self.debug_on = level <= DEBUG
+        self.info_on = level <= INFO
+
+    # ==========================================
+    # 記錄
+    # ==========================================
+    def log(self, level: int, kind: str, template: str, date=None, **fields):
+        if level < self.level:
+            return
+        self._events.append((date, level, kind, template, fields))
+        if self.console:
+            print(_format(template, date, fields))
+
+    def debug(self, kind, template, date=None, **fields):
+        if self.debug_on:
+            self.log(DEBUG, kind, template, date, **fields)
+
+    def info(self, kind, template, date=None, **fields):
+        if self.info_on:
+            self.log(INFO, kind, template, date, **fields)
+
+    def warning(self, kind, template, date=None, **fields):
+        self.log(WARNING, kind, template, date, **fields)
+
+    def error(self, kind, template, date=None, **fields):
+        self.log(ERROR, kind, template, date, **fields)
+
+    # ==========================================
+    # 匯出
+    # ==========================================
+    def __len__(self):
+        return len(self._events)
+
+    def __bool__(self):
+        # 空日誌仍是有效的日誌 (避免 journal or get_journal() 誤用預設日誌)
+        return True
+
+    def clear(self):
+        self._events.clear()
+
+    def to_frame(self, kind: Optional[str] = None, expand: bool = False) -> pd.DataFrame:
+        """
+        匯出成 DataFrame (date, level, kind, message)
+
+        參數:
+            kind (str): 只取特定類型的事件
+            expand (bool): 是否將事件欄位 (fields) 展開成獨立欄位
+        """
+        events = [e for e in self._events if kind is None or e[2] == kind]
+        frame = pd.DataFrame({
+            'date': [e[0] for e in events],
+            'level': [LEVEL_NAMES.get(e[1], str(e[1])) for e in events],
+            'kind': [e[2] for e in events],
+            'message': [_format(e[3], e[0], e[4]) for e in events],
+        })
+        if expand and events:
+            fields = pd.DataFrame([e[4] for e in events])
+            frame = pd.concat([frame, fields.drop(columns=[c for c in fields.columns if c in frame.columns])], axis=1)
+        return frame
+
+
+def _format(template, date, fields):
+    try:
+        return template.format(date=date, **fields)
+    except (KeyError, IndexError, ValueError, TypeError):
+        return f"{template} {fields}"
+
+
+# ==========================================
+# 預設日誌 (資料清洗等沒有 Executor 的地方使用)
+# ==========================================
+_default_journal = EventJournal()
+
+
+def get_journal() -> EventJournal:
+    return _default_journal
+
+
+def set_journal(journal: EventJournal):
+    """替換預設日誌，例如 Jupyter 中想看到即時輸出：set_journal(EventJournal(console=True))"""
+    global _default_journal
+    _default_journal = journal
+
+
+def new_journal_like(journal: EventJournal) -> EventJournal:
+    """建立與指定日誌相同設定 (等級、容量、console) 的新日誌"""
+    return EventJournal(level=journal.level, capacity=journal.capacity, console=journal.console)
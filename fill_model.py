@@ -0,0 +1,132 @@
+from typing import NamedTuple
+
+import numpy as np
+
+MULTIPLIER = 50  # 臺指選擇權每點 50 元
+
+
+class Fill(NamedTuple):
+    """一張單 (所有腳) 的成交結果 (由 FillModel.fill 回傳)"""
+    prices: np.ndarray      # 每腳成交價，NaN 表示查無報價 (該腳不成交)
+    qty: int                # 實際成交口數 (各腳相同，可能小於委託口數)
+    fees: float             # 手續費 + 交易稅 (元，所有腳合計)
+    settled: bool = False   # 是否以到期結算價成交
+
+
+def txo_tick_size(price) -> np.ndarray:
+    """臺指選擇權升降單位 (向量化)：未滿 10 點 0.1、10~50 點 0.5、50~500 點 1、500~1000 點 5、1000 點以上 10"""
+    price = np.asarray(price, dtype=float)
+    return np.select([price < 10, price < 50, price < 500, price < 1000], [0.1, 0.5, 1.0, 5.0], 10.0)
+
+
+class FillModel:
+    """
+    成交模型：決定一張單每腳的成交價、成交口數與費用
+
+    Executor 建倉/平倉時以 fill() 一次處理整張單的所有腳 (陣列運算，不建立 DataFrame)。
+    預設行為與舊版相同：以收盤價成交、不計費用、不限成交量。
+    """
+    def fill(self, snapshot, rows, sides, qty, expiring=False, closing=False) -> Fill:
+        """
+        參數:
+            snapshot (MarketSnapshot): 當日 (當根 K 棒) 快照
+            rows (ndarray[int]): 每腳在快照中的列位置 (MarketSnapshot.locate，查無為 -1)
+            sides (ndarray[float]): 這次下單每腳的方向，買進 +1、賣出 -1
+            qty (int): 委託口數
+            expiring (bool): 當日是否為該合約的最後結算日
+            closing (bool): 是否為平倉單 (平倉不受成交量限制，避免流動性不足時出不了場)
+        """
+        return Fill(snapshot.take('close', rows), qty, 0.0)
+
+    def __repr__(self):
+        # 回測結果快取 (optimization.BacktestRunner) 以 repr 區分不同的成交設定
+        return f"{type(self).__name__}()"
+
+
+class TaifexFillModel(FillModel):
+    """
+    臺指選擇權 (TXO) 的成交與交易成本模型
+
+    參數:
+        commission (float): 每口每腳手續費 (元，含期交所規費)
+        tax_rate (float): 交易稅率，權利金金額的千分之一
+        settle_tax_rate (float): 到期履約的交易稅率，價內腳履約價金的十萬分之二
+        slippage (str):
+            'quote'    : 買進以最後最佳賣價、賣出以最後最佳買價成交 (缺報價時改用價差估計)
+            'estimate' : 一律以收盤價加減半個估計價差成交
+            'none'     : 以收盤價成交
+        spread_ticks (float): 估計價差為 spread_ticks 個升降單位 (成交價偏離收盤價半個價差)
+        volume_cap (float): 建倉單最多成交當日成交量的比例 (None 不限制)
+        oi_cap (float): 建倉單最多成交未沖銷契約數的比例 (None 不限制)
+        close_penalty_ticks (float): 平倉單超出上述上限的口數，每口多付的升降單位 (平倉一律全部成交，
+                                     超量部分以較差的價格計入各腳的平均成交價)
+        settle_on_expiry (bool): 最後結算日以結算價成交 (不計滑價與交易稅、不受成交量限制)
+    """
+    def __init__(self, commission: float = 25.0, tax_rate: float = 0.001, settle_tax_rate: float = 0.00002,
+                 slippage: str = 'quote', spread_ticks: float = 2.0, volume_cap=0.1, oi_cap=None,
+                 settle_on_expiry: bool = True, close_penalty_ticks: float = 2.0):
+        if slippage not in ('quote', 'estimate', 'none'):
+            raise ValueError(f"未知的 slippage: {slippage}")
+        self.commission = commission
+        self.tax_rate = tax_rate
+        self.settle_tax_rate = settle_tax_rate
+        self.slippage = slippage
+        self.spread_ticks = spread_ticks
+        self.volume_cap = volume_cap
+        self.oi_cap = oi_cap
+        self.settle_on_expiry = settle_on_expiry
+        self.close_penalty_ticks = close_penalty_ticks
+
+    def __repr__(self):
+        return (f"TaifexFillModel(commission={self.commission}, tax_rate={self.tax_rate}, "
+                f"settle_tax_rate={self.settle_tax_rate}, slippage={self.slippage!r}, "
+                f"spread_ticks={self.spread_ticks}, volume_cap={self.volume_cap}, oi_cap={self.oi_cap}, "
+                f"settle_on_expiry={self.settle_on_expiry}, "
+                f"close_penalty_ticks={self.close_penalty_ticks})")
+
+    def fill(self, snapshot, rows, sides, qty, expiring=False, closing=False) -> Fill:
+        rows = np.asarray(rows)
+        sides = np.asarray(sides, dtype=float)
+        close = snapshot.take('close', rows)
+
+        if expiring and self.settle_on_expiry:
+            # 最後結算：結算價即履約價值，只有價內腳 (結算價 > 0) 課履約稅
+            price = snapshot.take('settle', rows)
+            price = np.where(np.isfinite(price), price, close)
+            filled = np.isfinite(price)
+            exercised = filled & (price > 0)
+            strike = snapshot.take('strike', rows)
+            fees = qty * (self.commission * filled.sum() +
+                          self.settle_tax_rate * MULTIPLIER * strike[exercised].sum())
+            return Fill(price, qty, float(fees), True)
+
+        if self.slippage == 'none':
+            price = close
+        else:
+            half_spread = self.spread_ticks / 2 * txo_tick_size(close)
+            price = np.maximum(close + sides * half_spread, 0.0)
+            if self.slippage == 'quote':
+                bid, ask = snapshot.take('bid', rows), snapshot.take('ask', rows)
+                quoted = np.where(sides > 0, ask, bid)
+                usable = np.isfinite(quoted) & (quoted > 0) & ~(bid > ask)
+                price = np.where(usable, quoted, price)
+        filled = np.isfinite(price)
+
+        # 參與率上限：以各腳可成交口數的最小值成交 (價差單各腳口數一致)；平倉單超量部分改為加價成交
+        n = qty
+        for name, ratio in (('volume', self.volume_cap), ('oi', self.oi_cap)):
+            if ratio is None:
+                continue
+            cap = np.floor(snapshot.take(name, rows)[filled] * ratio)
+            cap = cap[np.isfinite(cap)]
+            if cap.size:
+                n = min(n, int(cap.min()))
+        n = max(n, 0)
+        if closing and n < qty:
+            # 平倉不限量：超出上限的口數多付 close_penalty_ticks 個升降單位，攤入各腳的平均成交價
+            excess = (qty - n) / qty
+            price = np.maximum(price + sides * self.close_penalty_ticks * txo_tick_size(price) * excess, 0.0)
+            n = qty
+
+        fees = n * (self.commission * filled.sum() + self.tax_rate * MULTIPLIER * price[filled].sum())
+        return Fill(price, n, float(fees))
@@ -0,0 +1,294 @@
+import math
+import os
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import py_lets_be_rational as lj
+
+from utils import (OptionDataIndex, near_month_spot, implied_volatility_array, bs_greeks_array,
+                   build_market_snapshot)
+from profiling import StageProfiler
+
+DEFAULT_GRID_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'future_option_trader', 'black76_grid.npz')
+
+_LOG_FLOOR = -700.0  # 常態化價格低於 e^-700 視為 0 (該格不可信，一律改用精確解)
+
+
+class Black76Grid:
+    """
+    Black-76 常態化價格查表 (IV 反推用)
+
+    以價外選擇權的常態化價格 b = 價外權利金 / sqrt(F K) 建表，只與兩個座標有關：
+        a = |ln(F / K)|   (log-moneyness 絕對值；價內選擇權以買賣權平價換成價外)
+        w = sigma * sqrt(T) (總變異數的平方根)
+    表格存 ln b，a 為等距格點，w 取對數等距格點。反推時先在 a 方向線性內插出
+    ln b 對 w 的單調曲線，再以二分搜尋找到所在格子並線性內插出 w。
+
+    error[i, j] 為每個格子中點的反推誤差 (w 單位)，查表時換算成 IV 誤差
+    (error / sqrt(T)) 與容許誤差比較，超過者改用精確解。
+    """
+    def __init__(self, a_max: float = 1.0, na: int = 1001, w_min: float = 1e-3, w_max: float = 2.0,
+                 nw: int = 600):
+        self.spec = np.array([a_max, na, w_min, w_max, nw], dtype=float)
+        self.a_max = a_max
+        self.na = int(na)
+        self.nw = int(nw)
+        self.da = a_max / (self.na - 1)
+        self.u0 = math.log(w_min)
+        self.du = (math.log(w_max) - self.u0) / (self.nw - 1)
+        self.log_b = None
+        self.error = None
+
+    # ==========================================
+    # 建表 (只做一次，結果存檔)
+    # ==========================================
+    def build(self) -> 'Black76Grid':
+        a = np.arange(self.na) * self.da
+        w = np.exp(self.u0 + np.arange(self.nw) * self.du)
+        self.log_b = _exact_log_b(*np.meshgrid(a, w, indexing='ij'))
+
+        # 格子中點的反推誤差；角落有價格為 0 的格子不可信
+        a_mid = (a[:-1] + self.da / 2)[:, None] * np.ones(self.nw - 1)
+        w_mid = np.ones(self.na - 1)[:, None] * np.exp(self.u0 + (np.arange(self.nw - 1) + 0.5) * self.du)
+        w_est, inside = self._lookup(a_mid.ravel(), _exact_log_b(a_mid, w_mid).ravel())
+        error = np.where(inside, np.abs(w_est - w_mid.ravel()), np.inf).reshape(self.na - 1, self.nw - 1)
+        floor = self.log_b <= _LOG_FLOOR
+        bad = floor[:-1, :-1] | floor[1:, :-1] | floor[:-1, 1:] | floor[1:, 1:]
+        self.error = np.where(bad, np.inf, error)
+        return self
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, spec=self.spec, log_b=self.log_b, error=self.error)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_build(cls, path: Optional[str] = DEFAULT_GRID_PATH, **spec) -> 'Black76Grid':
+        """讀取磁碟上的表格；不存在或格點設定不同時重新建表並存檔 (path=None 則只建在記憶體)"""
+        grid = cls(**spec)
+        if path and os.path.exists(path):
+            with np.load(path) as data:
+                if np.array_equal(data['spec'], grid.spec):
+                    grid.log_b, grid.error = data['log_b'], data['error']
+                    return grid
+        grid.build()
+        if path:
+            grid.save(path)
+        return grid
+
+    # ==========================================
+    # 查表
+    # ==========================================
+    def _lookup(self, a, log_b):
+        """
+        向量化反推 w
+        回傳:
+            (w, inside): inside 為 False 表示超出表格範圍 (w 無意義)
+        """
+        n = len(a)
+        pos = np.clip(a / self.da, 0, self.na - 1 - 1e-12)
+        i = pos.astype(np.int64)
+        fa = pos - i
+        table = self.log_b
+
+        def curve(j):
+            return (1 - fa) * table[i, j] + fa * table[i + 1, j]
+
+        lo = np.zeros(n, dtype=np.int64)
+        hi = np.full(n, self.nw - 1, dtype=np.int64)
+        inside = (a <= self.a_max) & (curve(lo) < log_b) & (log_b <= curve(hi)) & np.isfinite(log_b)
+        while True:
+            active = hi - lo > 1
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            below = curve(mid) < log_b
+            lo = np.where(active & below, mid, lo)
+            hi = np.where(active & ~below, mid, hi)
+        c0, c1 = curve(lo), curve(hi)
+        with np.errstate(all='ignore'):
+            frac = np.clip((log_b - c0) / (c1 - c0), 0, 1)
+        return np.exp(self.u0 + (lo + frac) * self.du), inside
+
+    def implied_w(self, a, log_b):
+        """
+        回傳:
+            (w, w_error): w_error 為所在格子的反推誤差，超出表格為 inf
+        """
+        w, inside = self._lookup(a, log_b)
+        pos = np.clip(a / self.da, 0, self.na - 2)
+        i = pos.astype(np.int64)
+        j = np.clip(((np.log(np.maximum(w, 1e-300)) - self.u0) / self.du).astype(np.int64), 0, self.nw - 2)
+        w_error = np.where(inside, self.error[i, j], np.inf)
+        return w, w_error
+
+
+def _exact_log_b(a, w):
+    """價外選擇權常態化價格的對數 (py_lets_be_rational，建表用)"""
+    b = np.frompyfunc(lj.normalised_black, 3, 1)(-np.asarray(a, float), np.asarray(w, float), 1.0).astype(float)
+    with np.errstate(divide='ignore'):
+        return np.maximum(np.log(b), _LOG_FLOOR)
+
+
+class ApproxGreeks:
+    """
+    近似 IV/Greeks 模式 (參數掃描與篩選用)
+
+    IV 以 Black76Grid 查表反推，誤差超過 max_error 或超出表格的列自動改用精確解
+    (implied_volatility_array)；Greeks 的常態分配 CDF 改用等距查表 + 線性內插。
+    傳給 get_greeks / market_data_generator / BacktestExecutor 的 approx_greeks 參數即可啟用。
+
+    max_error 只限制 IV 的誤差。Greeks 的誤差 = IV 誤差 x Greeks 對 IV 的敏感度，
+    到期前 (dT 很小) 與 sigma * sqrt(T) 很小時敏感度急遽放大 (例如結算日的 Theta 可達 -1e7)，
+    因此 dT < min_dT 或 sigma * sqrt(T) < min_w 的列也改用精確解。
+    各 Greeks 的實際誤差 (絕對與相對) 請以 validate_approx_greeks 確認。
+
+    參數:
+        max_error (float): IV 容許誤差 (例如 5e-4 = 0.05 個百分點)
+        min_dT (float): 剩餘年數低於此值改用精確解 (預設 1 天)
+        min_w (float): sigma * sqrt(T) 低於此值改用精確解
+        path (str): 表格的磁碟快取 (None 則不存檔)
+        grid_spec: Black76Grid 的格點設定
+    """
+    def __init__(self, max_error: float = 5e-4, min_dT: float = 1 / 365, min_w: float = 0.01,
+                 path: Optional[str] = DEFAULT_GRID_PATH, **grid_spec):
+        self.max_error = max_error
+        self.min_dT = min_dT
+        self.min_w = min_w
+        self.path = path
+        self.grid_spec = grid_spec
+        self._grid = None
+        self._cdf_x = None
+        self._cdf_y = None
+
+    def __repr__(self):
+        return (f"ApproxGreeks(max_error={self.max_error}, min_dT={self.min_dT}, min_w={self.min_w}, "
+                f"grid_spec={self.grid_spec})")
+
+    def __getstate__(self):
+        # 跨行程傳遞時不帶表格，由背景行程自行從磁碟載入
+        state = self.__dict__.copy()
+        if self.path:
+            state['_grid'] = None
+        return state
+
+    @property
+    def grid(self) -> Black76Grid:
+        if self._grid is None:
+            self._grid = Black76Grid.load_or_build(self.path, **self.grid_spec)
+        return self._grid
+
+    def norm_cdf(self, x) -> np.ndarray:
+        """標準常態 CDF 查表 (步長 5e-4，誤差約 1e-8)"""
+        if self._cdf_x is None:
+            self._cdf_x = np.linspace(-10.0, 10.0, 40_001)
+            self._cdf_y = np.frompyfunc(lj.norm_cdf, 1, 1)(self._cdf_x).astype(float)
+        return np.interp(np.asarray(x, dtype=float), self._cdf_x, self._cdf_y)
+
+    def implied_volatility(self, price, K, T, S, R, flag, return_stats=False):
+        """
+        與 implied_volatility_array 相同的輸入與輸出 (無解為 0)
+
+        回傳:
+            ndarray: IV
+            (iv, n_fail, n_fallback): 當 return_stats=True，n_fallback 為改用精確解的筆數
+        """
+        price = np.asarray(price, dtype=float)
+        K = np.asarray(K, dtype=float)
+        T = np.asarray(T, dtype=float)
+        flag = np.asarray(flag, dtype=float)
+        iv = np.zeros(len(price))
+
+        with np.errstate(all='ignore'):
+            F = S * np.exp(R * T)
+            intrinsic = np.maximum(flag * (F - K), 0.0)
+            valid = (price > 0) & (T > 0) & (K > 0) & (price > intrinsic)
+            rows = np.flatnonzero(valid)
+            # 價內選擇權以平價關係換成同履約價的價外選擇權 (時間價值相同)
+            b = (price[rows] - intrinsic[rows]) / np.sqrt(F[rows] * K[rows])
+            a = np.abs(np.log(F[rows] / K[rows]))
+            w, w_error = self.grid.implied_w(a, np.log(b))
+            sqrt_T = np.sqrt(T[rows])
+            # IV 誤差超過上限，或 Greeks 對 IV 過於敏感 (接近到期、總變異數很小) 的列改用精確解
+            ok = (w_error / sqrt_T <= self.max_error) & (T[rows] >= self.min_dT) & (w >= self.min_w)
+        iv[rows[ok]] = w[ok] / sqrt_T[ok]
+
+        fallback = rows[~ok]
+        n_fail = 0
+        if len(fallback):
+            iv[fallback], n_fail = implied_volatility_array(price[fallback], K[fallback], T[fallback], S, R,
+                                                            flag[fallback], return_failures=True)
+        if return_stats:
+            return iv, n_fail, len(fallback)
+        return iv
+
+    def greeks(self, K, T, sigma, S, R, is_call):
+        """與 bs_greeks_array 相同，常態 CDF 改用查表"""
+        return bs_greeks_array(K, T, sigma, S, R, is_call, cdf=self.norm_cdf)
+
+
+# ==========================================
+# 驗證報告 (近似 vs 精確)
+# ==========================================
+def validate_approx_greeks(df_opt, df_fut, approx: Optional[ApproxGreeks] = None, dates=None, n_days: int = 20,
+                           risk_free_rate: float = 0.01, seed: int = 0) -> pd.DataFrame:
+    """
+    抽樣交易日，比較近似模式與精確解的 IV / Greeks
+
+    參數:
+        dates (list): 指定交易日 (None 則隨機抽 n_days 天)
+    回傳:
+        DataFrame: 每個欄位的絕對誤差分位數 (p50 ~ max) 與相對誤差分位數 (rel_p50 ~ rel_max，
+                   |近似 - 精確| / |精確|，精確值為 0 的列不計)，index 為欄位；attrs 內含耗時、改用精確解的比例
+    """
+    approx = approx or ApproxGreeks()
+    approx.grid  # 建表 / 載入不計入耗時
+    opt_index = OptionDataIndex(df_opt)
+    spot = near_month_spot(df_fut)
+    candidates = [d for d in opt_index.dates if d in spot]
+    if dates is None:
+        rng = np.random.default_rng(seed)
+        dates = sorted(rng.choice(candidates, size=min(n_days, len(candidates)), replace=False))
+
+    fields = ('iv', 'delta', 'gamma', 'theta', 'vega', 'itm_prob')
+    errors = {name: [] for name in fields}
+    relative = {name: [] for name in fields}
+    elapsed = {'exact': 0.0, 'approx': 0.0}
+    n_rows = 0
+    profiler = StageProfiler(enabled=True)
+    for date in dates:
+        date = pd.Timestamp(date)
+        t = time.perf_counter()
+        exact = build_market_snapshot(opt_index, date, spot[date], risk_free_rate)
+        elapsed['exact'] += time.perf_counter() - t
+        t = time.perf_counter()
+        fast = build_market_snapshot(opt_index, date, spot[date], risk_free_rate, profiler, approx_greeks=approx)
+        elapsed['approx'] += time.perf_counter() - t
+        if exact is None:
+            continue
+        priced = exact.column('iv') > 0
+        n_rows += int(priced.sum())
+        for name in fields:
+            diff = np.abs(fast.column(name) - exact.column(name))[priced]
+            scale = np.abs(exact.column(name))[priced]
+            errors[name].append(diff)
+            relative[name].append(diff[scale > 0] / scale[scale > 0])
+    n_fallback = profiler.counters['iv_fallback']
+
+    def quantiles(parts):
+        values = np.concatenate(parts) if parts else np.zeros(0)
+        return np.percentile(values, [50, 90, 99, 100]) if values.size else np.full(4, np.nan)
+
+    report = pd.DataFrame({name: np.concatenate([quantiles(errors[name]), quantiles(relative[name])])
+                           for name in fields},
+                          index=['p50', 'p90', 'p99', 'max', 'rel_p50', 'rel_p90', 'rel_p99', 'rel_max']).T
+    report.attrs.update({
+        'days': len(dates), 'rows': n_rows, 'max_error': approx.max_error,
+        'fallback_rate': n_fallback / n_rows if n_rows else 0.0,
+        'exact_seconds': elapsed['exact'], 'approx_seconds': elapsed['approx'],
+        'speedup': elapsed['exact'] / elapsed['approx'] if elapsed['approx'] else np.nan,
+    })
+    return report
@@ -0,0 +1,262 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+MULTIPLIER = 50  # 臺指選擇權每點 50 元
+
+PANEL_FIELDS = ('close', 'settle', 'iv', 'delta', 'gamma', 'theta', 'vega')
+
+
+class GreeksPanel:
+    """
+    以合約為主的 Greeks 面板：每檔合約只保存存續期間 (第一次到最後一次有報價的交易日) 的序列
+
+    逐日快照 (MarketSnapshot) 適合「某一天的整條報價鏈」，面板則適合
+    「某一檔合約在持有期間的 IV / Delta / 價格走勢」：
+        row = panel.contract_ids[(expiry, strike, 'put')]   # dict 查詢 O(1)
+        panel.series(expiry, strike, 'put', 'delta')         # 存續期間的序列 (view，不複製)
+    存續期間內當日沒有報價的格子為 NaN。
+
+    每個欄位是一個一維陣列，所有合約的存續期間依序串接：第 i 檔合約為
+        fields[name][offset[i]:offset[i] + length[i]]，對應 dates[first_day[i]:first_day[i] + length[i]]
+    週選只存續約一週、月選數個月，記憶體約為 [合約數 x 交易日數] 密集陣列的數十分之一。
+
+    參數:
+        dates (DatetimeIndex): 交易日
+        keys (list): 每檔合約的 (到期月份, 履約價, 'call'/'put')
+        fields (dict): 欄位名稱 -> 串接後的一維陣列 (長度為 length 的總和)
+        first_day (ndarray[int]): 每檔合約第一個交易日在 dates 中的位置
+        length (ndarray[int]): 每檔合約存續的交易日數
+        S (ndarray): 每日標的價格
+    """
+    def __init__(self, dates, keys, fields: Dict[str, np.ndarray], first_day: np.ndarray, length: np.ndarray,
+                 S: np.ndarray):
+        self.dates = pd.DatetimeIndex(dates)
+        self.keys = list(keys)
+        self.contract_ids = {key: i for i, key in enumerate(self.keys)}
+        self.fields = fields
+        self.first_day = np.asarray(first_day, dtype=np.int64)
+        self.length = np.asarray(length, dtype=np.int64)
+        self.offset = np.concatenate(([0], np.cumsum(self.length)[:-1])).astype(np.int64)
+        self.S = np.asarray(S, dtype=float)
+        self._day_index = {d: i for i, d in enumerate(self.dates)}
+
+    @classmethod
+    def from_snapshots(cls, snapshots: Iterable, fields: Tuple[str, ...] = PANEL_FIELDS,
+                       dtype=np.float32) -> 'GreeksPanel':
+        """
+        由快照序列 (market_data_generator / SnapshotCache 的輸出) 建立面板
+
+        所有交易日的列先串接，再以 np.unique 一次編出合約代號與存續期間並填入串接陣列，
+        不逐列操作 dict。同一天重複的合約保留第一筆 (與 MarketSnapshot.quote 相同)。
+        """
+        dates, spots = [], []
+        expiry_parts, strike_parts, call_parts, day_parts = [], [], [], []
+        value_parts = {name: [] for name in fields}
+        for day, snapshot in enumerate(snapshots):
+            expiry, is_call = snapshot.contract_keys()
+            dates.append(snapshot.date)
+            spots.append(snapshot.S)
+            expiry_parts.append(np.asarray(expiry, dtype=str))
+            strike_parts.append(snapshot.column('strike'))
+            call_parts.append(is_call)
+            day_parts.append(np.full(len(is_call), day, dtype=np.int64))
+            for name in fields:
+                value_parts[name].append(snapshot.column(name))
+
+        if not dates:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls([], [], {name: np.zeros(0, dtype=dtype) for name in fields}, empty, empty, np.zeros(0))
+        expiry = np.concatenate(expiry_parts)
+        strike = np.concatenate(strike_parts)
+        is_call = np.concatenate(call_parts)
+        day = np.concatenate(day_parts)
+
+        # 合約代號：(到期月份, 履約價, 買賣權) 的唯一組合
+        uniq_expiry, expiry_code = np.unique(expiry, return_inverse=True)
+        uniq_strike, strike_code = np.unique(strike, return_inverse=True)
+        code = (expiry_code * len(uniq_strike) + strike_code) * 2 + is_call
+        uniq_code, contract = np.unique(code, return_inverse=True)
+        keys = [(str(uniq_expiry[c // 2 // len(uniq_strike)]), float(uniq_strike[c // 2 % len(uniq_strike)]),
+                 'call' if c % 2 else 'put') for c in uniq_code.tolist()]
+
+        # 同一 (合約, 日) 只保留第一筆；np.unique 依 (合約, 日) 排序，每檔合約的第一筆 / 最後一筆即存續期間
+        _, first = np.unique(contract * len(dates) + day, return_index=True)
+        contract, day = contract[first], day[first]
+        starts = np.flatnonzero(np.r_[True, contract[1:] != contract[:-1]])
+        ends = np.r_[starts[1:], len(contract)] - 1
+        first_day = day[starts]
+        length = day[ends] - first_day + 1
+        offset = np.concatenate(([0], np.cumsum(length)[:-1]))
+        pos = offset[contract] + day - first_day[contract]
+
+        panel_fields = {}
+        for name in fields:
+            values = np.full(int(length.sum()), np.nan, dtype=dtype)
+            values[pos] = np.concatenate(value_parts[name])[first]
+            panel_fields[name] = values
+        return cls(dates, keys, panel_fields, first_day, length, np.asarray(spots))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return (f"GreeksPanel({len(self.keys)} contracts x {len(self.dates)} days, {int(self.length.sum())} cells, "
+                f"fields={list(self.fields)})")
+
+    @property
+    def nbytes(self) -> int:
+        """各欄位陣列佔用的位元組數"""
+        return sum(values.nbytes for values in self.fields.values())
+
+    # ==========================================
+    # 查詢
+    # ==========================================
+    def row(self, expiry: str, strike: float, opt_type: str) -> int:
+        """合約所在的列，查無回傳 -1"""
+        return self.contract_ids.get((str(expiry), float(strike), opt_type), -1)
+
+    def day(self, date) -> int:
+        """交易日所在的欄，查無回傳 -1"""
+        return self._day_index.get(pd.Timestamp(date), -1)
+
+    def _span(self, i: int, until=None) -> Tuple[int, int, int]:
+        """第 i 檔合約的 (第一個交易日的位置, 串接陣列中的起點, 交易日數)，until 截斷到該日 (含)"""
+        first, n = int(self.first_day[i]), int(self.length[i])
+        if until is not None:
+            n = min(n, max(0, int(self.dates.searchsorted(pd.Timestamp(until), side='right')) - first))
+        return first, int(self.offset[i]), n
+
+    def dates_of(self, expiry: str, strike: float, opt_type: str, until=None) -> Optional[pd.DatetimeIndex]:
+        """合約存續期間的交易日 (與 series() 對齊)，查無合約回傳 None"""
+        i = self.row(expiry, strike, opt_type)
+        if i < 0:
+            return None
+        first, _, n = self._span(i, until)
+        return self.dates[first:first + n]
+
+    def series(self, expiry: str, strike: float, opt_type: str, field: str = 'close',
+               until=None) -> Optional[np.ndarray]:
+        """
+        單一合約單一欄位在存續期間的序列 (view，日期為 dates_of())，查無合約回傳 None
+
+        until: 只取到該日 (含) 為止，策略在 on_bar 中使用時傳入當日日期以避免看到未來資料
+        """
+        i = self.row(expiry, strike, opt_type)
+        if i < 0:
+            return None
+        _, start, n = self._span(i, until)
+        return self.fields[field][start:start + n]
+
+    def frame(self, expiry: str, strike: float, opt_type: str, until=None) -> Optional[pd.DataFrame]:
+        """單一合約存續期間所有欄位的序列 (index 為交易日期，含標的價格 S)"""
+        i = self.row(expiry, strike, opt_type)
+        if i < 0:
+            return None
+        first, start, n = self._span(i, until)
+        data = {'S': self.S[first:first + n], **{name: values[start:start + n] for name, values in self.fields.items()}}
+        return pd.DataFrame(data, index=self.dates[first:first + n])
+
+    def dense(self, field: str, rows) -> np.ndarray:
+        """
+        指定合約 (列號，-1 表示查無) 的欄位展開成 [len(rows), 交易日數] 的 float64 陣列，存續期間外為 NaN
+        (一次以陣列索引填入，不逐列迴圈)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.full((len(rows), len(self.dates)), np.nan)
+        found = rows >= 0
+        lengths = np.where(found, self.length[np.where(found, rows, 0)], 0)
+        if not lengths.sum():
+            return out
+        leg = np.repeat(np.arange(len(rows)), lengths)
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        safe = np.where(found, rows, 0)
+        out[leg, np.repeat(self.first_day[safe], lengths) + within] = \
+            self.fields[field][np.repeat(self.offset[safe], lengths) + within]
+        return out
+
+    # ==========================================
+    # 損益歸因 (Greeks 泰勒展開，所有腳一次計算)
+    # ==========================================
+    def attribute(self, legs: pd.DataFrame) -> pd.DataFrame:
+        """
+        持有期間逐日的損益歸因：
+            delta = Δ(t-1) * dS, gamma = 0.5 * Γ(t-1) * dS^2,
+            theta = Θ(t-1) * 經過天數 / 365, vega = Vega(t-1) * dIV,
+            total = (平倉價 - 建倉價) * 方向 * 口數 * 50 (實際成交價，含結算與內含價值平倉)
+            residual = total - 以上四項 (高階項、IV 解算失敗、缺報價、成交價與收盤價的差異等)
+        持有期間內缺報價或 IV 解算失敗的日子沿用前一日的 Greeks。
+
+        參數:
+            legs (DataFrame): trade_legs(history) 的輸出，每腳一列 (需含 contract, side, type, strike, qty,
+                              entry_date, exit_date, entry_price, exit_price)
+        回傳:
+            DataFrame: 每腳一列 (與 legs 同 index)，欄位 delta, gamma, theta, vega, residual, total (元)
+        """
+        columns = ['delta', 'gamma', 'theta', 'vega', 'residual', 'total']
+        if not len(legs):
+            return pd.DataFrame(columns=columns, dtype=float)
+        rows = np.array([self.row(e, k, t) for e, k, t in zip(legs['contract'], legs['strike'], legs['type'])])
+        entry = self.dates.searchsorted(pd.to_datetime(legs['entry_date']).to_numpy(), side='left')
+        exit_ = self.dates.searchsorted(pd.to_datetime(legs['exit_date']).to_numpy(), side='right') - 1
+        found = rows >= 0
+
+        solved = self.dense('iv', rows) > 0
+
+        def take(name):
+            # IV 解算失敗 (Greeks 為 0) 的日子與缺報價同樣視為缺值
+            return _ffill(np.where(solved, self.dense(name, rows), np.nan))
+
+        iv = take('iv')
+        delta, gamma, theta, vega = take('delta'), take('gamma'), take('theta'), take('vega')
+        dS = np.diff(self.S)[None, :]
+        dt = (np.diff(self.dates.values).astype('timedelta64[D]').astype(float) / 365.0)[None, :]
+
+        # 第 t 欄為 t-1 -> t 的變動，只計入持有期間 (entry, exit]
+        t = np.arange(1, len(self.dates))[None, :]
+        held = (t > entry[:, None]) & (t <= exit_[:, None]) & found[:, None]
+        parts = {
+            'delta': delta[:, :-1] * dS,
+            'gamma': 0.5 * gamma[:, :-1] * dS ** 2,
+            'theta': theta[:, :-1] * dt,
+            'vega': vega[:, :-1] * np.diff(iv, axis=1),
+        }
+        scale = np.where(legs['side'].to_numpy() == 'sell', -1.0, 1.0) * legs['qty'].to_numpy(float) * MULTIPLIER
+        out = {name: np.nansum(np.where(held, values, 0.0), axis=1) * scale for name, values in parts.items()}
+        out['total'] = (legs['exit_price'].to_numpy(float) - legs['entry_price'].to_numpy(float)) * scale
+        out['residual'] = out['total'] - out['delta'] - out['gamma'] - out['theta'] - out['vega']
+        return pd.DataFrame(out, index=legs.index)[columns]
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """沿交易日方向以前值補 NaN (向量化)"""
+    valid = ~np.isnan(values)
+    idx = np.where(valid, np.arange(values.shape[1])[None, :], 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return values[np.arange(values.shape[0])[:, None], idx]
+
+
+def trade_legs(history: pd.DataFrame) -> pd.DataFrame:
+    """
+    將回測紀錄 (BacktestExecutor.run() 的輸出) 展開成每腳一列
+    欄位: trade (history 的列號), contract, side, type, strike, qty, entry_date, exit_date, entry_price, exit_price
+    """
+    records = []
+    for trade, row in enumerate(history.itertuples(index=False)):
+        for leg in row.legs:
+            records.append({'trade': trade, 'contract': row.contract, 'side': leg['side'], 'type': leg['type'],
+                            'strike': float(leg['strike']), 'qty': row.qty, 'entry_date': row.entry_date,
+                            'exit_date': row.exit_date, 'entry_price': leg['entry_price'],
+                            'exit_price': leg['exit_price']})
+    return pd.DataFrame(records, columns=['trade', 'contract', 'side', 'type', 'strike', 'qty', 'entry_date',
+                                          'exit_date', 'entry_price', 'exit_price'])
+
+
+def attribute_trades(panel: GreeksPanel, history: pd.DataFrame) -> pd.DataFrame:
+    """每筆交易的損益歸因 (各腳加總)，並附上實際損益 pnl 供對照"""
+    legs = trade_legs(history)
+    parts = panel.attribute(legs)
+    by_trade = parts.groupby(legs['trade']).sum()
+    by_trade['pnl'] = history['pnl'].to_numpy()[by_trade.index]
+    return by_trade
@@ -0,0 +1,244 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from utils import FUTURES_MULTIPLIER, get_expiry_date_cached
+
+OPTION_MULTIPLIER = 50  # 臺指選擇權每點 50 元 (= 1 口小台)
+
+
+# ==========================================
+# 期貨報價表
+# ==========================================
+class FuturesPriceTable:
+    """
+    每日各到期月份的期貨價格 (開盤價 > 收盤價 > 結算價，與 near_month_spot 的 S 規則相同)
+
+    只保留月份合約 (YYYYMM)。一次建表後以 dict 查詢，避險時不再掃描 DataFrame。
+    """
+    def __init__(self, df_fut: pd.DataFrame):
+        months = df_fut['到期月份(週別)'].astype(str).str.strip()
+        df = df_fut.assign(_month=months)[months.str.fullmatch(r'\d{6}')]
+        df = df.sort_values(by=['交易日期', '_month'], kind='mergesort')
+
+        price = df['開盤價'].to_numpy(dtype=float)
+        for col in ('收盤價', '結算價'):
+            bad = np.isnan(price) | (price <= 0)
+            price = np.where(bad, df[col].to_numpy(dtype=float), price)
+        valid = ~(np.isnan(price) | (price <= 0))
+
+        self.prices: Dict[tuple, float] = {}
+        self.contracts: Dict[pd.Timestamp, List[str]] = {}
+        for d, month, p in zip(df['交易日期'].to_numpy()[valid], df['_month'].to_numpy()[valid], price[valid]):
+            day = pd.Timestamp(d)
+            if (day, month) in self.prices:
+                continue
+            self.prices[(day, month)] = float(p)
+            self.contracts.setdefault(day, []).append(month)
+
+    def price(self, date, contract: str) -> float:
+        """指定日、指定月份的價格，查無為 NaN"""
+        return self.prices.get((pd.Timestamp(date).normalize(), contract), np.nan)
+
+    def front(self, date) -> str:
+        """當日最近月合約 (即 snapshot.S 所使用的合約)，查無為 None"""
+        months = self.contracts.get(pd.Timestamp(date).normalize())
+        return months[0] if months else None
+
+    def hedge_contract(self, date) -> str:
+        """當日用來避險的合約：尚未到期 (最後結算日在當日之後) 的最近月，查無為 None"""
+        day = pd.Timestamp(date).normalize()
+        months = self.contracts.get(day, [])
+        for month in months:
+            if pd.Timestamp(get_expiry_date_cached(month)).normalize() > day:
+                return month
+        return months[-1] if months else None
+
+
+# ==========================================
+# 避險口數 (向量化)
+# ==========================================
+def hedge_quantity(delta, band: float, lot_delta: float = 1.0, to: str = 'center') -> np.ndarray:
+    """
+    將組合 Delta 調回區間內所需的期貨口數 (可一次傳入多個組合 / 多根 K 棒)
+
+    參數:
+        delta (array): 組合 Delta (小台口數當量，1 = 指數每漲 1 點賺 50 元)
+        band (float): 容許區間 ±band，區間內不調整
+        lot_delta (float): 每口避險期貨的 Delta (小台 1、大台 4)
+        to (str): 'center' 調回 0；'edge' 只調回最近的區間邊界 (交易較少)
+    回傳:
+        ndarray[int]: 買進為正、賣出為負的口數
+    """
+    if to not in ('center', 'edge'):
+        raise ValueError(f"未知的 to: {to}")
+    delta = np.asarray(delta, dtype=float)
+    target = np.clip(delta, -band, band) if to == 'edge' else np.zeros_like(delta)
+    need = np.where(np.abs(delta) > band, target - delta, 0.0) / lot_delta
+    return np.rint(need).astype(np.int64)  # 四捨五入到整口
+
+
+def option_leg_deltas(snapshot, positions) -> np.ndarray:
+    """
+    所有持倉所有腳的 Delta (小台口數當量)，一次查價、一次計算
+
+    參數:
+        positions (list): PositionBook.current_position 格式的持倉 (含 contract, legs, qty)
+    回傳:
+        ndarray: 每腳的 Delta x 方向 x 口數 (依 positions / legs 的順序攤平)
+    """
+    rows, strikes, is_call, scale = [], [], [], []
+    for pos in positions:
+        legs = pos['legs']
+        rows.append(snapshot.locate(pos['contract'], [leg['strike'] for leg in legs],
+                                    [leg['type'] for leg in legs]))
+        strikes.extend(leg['strike'] for leg in legs)
+        is_call.extend(leg['type'] == 'call' for leg in legs)
+        scale.extend((1.0 if leg['side'] == 'buy' else -1.0) * pos['qty'] for leg in legs)
+    if not strikes:
+        return np.zeros(0)
+    rows = np.concatenate(rows)
+    strikes = np.asarray(strikes, dtype=float)
+    is_call = np.asarray(is_call)
+
+    delta = snapshot.take('delta', rows)
+    solved = snapshot.take('iv', rows) > 0
+    # 查無報價或 IV 解算失敗：以內含價值的 Delta (價內 ±1、價外 0) 代替
+    intrinsic = np.where(is_call, (snapshot.S > strikes).astype(float), -(snapshot.S < strikes).astype(float))
+    delta = np.where(solved & np.isfinite(delta), delta, intrinsic)
+    return delta * np.asarray(scale)
+
+
+# ==========================================
+# 期貨成交 (避險與策略的期貨腳共用)
+# ==========================================
+class FuturesExecution:
+    """
+    期貨的報價與成交：BacktestExecutor 以此處理 TradeSignal 中的期貨腳 (Leg.opt_type 為 'TX' / 'MTX')，
+    DeltaHedger 也繼承它來下避險單。成交記在 executor.futures / hedges / hedge_pnl。
+
+    參數:
+        slippage (float): 每次成交的滑價 (點，買進加、賣出減)
+        commission (float): 每口手續費 (元，含期交所規費)
+        tax_rate (float): 期貨交易稅率 (契約金額的十萬分之二)
+    """
+    def __init__(self, slippage: float = 0.0, commission: float = 0.0, tax_rate: float = 0.0):
+        self.slippage = slippage
+        self.commission = commission
+        self.tax_rate = tax_rate
+        self.table = None
+        self._source = None
+
+    def __repr__(self):
+        return (f"FuturesExecution(slippage={self.slippage}, commission={self.commission}, "
+                f"tax_rate={self.tax_rate})")
+
+    def __getstate__(self):
+        # 報價表可由 df_fut 重建，送到背景行程時不複製
+        state = dict(vars(self))
+        state['table'] = state['_source'] = None
+        return state
+
+    def bind(self, df_fut: pd.DataFrame):
+        """建立期貨報價表 (同一份 df_fut 只建一次)"""
+        if self._source is not df_fut:
+            self.table = FuturesPriceTable(df_fut)
+            self._source = df_fut
+
+    def price(self, snapshot, contract: str) -> float:
+        """期貨的當前價格：最近月合約使用 snapshot.S (盤中為當根 K 棒)，其他月份使用當日報價表"""
+        if contract == self.table.front(snapshot.date):
+            return snapshot.S
+        price = self.table.price(snapshot.date, contract)
+        return snapshot.S if price != price else price
+
+    def trade(self, book, snapshot, product: str, contract: str, qty: int, reason: str):
+        """
+        以當前價格加減滑價成交 qty 口 (買進為正、賣出為負)，費用為手續費 + 交易稅
+        參數:
+            book (PositionBook): 持倉帳，需有 futures 與 _fill_futures
+        """
+        price = self.price(snapshot, contract) + np.sign(qty) * self.slippage
+        fees = abs(qty) * (self.commission + self.tax_rate * price * FUTURES_MULTIPLIER[product])
+        book._fill_futures(product, contract, int(qty), float(price), snapshot.date, fees, reason)
+
+
+# ==========================================
+# Delta 避險
+# ==========================================
+class DeltaHedger(FuturesExecution):
+    """
+    以臺指期貨 (TX / MTX) 將組合 Delta 維持在區間內
+
+    BacktestExecutor 每根 K 棒 (日資料為每日、盤中資料為每根 N 分 K) 執行完策略訊號後呼叫 rebalance()：
+        1. 持有的期貨到期 (最後結算日) 時轉倉到下一個月份
+        2. 組合 Delta = 選擇權各腳 Delta (一次查價的陣列運算) + 期貨部位 (含策略自己的期貨腳)
+        3. 超出 ±band 時以 hedge_quantity() 算出口數，在避險合約上成交
+    期貨部位、成交紀錄與損益另外記在 executor.futures / hedges / hedge_pnl，不混入選擇權的交易紀錄。
+
+    參數:
+        band (float): 容許的組合 Delta (小台口數當量；1 口賣權 Delta -0.3 約為 0.3)
+        product (str): 'MTX' (小台，每點 50 元) 或 'TX' (大台，每點 200 元)
+        to (str): 'center' 調回 0、'edge' 調回區間邊界
+        slippage (float): 每次成交的滑價 (點，買進加、賣出減)
+        commission (float): 每口手續費 (元，含期交所規費)
+        tax_rate (float): 期貨交易稅率 (契約金額的十萬分之二)
+    """
+    def __init__(self, band: float = 2.0, product: str = 'MTX', to: str = 'center', slippage: float = 1.0,
+                 commission: float = 20.0, tax_rate: float = 0.00002):
+        if product not in FUTURES_MULTIPLIER:
+            raise ValueError(f"未知的 product: {product}")
+        if to not in ('center', 'edge'):
+            raise ValueError(f"未知的 to: {to}")
+        super().__init__(slippage, commission, tax_rate)
+        self.band = band
+        self.product = product
+        self.to = to
+
+    def __repr__(self):
+        # 回測結果快取與存檔以 repr 區分不同的避險設定
+        return (f"DeltaHedger(band={self.band}, product={self.product!r}, to={self.to!r}, "
+                f"slippage={self.slippage}, commission={self.commission}, tax_rate={self.tax_rate})")
+
+    @property
+    def lot_delta(self) -> float:
+        """每口避險期貨的 Delta (小台口數當量)"""
+        return FUTURES_MULTIPLIER[self.product] / OPTION_MULTIPLIER
+
+    def portfolio_delta(self, book, snapshot) -> float:
+        """組合 Delta (小台口數當量)：選擇權持倉 + 期貨部位"""
+        positions = [book.current_position] if book.current_position else []
+        delta = option_leg_deltas(snapshot, positions).sum()
+        delta += sum(pos['qty'] * FUTURES_MULTIPLIER[product] / OPTION_MULTIPLIER
+                     for (product, _), pos in book.futures.items())
+        return float(delta)
+
+    def _trade(self, book, snapshot, contract, qty, reason):
+        self.trade(book, snapshot, self.product, contract, qty, reason)
+
+    def rebalance(self, book, snapshot):
+        """
+        調整一根 K 棒的期貨部位
+        參數:
+            book (PositionBook): 持倉帳 (BacktestExecutor)，需有 current_position, futures 與 _fill_futures
+            snapshot (MarketSnapshot): 當根 K 棒快照
+        """
+        contract = self.table.hedge_contract(snapshot.date)
+        if contract is None:
+            return
+
+        # 1. 轉倉：到期 (或已過期) 的期貨平倉，同口數建立在避險合約上
+        day = snapshot.date.normalize()
+        for (product, held), pos in list(book.futures.items()):
+            if product != self.product or held == contract:
+                continue
+            if pd.Timestamp(get_expiry_date_cached(held)).normalize() <= day:
+                qty = pos['qty']
+                self._trade(book, snapshot, held, -qty, 'roll')
+                self._trade(book, snapshot, contract, qty, 'roll')
+
+        # 2. Delta 超出區間時調整
+        qty = int(hedge_quantity(self.portfolio_delta(book, snapshot), self.band, self.lot_delta, self.to))
+        if qty:
+            self._trade(book, snapshot, contract, qty, 'rebalance')
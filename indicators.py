@@ -0,0 +1,273 @@
+import copy
+import math
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+# ==========================================
+# 滾動視窗的基本結構 (每次更新 O(1) / O(log B))
+# ==========================================
+class RollingWindow:
+    """
+    固定長度的環狀緩衝區，維護視窗內的累計和與平方和
+
+    push() 為 O(1)：新值覆蓋最舊的值，並更新累計和，不會重新掃描整個視窗。
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._buf = np.zeros(size)
+        self._pos = 0
+        self.count = 0
+        self._sum = 0.0
+        self._sumsq = 0.0
+
+    def push(self, x: float):
+        if self.count == self.size:
+            old = self._buf[self._pos]
+            self._sum -= old
+            self._sumsq -= old * old
+        else:
+            self.count += 1
+        self._buf[self._pos] = x
+        self._pos = (self._pos + 1) % self.size
+        self._sum += x
+        self._sumsq += x * x
+
+    @property
+    def full(self) -> bool:
+        return self.count == self.size
+
+    def mean(self) -> float:
+        return self._sum / self.count if self.count else math.nan
+
+    def mean_square(self) -> float:
+        return max(self._sumsq, 0.0) / self.count if self.count else math.nan
+
+    def values(self) -> np.ndarray:
+        """視窗內的值 (由舊到新)"""
+        if self.count < self.size:
+            return self._buf[:self.count].copy()
+        return np.roll(self._buf, -self._pos)
+
+
+class RollingRank:
+    """
+    滾動視窗的順序統計：以 Fenwick tree 記錄視窗內各數值區間的個數
+
+    數值先量化到 [lo, hi] 間寬度 resolution 的格子，push / rank / kth 皆為 O(log B)，
+    B = (hi - lo) / resolution (預設 30,000 格，IV 精度 0.01 個百分點)。
+    """
+    def __init__(self, size: int, lo: float = 0.0, hi: float = 3.0, resolution: float = 1e-4):
+        self.size = size
+        self.lo = lo
+        self.resolution = resolution
+        self.n_bins = int(round((hi - lo) / resolution)) + 1
+        self._tree = np.zeros(self.n_bins + 1, dtype=np.int64)
+        self._ring = np.zeros(size, dtype=np.int64)
+        self._pos = 0
+        self.count = 0
+        self._top = 1 << (self.n_bins.bit_length() - 1)
+
+    def _bin(self, x: float) -> int:
+        return min(max(int(round((x - self.lo) / self.resolution)), 0), self.n_bins - 1)
+
+    def _add(self, b: int, delta: int):
+        i = b + 1
+        tree = self._tree
+        while i <= self.n_bins:
+            tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, b: int) -> int:
+        """格子 0 ~ b-1 的個數"""
+        total, i, tree = 0, b, self._tree
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return int(total)
+
+    def push(self, x: float):
+        if self.count == self.size:
+            self._add(int(self._ring[self._pos]), -1)
+        else:
+            self.count += 1
+        b = self._bin(x)
+        self._ring[self._pos] = b
+        self._pos = (self._pos + 1) % self.size
+        self._add(b, 1)
+
+    def percentile(self, x: float) -> float:
+        """視窗內嚴格小於 x 的比例 (0 ~ 1)"""
+        if not self.count:
+            return math.nan
+        return self._prefix(self._bin(x)) / self.count
+
+    def kth(self, k: int) -> float:
+        """視窗內第 k 小 (1 起算) 的值 (量化後)"""
+        pos, rem, step, tree = 0, k, self._top, self._tree
+        while step:
+            nxt = pos + step
+            if nxt <= self.n_bins and tree[nxt] < rem:
+                pos = nxt
+                rem -= tree[nxt]
+            step >>= 1
+        return self.lo + pos * self.resolution
+
+    def min(self) -> float:
+        return self.kth(1) if self.count else math.nan
+
+    def max(self) -> float:
+        return self.kth(self.count) if self.count else math.nan
+
+
+# ==========================================
+# 單日快照的指標 (陣列運算，只看當日)
+# ==========================================
+def atm_iv(snapshot, expiry: str) -> float:
+    """指定月份的價平 IV：最接近標的價格的履約價，Call / Put 有效 IV 的平均"""
+    ivs = []
+    for opt_type in ('call', 'put'):
+        chain = snapshot.chain(expiry, opt_type)
+        if chain.empty:
+            continue
+        i = int(np.argmin(np.abs(chain.strike - snapshot.S)))
+        if chain.iv[i] > 0:
+            ivs.append(chain.iv[i])
+    return float(np.mean(ivs)) if ivs else math.nan
+
+
+def delta_skew(snapshot, expiry: str, target: float = 0.25) -> float:
+    """風險逆轉偏斜：|Delta| 最接近 target 的 Put IV 減 Call IV"""
+    ivs = []
+    for opt_type in ('put', 'call'):
+        chain = snapshot.chain(expiry, opt_type)
+        valid = np.flatnonzero(chain.iv > 0) if not chain.empty else []
+        if not len(valid):
+            return math.nan
+        best = valid[np.argmin(np.abs(np.abs(chain.delta[valid]) - target))]
+        ivs.append(chain.iv[best])
+    return float(ivs[0] - ivs[1])
+
+
+def monthly_expiries(snapshot, min_days: float = 5) -> List[str]:
+    """剩餘天數 >= min_days 的月選 (不含週選)，由近到遠"""
+    out = []
+    for expiry in snapshot.expiries:
+        if len(expiry) != 6:
+            continue
+        chain = snapshot.chain(expiry, 'call')
+        if chain.empty:
+            chain = snapshot.chain(expiry, 'put')
+        if not chain.empty and chain.dT[0] * 365 >= min_days:
+            out.append((chain.dT[0], expiry))
+    return [e for _, e in sorted(out)]
+
+
+# ==========================================
+# 逐日指標層
+# ==========================================
+class MarketIndicators:
+    """
+    逐日更新的市場指標，供策略在 context['indicators'] 讀取
+
+    每天 update() 只處理當日快照並推進滾動狀態 (環狀緩衝區 / Fenwick tree)，
+    不會重新掃描歷史資料：
+        atm_iv        : 近月 (剩餘 >= min_days 天) 價平 IV
+        atm_iv_next   : 次月價平 IV
+        term_slope    : 次月 - 近月價平 IV (期限結構斜率，> 0 為正價差)
+        iv_rank       : (atm_iv - 視窗最低) / (視窗最高 - 視窗最低)
+        iv_percentile : 視窗內低於當日 atm_iv 的比例
+        realized_vol  : 標的對數報酬的年化實現波動率 (rv_window 日)
+        skew          : 近月 25 Delta 風險逆轉 (Put IV - Call IV)
+    另外 term_structure 屬性保存當日所有月選的 {到期月份: 價平 IV}。
+
+    參數:
+        rank_window (int): IV rank / percentile 的視窗長度 (交易日)
+        rv_window (int): 實現波動率的視窗長度 (交易日)
+        min_days (float): 近月合約至少剩餘的天數 (避開結算前幾天失真的 IV)
+        skew_delta (float): 偏斜使用的 |Delta|
+    """
+    FIELDS = ('atm_iv', 'atm_iv_next', 'term_slope', 'iv_rank', 'iv_percentile', 'realized_vol', 'skew')
+
+    def __init__(self, rank_window: int = 252, rv_window: int = 20, min_days: float = 5,
+                 skew_delta: float = 0.25):
+        self.rank_window = rank_window
+        self.rv_window = rv_window
+        self.min_days = min_days
+        self.skew_delta = skew_delta
+        self._iv_rank = RollingRank(rank_window)
+        self._returns = RollingWindow(rv_window)
+        self._last_S = None
+        self.date = None
+        self.values = dict.fromkeys(self.FIELDS, math.nan)
+        self.term_structure = {}
+        self.series = []  # 每日 (date, *FIELDS)
+
+    def __repr__(self):
+        # 回測結果快取 (optimization.BacktestRunner) 以 repr 區分不同的指標設定
+        return (f"MarketIndicators(rank_window={self.rank_window}, rv_window={self.rv_window}, "
+                f"min_days={self.min_days}, skew_delta={self.skew_delta})")
+
+    def update(self, snapshot) -> Dict[str, float]:
+        """以當日快照推進一天，回傳當日指標 (同一天重複呼叫直接回傳當日結果)"""
+        day = snapshot.date.normalize()
+        if day == self.date:
+            return self.values
+        self.date = day
+
+        S = snapshot.S
+        if self._last_S and S > 0:
+            self._returns.push(math.log(S / self._last_S))
+        if S > 0:
+            self._last_S = S
+
+        expiries = monthly_expiries(snapshot, self.min_days)
+        self.term_structure = {e: atm_iv(snapshot, e) for e in expiries}
+        front = self.term_structure[expiries[0]] if expiries else math.nan
+        nxt = self.term_structure[expiries[1]] if len(expiries) > 1 else math.nan
+
+        rank = pct = math.nan
+        if front == front:
+            self._iv_rank.push(front)
+            lo, hi = self._iv_rank.min(), self._iv_rank.max()
+            rank = (front - lo) / (hi - lo) if hi > lo else math.nan
+            pct = self._iv_rank.percentile(front)
+
+        self.values = {
+            'atm_iv': front,
+            'atm_iv_next': nxt,
+            'term_slope': nxt - front,
+            'iv_rank': min(max(rank, 0.0), 1.0) if rank == rank else rank,
+            'iv_percentile': pct,
+            'realized_vol': math.sqrt(self._returns.mean_square() * 252) if self._returns.count else math.nan,
+            'skew': delta_skew(snapshot, expiries[0], self.skew_delta) if expiries else math.nan,
+        }
+        self.series.append((day, *(self.values[k] for k in self.FIELDS)))
+        return self.values
+
+    def frame(self) -> pd.DataFrame:
+        """至今的逐日指標序列 (index 為交易日期)，供向量化分析使用"""
+        return pd.DataFrame(self.series, columns=('date',) + self.FIELDS).set_index('date')
+
+    def get_state(self) -> dict:
+        """可續跑狀態 (BacktestExecutor 存檔時一併保存)"""
+        return copy.deepcopy(vars(self))
+
+    def set_state(self, state: dict):
+        vars(self).update(copy.deepcopy(state))
+
+
+def indicator_series(snapshots, **params) -> pd.DataFrame:
+    """
+    對快照序列一次算出完整的逐日指標表
+
+    參數:
+        snapshots: MarketSnapshot 的迭代器，例如 market_data_generator(...) 或 SnapshotCache(...)(start, end)
+        params: MarketIndicators 的參數
+    """
+    indicators = MarketIndicators(**params)
+    for snapshot in snapshots:
+        indicators.update(snapshot)
+    return indicators.frame()
@@ -0,0 +1,298 @@
+import importlib.util
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils import expiry_dT_array, implied_volatility_array, bs_greeks_array, CALL_LABEL, PUT_LABEL
+from market_snapshot import MarketSnapshot
+from profiling import NULL_PROFILER
+from event_journal import get_journal, DATA, SOLVER_FAILURE, ERROR_EVENT
+
+
+# ==========================================
+# 分日存放的盤中資料 (Partitioned Files)
+# ==========================================
+# 目錄結構：<root>/<product>/<YYYY>/<YYYYMMDD>.<fmt>，product 為 'TX' 或 'TXO'
+#
+# 欄位 (逐筆成交或 1 分 K 皆可，resample_bars 會聚合成 N 分 K)：
+#   TX : 時間, 到期月份(週別), 收盤價, 成交量
+#   TXO: 時間, 到期月份(週別), 履約價, 買賣權, 收盤價, 成交量
+# 時間為 datetime；逐筆資料的收盤價即成交價。只放一般交易時段的資料。
+
+TIME_COL = '時間'
+FORMATS = ('csv', 'parquet')
+
+
+def check_fmt(fmt: str):
+    """檢查存檔格式 (IntradayStore / run_registry.RunRegistry 共用)；parquet 需要 pyarrow 或 fastparquet"""
+    if fmt not in FORMATS:
+        raise ValueError(f"未知的 fmt: {fmt} (可用 {FORMATS})")
+    if fmt == 'parquet' and not any(importlib.util.find_spec(name) for name in ('pyarrow', 'fastparquet')):
+        raise ImportError("fmt='parquet' 需要 pyarrow 或 fastparquet (pip install pyarrow)，或改用 fmt='csv'")
+
+
+class IntradayStore:
+    """
+    讀寫分日存放的盤中資料 (一天一個檔案，回測時逐日載入，記憶體只保留一天)
+    """
+    def __init__(self, root: str, fmt: str = 'csv'):
+        """
+        參數:
+            root (str): 資料根目錄
+            fmt (str): 'csv' 或 'parquet' (需要 pyarrow 或 fastparquet，檔案較小、讀取較快)
+        """
+        check_fmt(fmt)
+        self.root = root
+        self.fmt = fmt
+
+    def path(self, product: str, date) -> str:
+        date = pd.Timestamp(date)
+        return os.path.join(self.root, product, f"{date:%Y}", f"{date:%Y%m%d}.{self.fmt}")
+
+    def dates(self, product: str = 'TX') -> List[pd.Timestamp]:
+        """有資料的交易日 (依檔名排序)"""
+        base = os.path.join(self.root, product)
+        if not os.path.isdir(base):
+            return []
+        dates = []
+        suffix = '.' + self.fmt
+        for year in sorted(os.listdir(base)):
+            year_dir = os.path.join(base, year)
+            if not os.path.isdir(year_dir):
+                continue
+            dates.extend(pd.Timestamp(name[:-len(suffix)]) for name in sorted(os.listdir(year_dir))
+                         if name.endswith(suffix))
+        return dates
+
+    def load(self, product: str, date) -> Optional[pd.DataFrame]:
+        path = self.path(product, date)
+        if not os.path.exists(path):
+            return None
+        if self.fmt == 'parquet':
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, dtype={'到期月份(週別)': str})
+        df[TIME_COL] = pd.to_datetime(df[TIME_COL])
+        return df
+
+    def write(self, df: pd.DataFrame, product: str):
+        """將盤中資料依交易日拆檔寫入 (同一天的檔案會被覆寫)"""
+        times = pd.to_datetime(df[TIME_COL])
+        for date, part in df.groupby(times.dt.normalize()):
+            path = self.path(product, date)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.fmt == 'parquet':
+                part.to_parquet(path, index=False)
+            else:
+                part.to_csv(path, index=False)
+
+
+def resample_bars(df: pd.DataFrame, minutes: int, keys: List[str]) -> pd.DataFrame:
+    """
+    聚合成 N 分 K (每組取最後收盤價、加總成交量)；K 棒時間為區間結束時間
+
+    參數:
+        keys (list): 分組欄位 (期貨 ['到期月份(週別)']，選擇權再加上履約價與買賣權)
+    """
+    bar = df[TIME_COL].dt.ceil(f'{minutes}min')
+    df = df.assign(**{TIME_COL: bar}).sort_values(TIME_COL, kind='mergesort')
+    agg = {'收盤價': 'last'}
+    if '成交量' in df.columns:
+        agg['成交量'] = 'sum'
+    return df.groupby([TIME_COL] + keys, sort=True).agg(agg).reset_index()
+
+
+# ==========================================
+# 盤中 K 棒生成器
+# ==========================================
+def _near_month_bars(fut: pd.DataFrame, minutes: int) -> pd.Series:
+    """近月 TX 的 N 分 K 收盤價 (index 為 K 棒時間)"""
+    codes = fut['到期月份(週別)'].astype(str)
+    fut = fut[~codes.str.contains('/')]
+    near = fut['到期月份(週別)'].astype(str).min()
+    bars = resample_bars(fut[fut['到期月份(週別)'].astype(str) == near], minutes, ['到期月份(週別)'])
+    bars = bars[bars['收盤價'] > 0]
+    return pd.Series(bars['收盤價'].to_numpy(float), index=pd.DatetimeIndex(bars[TIME_COL]))
+
+
+def intraday_bar_generator(store: IntradayStore, start_date, end_date, minutes: int = 1,
+                           risk_free_rate: float = 0.01, moneyness: float = 0.1,
+                           resolve_on_spot: bool = False, profiler=NULL_PROFILER, journal=None,
+                           state: Optional[dict] = None):
+    """
+    盤中 K 棒生成器：每根 N 分 K 產出一個 MarketSnapshot (snapshot.date 為 K 棒時間)
+
+    每日先把選擇權 K 棒整理成 [K 棒 x 合約] 的矩陣 (收盤價向前填補；當日尚未成交的合約
+    沿用前一日最後價格，開盤第一根 K 棒即有完整報價鏈)，之後每根 K 棒：
+        1. 只對「本根有成交」的合約重新反推 IV
+        2. 其餘合約沿用上一次的 IV (sticky strike)，以新的 S 向量化重算 Greeks
+    resolve_on_spot=True 時，S 變動即對所有已報價合約重新反推 IV (較慢，與日頻的算法一致)。
+
+    參數:
+        minutes (int): K 棒分鐘數
+        moneyness (float): 只保留 |K / S_open - 1| <= moneyness 的履約價 (None 則全部保留)
+        resolve_on_spot (bool): S 變動時是否重新反推所有合約的 IV
+        profiler (StageProfiler): 階段計時器 (stage: slice / iv / greeks / snapshot)
+        journal (EventJournal): 事件日誌
+        state (dict): 續跑狀態，每日開始時更新為 {'date': 當日, 'carry': 前一日各合約最後價格}；
+                      起始日與 state['date'] 相同時以其中的 carry 接續 (IntradayBarSource 存檔用)
+    從 K 棒中間開始時 (start_date 不在整日開頭)，當日較早的 K 棒仍會反推 IV (只是不產出快照)，
+    因此續跑的 IV 與完整回測一致。
+
+    注意：dT 以「交易日」計算 (與日頻相同)，同一天內各 K 棒的 dT 不變。
+    """
+    journal = journal or get_journal()
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    dates = [d for d in store.dates('TX') if start_date.normalize() <= d <= end_date]
+    journal.info(DATA, "--- 初始化盤中 K 棒生成器 ({start} to {end}, {minutes} 分 K) ---",
+                 start=start_date, end=end_date, minutes=minutes)
+    journal.info(DATA, ">> 預計執行交易日數: {n} 天", n=len(dates))
+
+    carry = {}  # 前一日各合約最後價格：(到期月份, 履約價, 是否買權) -> 收盤價
+    if state is not None and dates and state.get('date') == dates[0]:
+        carry = state['carry']
+    for date in dates:
+        if state is not None:
+            state.update(date=date, carry=carry)
+        try:
+            day = _load_day(store, date, minutes, moneyness, profiler)
+        except Exception as e:
+            journal.error(ERROR_EVENT, "Error on {date:%Y-%m-%d}: {error}", date=date, error=repr(e))
+            continue
+        if day is None:
+            continue
+        spot, bar_times, expiry, strike, is_call, close, traded = day
+        keys = list(zip(expiry.tolist(), strike.tolist(), is_call.tolist()))
+        prev = np.array([carry.get(k, np.nan) for k in keys])
+        seeded = np.isnan(close[0]) & ~np.isnan(prev)
+        close = np.where(np.isnan(close), prev, close)
+        traded[0] |= seeded
+        carry = dict(zip(keys, close[-1].tolist()))
+        dT = expiry_dT_array(expiry, date)
+        flag = np.where(is_call, 1.0, -1.0)
+        n = len(strike)
+        iv = np.zeros(n)
+        quoted = np.zeros(n, dtype=bool)
+        prev_S = np.nan
+
+        for b, bar_time in enumerate(bar_times):
+            S = spot[b]
+            price = close[b]
+            quoted |= traded[b]
+
+            # 1. 需要重新反推 IV 的合約
+            t = profiler.start()
+            if resolve_on_spot and S != prev_S:
+                solve = np.flatnonzero(quoted)
+            else:
+                solve = np.flatnonzero(traded[b])
+            if solve.size:
+                iv[solve], n_fail = implied_volatility_array(price[solve], strike[solve], dT[solve], S,
+                                                             risk_free_rate, flag[solve], return_failures=True)
+                profiler.count('solver_fail', n_fail)
+                if n_fail:
+                    journal.warning(SOLVER_FAILURE, ">> [IV 解算失敗] {date} 共 {n} 筆", date=bar_time, n=n_fail)
+            profiler.stop('iv', t)
+            profiler.count('rows', solve.size)
+            prev_S = S
+            if bar_time < start_date:
+                continue
+
+            # 2. 已報價合約以新的 S 重算 Greeks
+            rows = np.flatnonzero(quoted)
+            if not rows.size:
+                continue
+            t = profiler.start()
+            delta, gamma, theta, vega, itm_prob = bs_greeks_array(strike[rows], dT[rows], iv[rows], S,
+                                                                  risk_free_rate, is_call[rows])
+            profiler.stop('greeks', t)
+
+            t = profiler.start()
+            columns = {
+                'strike': strike[rows], 'close': price[rows], 'settle': np.full(rows.size, np.nan),
+                'dT': dT[rows], 'iv': iv[rows], 'delta': delta, 'gamma': gamma, 'theta': theta,
+                'vega': vega, 'itm_prob': itm_prob,
+            }
+            snapshot = MarketSnapshot(bar_time, S, columns, expiry[rows], is_call[rows])
+            profiler.stop('snapshot', t)
+            profiler.count('bars')
+            yield snapshot
+
+
+def _load_day(store, date, minutes, moneyness, profiler):
+    """
+    載入一天的資料並整理成矩陣
+
+    回傳:
+        (spot[B], bar_times[B], expiry[C], strike[C], is_call[C], close[B, C], traded[B, C])，無資料回傳 None
+    """
+    t = profiler.start()
+    fut = store.load('TX', date)
+    opt = store.load('TXO', date)
+    if fut is None or opt is None or fut.empty or opt.empty:
+        return None
+    spot = _near_month_bars(fut, minutes)
+    if spot.empty:
+        return None
+
+    cp = opt['買賣權'].to_numpy()
+    opt = opt[(cp == CALL_LABEL) | (cp == PUT_LABEL)]
+    if moneyness is not None:
+        k = opt['履約價'].to_numpy(float)
+        opt = opt[np.abs(k / spot.iloc[0] - 1) <= moneyness]
+    keys = ['到期月份(週別)', '履約價', '買賣權']
+    bars = resample_bars(opt[opt['收盤價'] > 0], minutes, keys)
+
+    # 合約依 (到期月份, 買權在前, 履約價) 編號，K 棒時間以期貨為準
+    contracts = bars[keys].drop_duplicates()
+    contracts = contracts.assign(_put=contracts['買賣權'] == PUT_LABEL).sort_values(['到期月份(週別)', '_put', '履約價'])
+    contract_id = pd.MultiIndex.from_frame(contracts[keys])
+    bar_times = spot.index
+    col = contract_id.get_indexer(pd.MultiIndex.from_frame(bars[keys]))
+    row = bar_times.get_indexer(bars[TIME_COL])
+    ok = row >= 0  # 期貨沒有 K 棒的時間 (例如資料缺漏) 併入不了，直接略過
+
+    B, C = len(bar_times), len(contract_id)
+    close = np.full((B, C), np.nan)
+    close[row[ok], col[ok]] = bars['收盤價'].to_numpy(float)[ok]
+    traded = ~np.isnan(close)
+    close = pd.DataFrame(close).ffill().to_numpy()
+
+    expiry = contracts['到期月份(週別)'].astype(str).to_numpy()
+    strike = contracts['履約價'].to_numpy(float)
+    is_call = contracts['買賣權'].to_numpy() == CALL_LABEL
+    profiler.stop('slice', t)
+    return spot.to_numpy(float), bar_times, expiry, strike, is_call, close, traded
+
+
+class IntradayBarSource:
+    """
+    BacktestExecutor 的盤中資料來源：
+        BacktestExecutor(strategy, start, end, None, df_fut, market_data=IntradayBarSource(store, minutes=5))
+    (df_fut 仍需提供日資料，用來建立換倉地圖)
+
+    get_state() / set_state() 保存「前一日各合約最後價格」，BacktestExecutor 存檔續跑時
+    開盤第一根 K 棒的報價鏈與完整回測相同。
+    """
+    def __init__(self, store: IntradayStore, minutes: int = 1, risk_free_rate: float = 0.01,
+                 moneyness: float = 0.1, resolve_on_spot: bool = False):
+        self.store = store
+        self.minutes = minutes
+        self.risk_free_rate = risk_free_rate
+        self.moneyness = moneyness
+        self.resolve_on_spot = resolve_on_spot
+        self._state = {}      # 目前 generator 的續跑狀態
+        self._resume = None   # set_state() 載入、下一次呼叫時接續的狀態
+
+    def __call__(self, start_date, end_date, profiler=NULL_PROFILER, journal=None):
+        self._state, self._resume = self._resume or {}, None
+        return intraday_bar_generator(self.store, start_date, end_date, self.minutes, self.risk_free_rate,
+                                      self.moneyness, self.resolve_on_spot, profiler, journal, self._state)
+
+    def get_state(self) -> dict:
+        return {'date': self._state.get('date'), 'carry': dict(self._state.get('carry', {}))}
+
+    def set_state(self, state: dict):
+        self._resume = {'date': state['date'], 'carry': dict(state['carry'])}
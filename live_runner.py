@@ -0,0 +1,581 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils import (Leg, TradeSignal, PositionBook, BacktestExecutor, OptionDataIndex, near_month_spot,
+                   build_rollover_map, get_rollover_info, get_expiry_date_cached, expiry_dT_array,
+                   implied_volatility_array, bs_greeks_array, _fill_prices, FUTURES_MULTIPLIER)
+from market_snapshot import MarketSnapshot, CALL_LABEL
+from event_journal import get_journal, new_journal_like, DATA, SIGNAL, MISSING_QUOTE, ERROR_EVENT
+from profiling import LatencyRecorder
+
+
+# ==========================================
+# 報價事件 (報價源 -> LiveRunner)
+# ==========================================
+# ts 為事件送出時的 time.perf_counter()，用來量測 tick-to-order 延遲
+
+class SpotTick(NamedTuple):
+    date: pd.Timestamp
+    S: float
+    ts: float
+
+
+class OptionTicks(NamedTuple):
+    """一批選擇權報價 (陣列，長度一致)"""
+    date: pd.Timestamp
+    expiry: np.ndarray
+    strike: np.ndarray
+    is_call: np.ndarray
+    close: np.ndarray
+    settle: np.ndarray
+    ts: float
+
+
+class BarClose(NamedTuple):
+    """K 棒結束：LiveRunner 收到後重算 Greeks 並呼叫策略"""
+    date: pd.Timestamp
+    ts: float
+
+
+# ==========================================
+# 委託與成交回報 (LiveRunner <-> 券商)
+# ==========================================
+class Order(NamedTuple):
+    order_id: int
+    action: str              # 'OPEN' / 'CLOSE'
+    contract: str            # 到期月份(週別)
+    legs: List[Leg]          # 實際送出的腳 (平倉時為持倉腳的反向)
+    quantity: int
+    signal: TradeSignal
+    date: pd.Timestamp       # 下單當根 K 棒的日期
+    S: float                 # 下單當時的標的價格 (查無報價時以內含價值計算)
+    ts: float
+    position: Optional[Dict] = None   # 下單當時的持倉 (CLOSE 的平倉目標)；成交時持倉已不同則不記帳
+
+
+class Fill(NamedTuple):
+    order_id: int
+    prices: List[Optional[float]]   # 與 order.legs 對齊，None (或 NaN) 表示該腳查無報價
+    ts: float
+
+
+class BrokerAdapter(ABC):
+    """
+    券商介面
+
+    submit() 只負責送出委託，不等待成交；成交回報由 next_fill() 依序取得。
+    接真實券商 API 時實作這兩個方法即可 (connect / close 視需要覆寫)。
+    """
+    async def connect(self):
+        pass
+
+    @abstractmethod
+    async def submit(self, order: Order):
+        pass
+
+    @abstractmethod
+    async def next_fill(self) -> Fill:
+        pass
+
+    async def close(self):
+        pass
+
+
+# ==========================================
+# 增量更新的 Greeks 報價鏈
+# ==========================================
+class LiveGreeksChain:
+    """
+    盤中報價鏈：收到報價時只標記有變動的合約，K 棒結束時只重算這些合約的 IV/Greeks
+
+    - 標的價格 S 變動時，所有合約都需重算 (IV 以 F = S·e^{RT} 反推)
+    - 換日時清空 (dT 與掛牌合約都會改變)
+    """
+    _FLOAT_COLUMNS = ('strike', 'close', 'settle', 'dT', 'iv', 'delta', 'gamma', 'theta', 'vega', 'itm_prob')
+
+    def __init__(self, risk_free_rate: float = 0.01, capacity: int = 1024):
+        self.R = risk_free_rate
+        self._capacity = capacity
+        self.n_recomputed = 0
+        self.reset(None)
+
+    def reset(self, date):
+        self.date = None if date is None else pd.Timestamp(date)
+        self.S = np.nan
+        self._index = {}
+        self._n = 0
+        self._expiry = np.empty(self._capacity, dtype=object)
+        self._is_call = np.zeros(self._capacity, dtype=bool)
+        self._dirty = np.zeros(self._capacity, dtype=bool)
+        self._cols = {name: np.zeros(self._capacity) for name in self._FLOAT_COLUMNS}
+
+    def __len__(self):
+        return self._n
+
+    def _grow(self):
+        cap = len(self._expiry) * 2
+        self._expiry = np.resize(self._expiry, cap)
+        self._is_call = np.resize(self._is_call, cap)
+        self._dirty = np.resize(self._dirty, cap)
+        self._cols = {name: np.resize(col, cap) for name, col in self._cols.items()}
+
+    def update_spot(self, S: float):
+        if S != self.S:
+            self.S = float(S)
+            self._dirty[:self._n] = True
+
+    def update_options(self, expiry, strike, is_call, close, settle):
+        """套用一批報價；新合約加入報價鏈，收盤價有變動的合約標記為待重算"""
+        col_close, col_settle = self._cols['close'], self._cols['settle']
+        new_rows = []
+        for e, k, c, p, st in zip(expiry, strike, is_call, close, settle):
+            key = (e, float(k), bool(c))
+            i = self._index.get(key)
+            if i is None:
+                if self._n == len(self._expiry):
+                    self._grow()
+                    col_close, col_settle = self._cols['close'], self._cols['settle']
+                i = self._n
+                self._n += 1
+                self._index[key] = i
+                self._expiry[i] = e
+                self._is_call[i] = c
+                self._cols['strike'][i] = k
+                new_rows.append(i)
+            elif col_close[i] == p or (p != p and col_close[i] != col_close[i]):
+                col_settle[i] = st
+                continue
+            col_close[i] = p
+            col_settle[i] = st
+            self._dirty[i] = True
+        if new_rows:
+            new_rows = np.asarray(new_rows)
+            self._cols['dT'][new_rows] = expiry_dT_array(self._expiry[new_rows].astype(str), self.date)
+
+    def snapshot(self) -> MarketSnapshot:
+        """重算待更新合約的 IV/Greeks，回傳目前的 MarketSnapshot"""
+        n = self._n
+        idx = np.flatnonzero(self._dirty[:n])
+        if idx.size:
+            c = self._cols
+            strike, dT, is_call = c['strike'][idx], c['dT'][idx], self._is_call[idx]
+            iv = implied_volatility_array(c['close'][idx], strike, dT, self.S, self.R,
+                                          np.where(is_call, 1.0, -1.0))
+            greeks = bs_greeks_array(strike, dT, iv, self.S, self.R, is_call)
+            c['iv'][idx] = iv
+            for name, values in zip(('delta', 'gamma', 'theta', 'vega', 'itm_prob'), greeks):
+                c[name][idx] = values
+            self._dirty[:n] = False
+        self.n_recomputed = idx.size
+        # 複製一份：策略在背景處理這根 K 棒時，報價鏈仍會繼續更新
+        columns = {name: col[:n].copy() for name, col in self._cols.items()}
+        return MarketSnapshot(self.date, self.S, columns, self._expiry[:n].astype(str), self._is_call[:n].copy())
+
+
+# ==========================================
+# 即時交易執行器
+# ==========================================
+class LiveRunner(PositionBook):
+    """
+    asyncio 即時交易執行器 (沿用 BaseStrategy 的 on_bar / on_rollover)
+
+    流程：
+        1. 報價源送出 SpotTick / OptionTicks，更新 LiveGreeksChain (只標記變動合約)
+        2. BarClose 時重算變動合約的 Greeks 並建立快照，交給背景工作 (_process_bars) 依序處理，
+           報價的接收不會因等待成交而停止
+        3. 背景工作呼叫策略取得訊號，轉成 Order 交給 BrokerAdapter；成交回報由另一個背景工作 (_consume_fills) 記帳
+           同一根 K 棒的訊號依序送出 (後一筆訊號可能依賴前一筆的成交，例如換倉的先平後開)，
+           每筆最多等待 fill_timeout 秒，逾時未成交的委託會出現在 context['pending_orders']
+        4. 每筆委託記錄下單當時的持倉；成交回報到達時持倉已改變 (逾時的委託晚到、重複的平倉)，
+           該筆成交不記帳，記錄在事件日誌與 self.unmatched_fills，由人工對帳
+        背景工作發生例外時記錄到事件日誌，並在下一個事件時停止 run()。
+
+    延遲統計 (self.latency)：
+        quote         : 套用一批報價
+        greeks        : K 棒結束時重算 Greeks 並建立快照
+        strategy      : 策略 on_bar / on_rollover
+        tick_to_order : BarClose 送出到委託送出
+        order_to_fill : 委託送出到成交記帳完成
+        bar           : 整根 K 棒的處理時間
+    """
+    def __init__(self, strategy, broker: BrokerAdapter, quotes, rollover_map=None, risk_free_rate=0.01,
+                 balance=2_000_000, fill_timeout=5.0, journal=None):
+        """
+        參數:
+            broker (BrokerAdapter): 券商介面 (離線測試用 MockBroker)
+            quotes: 報價事件的 async iterable (例如 MockMarketServer.stream())
+            rollover_map (dict): 換倉地圖 (build_rollover_map 的結果，None 則不換倉)
+            fill_timeout (float): 每筆委託等待成交的秒數
+        """
+        self.strategy = strategy
+        self.broker = broker
+        self.quotes = quotes
+        self.rollover_map = rollover_map or {}
+        self.chain = LiveGreeksChain(risk_free_rate)
+        self.fill_timeout = fill_timeout
+
+        self.current_position = None
+        self.history = []
+        self.balance = balance
+        self.journal = journal if journal is not None else new_journal_like(get_journal())
+        self.latency = LatencyRecorder()
+
+        self._next_order_id = 1
+        self._pending = {}  # order_id -> (Order, Future)
+        self.unmatched_fills = []  # 成交時持倉已改變而未記帳的 (Order, Fill)
+        self._tasks = []
+
+    async def run(self) -> pd.DataFrame:
+        journal = self.journal
+        journal.info(DATA, "--- LiveRunner Start | Balance: {balance} ---", balance=self.balance)
+        await self.broker.connect()
+        bars = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._consume_fills()), asyncio.create_task(self._process_bars(bars))]
+        for task in self._tasks:
+            task.add_done_callback(self._task_done)
+        try:
+            async for event in self.quotes:
+                self._check_tasks()
+                if isinstance(event, BarClose):
+                    t = time.perf_counter()
+                    snapshot = self.chain.snapshot()
+                    self.latency.record('greeks', time.perf_counter() - t)
+                    if snapshot.n_rows:
+                        bars.put_nowait((snapshot, event.ts, t))
+                    continue
+                if event.date != self.chain.date:
+                    self.chain.reset(event.date)
+                t = time.perf_counter()
+                if isinstance(event, SpotTick):
+                    self.chain.update_spot(event.S)
+                else:
+                    self.chain.update_options(event.expiry, event.strike, event.is_call, event.close, event.settle)
+                self.latency.record('quote', time.perf_counter() - t)
+            # 報價結束：處理完已排隊的 K 棒
+            bars.put_nowait(None)
+            await asyncio.wait([self._tasks[1]])
+            self._check_tasks()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await self.broker.close()
+        return pd.DataFrame(self.history)
+
+    def _task_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.journal.error(ERROR_EVENT, "LiveRunner 背景工作中止: {error}", error=repr(task.exception()))
+
+    def _check_tasks(self):
+        """背景工作 (成交回報 / K 棒處理) 因例外結束時停止 run()"""
+        for task in self._tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise RuntimeError("LiveRunner 背景工作中止") from task.exception()
+
+    async def _process_bars(self, bars: asyncio.Queue):
+        """背景工作：依序處理已結束的 K 棒 (策略與下單)，None 表示報價結束"""
+        while True:
+            item = await bars.get()
+            if item is None:
+                return
+            await self._on_bar_close(*item)
+
+    async def _on_bar_close(self, snapshot: MarketSnapshot, bar_ts: float, t_bar: float):
+        self._check_tasks()
+        date = snapshot.date
+
+        context = {
+            'position': self.current_position,
+            'balance': self.balance,
+            'journal': self.journal,
+            'pending_orders': [order for order, _ in self._pending.values()],
+        }
+        rollover_info = get_rollover_info(date, self.rollover_map)
+        t = time.perf_counter()
+        if rollover_info[0]:
+            signals = self.strategy.on_rollover(context, snapshot, rollover_info)
+        else:
+            signals = self.strategy.on_bar(context, snapshot)
+        self.latency.record('strategy', time.perf_counter() - t)
+
+        for sig in signals:
+            if self.journal.debug_on:
+                self.journal.debug(SIGNAL, ">> [訊號] {date:%Y-%m-%d} {action} {contract} x{qty} ({reason})", date=date,
+                                   action=sig.action, contract=sig.contract, qty=sig.quantity, reason=sig.reason)
+            await self._submit(sig, snapshot, bar_ts)
+        self.latency.record('bar', time.perf_counter() - t_bar)
+
+    async def _submit(self, signal, snapshot, bar_ts):
+        """訊號轉成委託送出，並等待成交 (最多 fill_timeout 秒)"""
+        date = snapshot.date
+        if any(leg.opt_type in FUTURES_MULTIPLIER for leg in signal.legs):
+            # 券商介面目前只接選擇權委託：期貨腳不送出 (回測的 BacktestExecutor 才會成交期貨腳)
+            self.journal.warning(ERROR_EVENT, ">> [不支援] {date:%Y-%m-%d} 即時模式略過期貨腳 ({reason})",
+                                 date=date, reason=signal.reason)
+            legs = [leg for leg in signal.legs if leg.opt_type not in FUTURES_MULTIPLIER]
+            if not legs:
+                return
+            signal = TradeSignal(signal.action, signal.contract, legs, signal.reason, signal.quantity)
+        if not snapshot.has_expiry(signal.contract):
+            self.journal.warning(MISSING_QUOTE, ">> [下單失敗] {date:%Y-%m-%d} 找不到月份為 {contract} 的報價資料",
+                                 date=date, contract=signal.contract)
+            return
+        if signal.action == 'OPEN':
+            contract, legs, qty = signal.contract, list(signal.legs), signal.quantity
+        elif signal.action == 'CLOSE' and self.current_position:
+            pos = self.current_position
+            contract, qty = pos['contract'], pos['qty']
+            legs = [Leg('buy' if l['side'] == 'sell' else 'sell', l['strike'], l['type']) for l in pos['legs']]
+        else:
+            return
+
+        order = Order(self._next_order_id, signal.action, contract, legs, qty, signal, date, snapshot.S,
+                      time.perf_counter(), self.current_position)
+        self._next_order_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[order.order_id] = (order, future)
+        await self.broker.submit(order)
+        self.latency.record('tick_to_order', time.perf_counter() - bar_ts)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.fill_timeout)
+        except asyncio.TimeoutError:
+            self.journal.warning(ERROR_EVENT, ">> [委託逾時] {date:%Y-%m-%d} 委託 {order_id} 於 {timeout}s 內未成交",
+                                 date=date, order_id=order.order_id, timeout=self.fill_timeout)
+
+    async def _consume_fills(self):
+        """背景工作：依序取得成交回報並記帳"""
+        while True:
+            fill = await self.broker.next_fill()
+            entry = self._pending.pop(fill.order_id, None)
+            if entry is None:
+                self.journal.warning(ERROR_EVENT, ">> [未知成交回報] 委託 {order_id}", order_id=fill.order_id)
+                continue
+            order, future = entry
+            # 券商回報的缺價 (None / NaN) 與 BacktestExecutor 相同處理：開倉略過該腳、平倉以內含價值計算
+            prices = _fill_prices(fill)
+            mismatch = self._fill_mismatch(order)
+            try:
+                if mismatch:
+                    self.unmatched_fills.append((order, fill))
+                    self.journal.error(ERROR_EVENT, ">> [成交不符] {date:%Y-%m-%d} 委託 {order_id} {action} {contract}: "
+                                       "{why}，未記帳", date=order.date, order_id=order.order_id,
+                                       action=order.action, contract=order.contract, why=mismatch)
+                elif order.action == 'OPEN':
+                    self._fill_open(order.signal, prices, order.date, order.S)
+                else:
+                    self._fill_close(order.signal, prices, order.date, order.S)
+            except Exception as e:
+                self.journal.error(ERROR_EVENT, "Fill error on {date:%Y-%m-%d}: {error}", date=order.date, error=repr(e))
+            self.latency.record('order_to_fill', time.perf_counter() - order.ts)
+            if not future.done():
+                future.set_result(fill)
+
+    def _fill_mismatch(self, order: Order) -> Optional[str]:
+        """成交回報與目前持倉是否相符 (例如逾時的委託晚到)，不符時回傳原因"""
+        held = self.current_position
+        if order.action == 'OPEN':
+            # 下單後已建立其他持倉：記帳會覆蓋該持倉
+            if held is not None and held is not order.position:
+                return f"已有下單後建立的持倉 {held['contract']}"
+        elif held is None:
+            return "持倉已平倉"
+        elif held is not order.position:
+            return f"平倉目標已不是目前持倉 {held['contract']}"
+        return None
+
+
+# ==========================================
+# 離線測試用：行程內的模擬報價源與券商
+# ==========================================
+class MockMarketServer:
+    """
+    以歷史資料重播報價 (與 market_data_generator 相同的交易日曆與標的價格)
+
+    每個交易日依序送出：SpotTick -> OptionTicks (分 n_batches 批) -> BarClose。
+    同一交易日重複的合約只送第一筆 (與回測 snapshot.quote() 取第一筆一致)。
+    """
+    def __init__(self, df_opt, df_fut, start_date, end_date, n_batches=4, bar_interval=0.0, opt_index=None):
+        """
+        參數:
+            n_batches (int): 每日選擇權報價拆成幾批送出
+            bar_interval (float): 每根 K 棒之間暫停的秒數 (0 表示盡快重播)
+            opt_index (OptionDataIndex): 可重複使用的選擇權逐日索引
+        """
+        self.df_fut = df_fut
+        self.start_date = pd.Timestamp(start_date)
+        self.end_date = pd.Timestamp(end_date)
+        self.n_batches = n_batches
+        self.bar_interval = bar_interval
+        self.opt_index = opt_index if opt_index is not None else OptionDataIndex(df_opt)
+        self.spot = near_month_spot(df_fut)
+
+        # 目前報價 (供 MockBroker 成交)： (到期月份, 履約價, 是否買權) -> 收盤價
+        self.date = None
+        self.S = np.nan
+        self.book = {}
+        self.books = {}   # 最近 keep_days 個交易日的報價 (策略晚於報價處理時，委託以下單 K 棒的報價成交)
+        self.keep_days = 5
+
+    @property
+    def trade_dates(self):
+        dates = pd.to_datetime(pd.Series(self.df_fut['交易日期'].unique())).sort_values()
+        return [pd.Timestamp(d) for d in dates if self.start_date <= d <= self.end_date]
+
+    def rollover_map(self, offset=3):
+        return build_rollover_map(self.df_fut, self.start_date, self.end_date, offset)
+
+    async def stream(self):
+        idx = self.opt_index
+        for date in self.trade_dates:
+            S = self.spot.get(date)
+            sl = idx.day(date)
+            if S is None or sl is None:
+                continue
+            expiry, strike, is_call = idx.expiry[sl], idx.columns['strike'][sl], idx.is_call[sl]
+            close, settle = idx.columns['close'][sl], idx.columns['settle'][sl]
+            first = {}
+            for i, key in enumerate(zip(expiry, strike.tolist(), is_call.tolist())):
+                first.setdefault(key, i)
+            keep = np.fromiter(first.values(), dtype=int, count=len(first))
+
+            self.date, self.S, self.book = date, S, {}
+            self.books[date] = self.book
+            while len(self.books) > self.keep_days:
+                self.books.pop(next(iter(self.books)))
+            yield SpotTick(date, S, time.perf_counter())
+            for part in np.array_split(keep, max(1, self.n_batches)):
+                if not part.size:
+                    continue
+                self.book.update(zip(zip(expiry[part], strike[part].tolist(), is_call[part].tolist()),
+                                     close[part].tolist()))
+                yield OptionTicks(date, expiry[part], strike[part], is_call[part], close[part], settle[part],
+                                  time.perf_counter())
+                await asyncio.sleep(0)
+            yield BarClose(date, time.perf_counter())
+            await asyncio.sleep(self.bar_interval)
+
+
+class MockBroker(BrokerAdapter):
+    """
+    模擬券商：以委託 K 棒 (order.date) 當時 server 的報價成交，延遲 latency 秒後送出回報
+    (latency 與 LiveRunner 的處理延遲只影響回報時間，不影響成交價，重播結果與 BacktestExecutor 一致)
+    """
+    def __init__(self, server: MockMarketServer, latency: float = 0.0):
+        self.server = server
+        self.latency = latency
+        self._fills = asyncio.Queue()
+        self._tasks = set()
+
+    async def submit(self, order: Order):
+        book = self.server.books.get(order.date, self.server.book)
+        prices = [book.get((order.contract, float(leg.strike), leg.opt_type == 'call')) for leg in order.legs]
+        task = asyncio.get_running_loop().create_task(self._report(Fill(order.order_id, prices, 0.0)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _report(self, fill: Fill):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        await self._fills.put(fill._replace(ts=time.perf_counter()))
+
+    async def next_fill(self) -> Fill:
+        return await self._fills.get()
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+
+def run_replay(strategy, df_opt, df_fut, start_date, end_date, latency=0.0, n_batches=4, balance=2_000_000,
+               journal=None):
+    """
+    以 MockMarketServer + MockBroker 離線重播 (腳本用；Jupyter 中請直接 await runner.run())
+
+    回傳:
+        (history DataFrame, LiveRunner)
+    """
+    server = MockMarketServer(df_opt, df_fut, start_date, end_date, n_batches=n_batches)
+    runner = LiveRunner(strategy, MockBroker(server, latency), server.stream(),
+                        rollover_map=server.rollover_map(), balance=balance, journal=journal)
+    return asyncio.run(runner.run()), runner
+
+
+def drop_held_quotes(df_opt, history) -> pd.DataFrame:
+    """
+    將 history 中每筆交易各腳在建倉日之後、到期日之前改為缺價 (回傳副本)，用來檢查缺價的處理
+
+    策略查無報價時不會提早平倉，持倉會在換倉 / 結算日平倉；該腳在某日沒有資料列時，
+    補一列收盤價為缺價的資料 (與期交所結算日「有列、無成交」的原始資料相同)。
+    """
+    df = df_opt.copy()
+    dates = pd.to_datetime(df['交易日期'])
+    trade_dates = np.sort(dates.unique())
+    expiry = df['到期月份(週別)'].astype(str).str.strip()
+    strike = pd.to_numeric(df['履約價'], errors='coerce')
+    is_call = (df['買賣權'] == CALL_LABEL).to_numpy()
+    drop = np.zeros(len(df), dtype=bool)
+    added = []
+    for _, trade in history.iterrows():
+        contract = str(trade['contract'])
+        last_day = pd.Timestamp(get_expiry_date_cached(contract)).normalize()
+        for leg in trade['legs']:
+            same = ((expiry == contract) & (strike == float(leg['strike']))).to_numpy() \
+                   & (is_call == (leg['type'] == 'call'))
+            held = same & ((dates > trade['entry_date']) & (dates <= last_day)).to_numpy()
+            drop |= held
+            template = df.iloc[[np.flatnonzero(same)[-1]]]
+            days = trade_dates[(trade_dates > trade['entry_date']) & (trade_dates <= last_day)]
+            for day in np.setdiff1d(days, dates[held].unique()):
+                added.append(template.assign(交易日期=pd.Timestamp(day)))
+    close = pd.to_numeric(df['收盤價'], errors='coerce')
+    df['收盤價'] = close.mask(drop)
+    if added:
+        extra = pd.concat(added, ignore_index=True)
+        extra['收盤價'] = np.nan
+        if '成交量' in extra:
+            extra['成交量'] = 0
+        df = pd.concat([df, extra], ignore_index=True).sort_values('交易日期', kind='stable', ignore_index=True)
+    return df
+
+
+def compare_replay(make_strategy, df_opt, df_fut, start_date, end_date, missing_quotes=True, **kwargs) -> pd.DataFrame:
+    """
+    重播與回測的一致性檢查：同一份資料分別以 BacktestExecutor 與 run_replay 執行，比較交易紀錄
+
+    參數:
+        make_strategy (callable): 每次呼叫回傳一個新的策略物件 (兩邊不可共用狀態)
+        missing_quotes (bool): 另以 drop_held_quotes() 拿掉持倉期間的報價再比較一次 (檢查缺價的處理)
+        kwargs: 傳給 run_replay (latency, n_batches, balance ...)
+    回傳:
+        DataFrame: 不一致的交易 (case, row, column, backtest, replay)；空表示一致
+    """
+    balance = kwargs.get('balance', 2_000_000)
+    journal = kwargs.pop('journal', None) or get_journal()
+    cases = [('quoted', df_opt)]
+    rows = []
+    while cases:
+        case, data = cases.pop(0)
+        executor = BacktestExecutor(make_strategy(), start_date, end_date, data, df_fut,
+                                    balance=balance, journal=new_journal_like(journal))
+        expected = executor.run()
+        actual, runner = run_replay(make_strategy(), data, df_fut, start_date, end_date,
+                                    journal=new_journal_like(journal), **kwargs)
+        if len(expected) != len(actual):
+            rows.append({'case': case, 'row': None, 'column': 'n_trades',
+                         'backtest': len(expected), 'replay': len(actual)})
+        for i in range(min(len(expected), len(actual))):
+            for col in ('entry_date', 'exit_date', 'qty', 'pnl', 'balance'):
+                a, b = expected[col].iloc[i], actual[col].iloc[i]
+                if not (a == b or (isinstance(a, float) and np.isclose(a, b))):
+                    rows.append({'case': case, 'row': i, 'column': col, 'backtest': a, 'replay': b})
+        if not np.isclose(executor.balance, runner.balance):
+            rows.append({'case': case, 'row': None, 'column': 'final_balance',
+                         'backtest': executor.balance, 'replay': runner.balance})
+        if missing_quotes and case == 'quoted' and len(expected):
+            cases.append(('missing_quotes', drop_held_quotes(data, expected)))
+    return pd.DataFrame(rows, columns=['case', 'row', 'column', 'backtest', 'replay'])
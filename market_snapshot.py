@@ -0,0 +1,327 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, NamedTuple, Optional
+
+
+# ==========================================
+# 欄位對照 (Snapshot 內部名稱 <-> 舊版 DataFrame 欄位)
+# ==========================================
+# 數值欄位：全部以 float64 NumPy 陣列保存
+FRAME_COLUMN_MAP = {
+    'strike': '履約價',
+    'close': '收盤價',
+    'settle': '結算價',
+    'dT': 'dT',
+    'iv': 'Implied_Volatility',
+    'delta': 'Delta',
+    'gamma': 'Gamma',
+    'theta': 'Theta',
+    'vega': 'Vega',
+    'itm_prob': 'Itm_Prob',
+}
+
+# 選用的流動性欄位 (成交模型用)：原始資料沒有時為 NaN
+QUOTE_COLUMN_MAP = {
+    'bid': '最後最佳買價',
+    'ask': '最後最佳賣價',
+    'volume': '成交量',
+    'oi': '未沖銷契約數',
+}
+
+CALL_LABEL = '買權'
+PUT_LABEL = '賣權'
+
+
+class OptionQuote(NamedTuple):
+    """單一合約報價 (由 MarketSnapshot.quote 回傳)"""
+    expiry: str
+    strike: float
+    opt_type: str
+    close: float
+    settle: float
+    dT: float
+    iv: float
+    delta: float
+    gamma: float
+    theta: float
+    vega: float
+    itm_prob: float
+
+
+class OptionChain:
+    """
+    單一到期月份、單一買賣權的報價鏈 (依履約價由小到大排序)
+
+    欄位以屬性存取，回傳的是 Snapshot 內部陣列的 view (不複製)：
+        chain.strike, chain.close, chain.delta, chain.iv ...
+    """
+    def __init__(self, expiry: str, opt_type: str, columns: Dict[str, np.ndarray]):
+        self.expiry = expiry
+        self.opt_type = opt_type
+        self._cols = columns
+
+    def __getattr__(self, name):
+        cols = self.__dict__.get('_cols')
+        if cols is not None and name in cols:
+            return cols[name]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return len(self._cols['strike'])
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._cols.keys())
+
+    def index_of(self, strike: float, tol: float = 1e-6) -> int:
+        """以二分搜尋找出履約價位置，找不到回傳 -1"""
+        strikes = self._cols['strike']
+        i = int(np.searchsorted(strikes, strike - tol, side='left'))
+        if i < len(strikes) and abs(strikes[i] - strike) <= tol:
+            return i
+        return -1
+
+    def row(self, i: int) -> OptionQuote:
+        c = self._cols
+        return OptionQuote(self.expiry, float(c['strike'][i]), self.opt_type,
+                           *(float(c[name][i]) for name in OptionQuote._fields[3:]))
+
+    def quote(self, strike: float, tol: float = 1e-6) -> Optional[OptionQuote]:
+        i = self.index_of(strike, tol)
+        return self.row(i) if i >= 0 else None
+
+
+class MarketSnapshot:
+    """
+    單日 (或單一 bar) 的市場快照，策略端與 Executor 的標準 market_data 型別
+
+    內部以 NumPy 欄位保存，依 (到期月份, 買/賣權, 履約價) 排序並記錄每組的切片位置，
+    因此 chain() / quote() 只需要切片與二分搜尋，不會建立任何 DataFrame。
+
+    向下相容：
+        date, S, calls, puts = snapshot
+    仍然可以使用 (calls/puts 會在第一次存取時由 to_frame() 建立並快取)。
+    """
+    def __init__(self, date, S: float, columns: Dict[str, np.ndarray],
+                 expiry: np.ndarray, is_call: np.ndarray,
+                 source: Optional[pd.DataFrame] = None, rows: Optional[np.ndarray] = None):
+        """
+        參數:
+            date: 交易日期
+            S (float): 標的價格
+            columns (dict): FRAME_COLUMN_MAP (與選用的 QUOTE_COLUMN_MAP) 中的數值欄位 -> 陣列 (長度一致)
+            expiry (ndarray[str]): 每列的到期月份(週別)
+            is_call (ndarray[bool]): 每列是否為買權
+            source (DataFrame): 原始選擇權資料表 (to_frame 用來還原完整欄位，可為 None)
+            rows (ndarray[int]): 每列在 source 中的位置 (iloc)
+        """
+        self.date = pd.Timestamp(date)
+        self.S = float(S)
+
+        # 依 (到期月份, 賣權在後, 履約價) 穩定排序；同履約價重複列保留原始順序
+        order = np.lexsort((columns['strike'], ~is_call, expiry))
+        self._cols = {name: np.asarray(arr, dtype=float)[order] for name, arr in columns.items()}
+        self._expiry = np.asarray(expiry)[order]
+        self._is_call = np.asarray(is_call, dtype=bool)[order]
+        self._rows = None if rows is None else np.asarray(rows)[order]
+        self._source = source
+        self._frames = None
+
+        # 每個 (到期月份, 'call'/'put') 的切片位置
+        self._slices = {}
+        n = len(self._expiry)
+        if n:
+            key_change = np.flatnonzero((self._expiry[1:] != self._expiry[:-1]) |
+                                        (self._is_call[1:] != self._is_call[:-1])) + 1
+            starts = np.concatenate(([0], key_change))
+            ends = np.concatenate((key_change, [n]))
+            for a, b in zip(starts, ends):
+                opt_type = 'call' if self._is_call[a] else 'put'
+                self._slices[(str(self._expiry[a]), opt_type)] = slice(int(a), int(b))
+        self._expiries = sorted({k[0] for k in self._slices})
+
+    # ==========================================
+    # 建構 (由舊版 DataFrame 轉換)
+    # ==========================================
+    @classmethod
+    def from_frames(cls, date, S, calls: pd.DataFrame, puts: pd.DataFrame) -> 'MarketSnapshot':
+        """由舊版 (date, S, calls, puts) 的 DataFrame 建立快照 (僅供相容用途)"""
+        frame = pd.concat([calls, puts])
+        n = len(frame)
+        columns = {}
+        for name, col in FRAME_COLUMN_MAP.items():
+            columns[name] = (frame[col].to_numpy(dtype=float) if col in frame.columns
+                             else np.full(n, np.nan))
+        for name, col in QUOTE_COLUMN_MAP.items():
+            if col in frame.columns:
+                columns[name] = pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=float)
+        if '買賣權' in frame.columns:
+            is_call = (frame['買賣權'] == CALL_LABEL).to_numpy()
+        else:
+            is_call = np.concatenate((np.ones(len(calls), bool), np.zeros(len(puts), bool)))
+        if '到期月份(週別)' in frame.columns:
+            expiry = frame['到期月份(週別)'].astype(str).to_numpy()
+        else:
+            expiry = np.full(n, '', dtype=object)
+        snap = cls(date, S, columns, expiry, is_call, source=frame, rows=np.arange(n))
+        snap._frames = (calls, puts)
+        return snap
+
+    @classmethod
+    def coerce(cls, market_data) -> 'MarketSnapshot':
+        """接受 MarketSnapshot 或舊版 tuple，一律回傳 MarketSnapshot"""
+        if isinstance(market_data, cls):
+            return market_data
+        date, S, calls, puts = market_data
+        return cls.from_frames(date, S, calls, puts)
+
+    # ==========================================
+    # 快速存取
+    # ==========================================
+    @property
+    def expiries(self) -> List[str]:
+        """當日有報價的到期月份(週別)，已排序"""
+        return self._expiries
+
+    def __len__(self):
+        # 舊版 tuple 相容：(date, S, calls, puts)
+        return 4
+
+    @property
+    def n_rows(self) -> int:
+        return len(self._expiry)
+
+    def has_expiry(self, expiry: str) -> bool:
+        return (expiry, 'call') in self._slices or (expiry, 'put') in self._slices
+
+    def chain(self, expiry: str, opt_type: str) -> OptionChain:
+        """取得指定到期月份與買賣權 ('call'/'put') 的報價鏈，無資料時回傳空的 chain"""
+        sl = self._slices.get((expiry, opt_type), slice(0, 0))
+        return OptionChain(expiry, opt_type, {name: arr[sl] for name, arr in self._cols.items()})
+
+    def quote(self, expiry: str, strike: float, opt_type: str, tol: float = 1e-6) -> Optional[OptionQuote]:
+        """精準查價：月份、履約價、買賣權必須完全吻合，查無資料回傳 None"""
+        sl = self._slices.get((expiry, opt_type))
+        if sl is None:
+            return None
+        strikes = self._cols['strike'][sl]
+        i = int(np.searchsorted(strikes, strike - tol, side='left'))
+        if i >= len(strikes) or abs(strikes[i] - strike) > tol:
+            return None
+        j = sl.start + i
+        c = self._cols
+        return OptionQuote(expiry, float(c['strike'][j]), opt_type,
+                           *(float(c[name][j]) for name in OptionQuote._fields[3:]))
+
+    def locate(self, expiry: str, strikes, opt_types, tol: float = 1e-6) -> np.ndarray:
+        """
+        批次查價位置：每個 (履約價, 買賣權) 在內部欄位中的列位置，查無資料為 -1
+        (成交模型以此一次取出整張單各腳的報價欄位)
+        """
+        strikes = np.asarray(strikes, dtype=float)
+        opt_types = np.asarray(opt_types)
+        rows = np.full(len(strikes), -1, dtype=np.int64)
+        for opt_type in ('call', 'put'):
+            sl = self._slices.get((expiry, opt_type))
+            legs = np.flatnonzero(opt_types == opt_type)
+            if sl is None or not legs.size:
+                continue
+            chain = self._cols['strike'][sl]
+            i = np.searchsorted(chain, strikes[legs] - tol, side='left')
+            j = np.minimum(i, len(chain) - 1)
+            found = (i < len(chain)) & (np.abs(chain[j] - strikes[legs]) <= tol)
+            rows[legs[found]] = sl.start + j[found]
+        return rows
+
+    def column(self, name: str) -> np.ndarray:
+        """整日的單一欄位 (依內部排序)"""
+        return self._cols[name]
+
+    def take(self, name: str, rows) -> np.ndarray:
+        """
+        依 locate() 的列位置取欄位值，查無報價 (row < 0) 或快照沒有該欄位時為 NaN
+        (成交模型、避險模組以此一次取出多腳的報價)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        col = self._cols.get(name)
+        if col is None or not len(col):
+            return np.full(len(rows), np.nan)
+        return np.where(rows >= 0, col[np.maximum(rows, 0)], np.nan)
+
+    def contract_keys(self):
+        """每列的 (到期月份, 是否為買權) 陣列 (依內部排序，與 column() 對齊)"""
+        return self._expiry, self._is_call
+
+    # ==========================================
+    # 舊版相容 (DataFrame)
+    # ==========================================
+    def to_frame(self):
+        """
+        還原舊版的 (calls, puts) DataFrame (含 T, dT, IV 與 Greeks 欄位)，結果會快取
+
+        若快照保有原始資料表 (source)，會保留原始欄位與 index，列順序與舊版 get_greeks 相同。
+        """
+        if self._frames is None:
+            self._frames = (self._build_frame(True), self._build_frame(False))
+        return self._frames
+
+    def _build_frame(self, call: bool) -> pd.DataFrame:
+        sel = np.flatnonzero(self._is_call == call)
+        if self._source is not None and self._rows is not None:
+            sel = sel[np.argsort(self._rows[sel], kind='stable')]
+            frame = self._source.iloc[self._rows[sel]].copy()
+        else:
+            frame = pd.DataFrame({
+                '交易日期': np.full(len(sel), self.date),
+                '到期月份(週別)': self._expiry[sel],
+                '買賣權': CALL_LABEL if call else PUT_LABEL,
+            })
+        for name in ('strike', 'close', 'settle'):
+            if FRAME_COLUMN_MAP[name] not in frame.columns:
+                frame[FRAME_COLUMN_MAP[name]] = self._cols[name][sel]
+        # 舊版 get_greeks 的欄位順序：T, dT, Implied_Volatility, Delta, Gamma, Theta, Vega, Itm_Prob
+        if 'T' not in frame.columns:
+            frame['T'] = pd.to_datetime([_expiry_timestamp(e) for e in self._expiry[sel]])
+        for name in ('dT', 'iv', 'delta', 'gamma', 'theta', 'vega', 'itm_prob'):
+            frame[FRAME_COLUMN_MAP[name]] = self._cols[name][sel]
+        return frame
+
+    def __iter__(self):
+        calls, puts = self.to_frame()
+        return iter((self.date, self.S, calls, puts))
+
+    def __getitem__(self, i):
+        if i == 0 or i == -4:
+            return self.date
+        if i == 1 or i == -3:
+            return self.S
+        return tuple(self)[i]
+
+    def __getstate__(self):
+        # 跨行程傳遞時不帶原始大表與快取的 DataFrame
+        state = self.__dict__.copy()
+        state['_source'] = None
+        state['_frames'] = None
+        return state
+
+    def clear_frames(self):
+        """丟棄 to_frame() 快取的 DataFrame (快照由多次回測共用時，避免記憶體累積與前一次回測的修改殘留)"""
+        self._frames = None
+
+    def attach_source(self, source: pd.DataFrame):
+        """重新掛上原始資料表 (跨行程傳回後，讓 to_frame 還原完整欄位)"""
+        self._source = source
+        self._frames = None
+
+    def __repr__(self):
+        return f"MarketSnapshot({self.date.date()}, S={self.S:.1f}, expiries={len(self._expiries)}, rows={self.n_rows})"
+
+
+def _expiry_timestamp(contract_str):
+    # 延遲匯入避免循環 (utils 會匯入本模組)
+    from utils import get_expiry_date_cached
+    return get_expiry_date_cached(contract_str)
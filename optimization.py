@@ -0,0 +1,492 @@
+import hashlib
+import itertools
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils import BacktestExecutor, OptionDataIndex, market_data_generator, stable_repr
+from profiling import NULL_PROFILER
+from event_journal import EventJournal, get_journal, DATA, WARNING
+
+
+# ==========================================
+# 快取 (Greeks 只算一次，同一組回測只跑一次)
+# ==========================================
+def data_fingerprint(df_opt, df_fut) -> str:
+    """資料指紋 (內容雜湊)：資料變動時快取與紀錄不會被誤用"""
+    h = hashlib.sha1()
+    for df in (df_opt, df_fut):
+        if df is None:
+            continue
+        h.update(str((df.shape, list(df.columns))).encode())
+        h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+class SnapshotCache:
+    """
+    MarketSnapshot 快取，作為 BacktestExecutor 的 market_data 使用：
+        BacktestExecutor(strategy, start, end, df_opt, df_fut, market_data=cache)
+
+    同一交易日的 IV/Greeks 只計算一次；不同回測區間與參數組合共用，
+    重疊的區間不會重算 (只補算尚未計算過的日子)。
+    快照交給回測處理完該 K 棒後即清除 to_frame() 的 DataFrame 快取，記憶體不會隨掃描次數增加。
+    approx_greeks (greeks_grid.ApproxGreeks) 不為 None 時以近似模式計算 IV/Greeks。
+    """
+    def __init__(self, df_opt, df_fut, risk_free_rate: float = 0.01, approx_greeks=None):
+        self.df_opt = df_opt
+        self.df_fut = df_fut
+        self.risk_free_rate = risk_free_rate
+        self.approx_greeks = approx_greeks
+        self.trade_dates = pd.DatetimeIndex(sorted(pd.to_datetime(df_fut['交易日期'].unique())))
+        self.snapshots = {}    # date -> MarketSnapshot
+        self.computed = set()  # 已計算過的交易日 (含無資料而略過的日子)
+        self._opt_index = None
+
+    def _dates(self, start, end) -> pd.DatetimeIndex:
+        return self.trade_dates[(self.trade_dates >= pd.Timestamp(start)) & (self.trade_dates <= pd.Timestamp(end))]
+
+    def ensure(self, start, end, profiler=NULL_PROFILER, journal=None):
+        """補算區間內尚未計算的交易日"""
+        missing = [d for d in self._dates(start, end) if d not in self.computed]
+        if not missing:
+            return
+        if self._opt_index is None:
+            self._opt_index = OptionDataIndex(self.df_opt)
+        # 依連續的缺漏區段補算，已算過的日子不會重算
+        pos = self.trade_dates.get_indexer(missing)
+        for run in np.split(np.asarray(missing, dtype=object), np.flatnonzero(np.diff(pos) > 1) + 1):
+            for snapshot in market_data_generator(run[0], run[-1], self.df_opt, self.df_fut,
+                                                  self.risk_free_rate, opt_index=self._opt_index,
+                                                  profiler=profiler, journal=journal,
+                                                  approx_greeks=self.approx_greeks):
+                self.snapshots.setdefault(snapshot.date, snapshot)
+            self.computed.update(run)
+
+    def __call__(self, start_date, end_date, profiler=NULL_PROFILER, journal=None):
+        self.ensure(start_date, end_date, profiler, journal)
+        for date in self._dates(start_date, end_date):
+            snapshot = self.snapshots.get(date)
+            if snapshot is not None:
+                try:
+                    yield snapshot
+                finally:
+                    # 快照由所有回測共用：處理完這根 K 棒就丟掉 to_frame() 建立的 DataFrame
+                    # (舊版策略 tuple 解包會建立；策略若修改了這些 DataFrame，也不會影響下一次回測)
+                    snapshot.clear_frames()
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def save(self, path: str):
+        """存到磁碟 (快照不含原始大表，載入時重新掛上)"""
+        with open(path, 'wb') as f:
+            pickle.dump({'fingerprint': data_fingerprint(self.df_opt, self.df_fut),
+                         'risk_free_rate': self.risk_free_rate,
+                         'approx_greeks': repr(self.approx_greeks),
+                         'computed': self.computed, 'snapshots': self.snapshots}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, path: str) -> bool:
+        """載入磁碟快取；資料指紋、利率或近似模式設定不同時不載入並回傳 False"""
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if (state['fingerprint'] != data_fingerprint(self.df_opt, self.df_fut)
+                or state['risk_free_rate'] != self.risk_free_rate
+                or state.get('approx_greeks', repr(None)) != repr(self.approx_greeks)):
+            return False
+        for snapshot in state['snapshots'].values():
+            snapshot.attach_source(self.df_opt)
+        self.snapshots.update(state['snapshots'])
+        self.computed.update(state['computed'])
+        return True
+
+
+class BacktestResult(NamedTuple):
+    params: Dict
+    start: pd.Timestamp
+    end: pd.Timestamp
+    initial_balance: float
+    history: pd.DataFrame      # 交易紀錄 (BacktestExecutor.run() 的輸出)
+    equity: pd.DataFrame       # 權益曲線 (BacktestExecutor.equity_frame())
+    stopped: Optional[str] = None  # 被 stop_rule 提前結束的原因
+    hedges: Optional[pd.DataFrame] = None  # 期貨避險紀錄 (BacktestExecutor.hedge_frame())
+
+    @property
+    def final_equity(self) -> float:
+        return float(self.equity['equity'].iloc[-1]) if len(self.equity) else float(self.initial_balance)
+
+
+class BacktestRunner:
+    """
+    以快取執行回測：快照由 SnapshotCache 共用，同一 (參數, 區間, 初始資金) 的結果只跑一次
+
+    參數:
+        strategy_cls: 策略類別，以 strategy_cls(**params) 建立
+        cache_dir (str): 快取目錄 (None 則只存在記憶體)；存在時自動載入，save() 寫回
+        fill_model (FillModel): 每次回測使用的成交模型 (None 則以收盤價成交、不計費用)
+        indicators (callable): 每次回測建立指標層的函式，例如 indicators.MarketIndicators 或
+                               functools.partial(MarketIndicators, rank_window=120) (None 則不提供指標)
+    結果快取以參數、區間、初始資金與 stop_rule / 元件的 repr 為鍵；repr 含記憶體位址 (例如 lambda) 時不快取。
+        approx_greeks (ApproxGreeks): 以近似模式計算快照的 IV/Greeks (greeks_grid)，None 則為精確解
+        hedger (DeltaHedger): 每次回測使用的期貨 Delta 避險 (hedging)，None 則不避險
+        registry (RunRegistry): 新跑完的回測寫入紀錄庫 (run_registry)，None 則不寫入
+        tags (dict): 寫入紀錄庫時附加的標籤
+    """
+    def __init__(self, strategy_cls, df_opt, df_fut, risk_free_rate: float = 0.01, cache_dir: Optional[str] = None,
+                 fill_model=None, indicators=None, approx_greeks=None, hedger=None,
+                 registry=None, tags=None):
+        self.strategy_cls = strategy_cls
+        self.df_opt = df_opt
+        self.df_fut = df_fut
+        self.snapshots = SnapshotCache(df_opt, df_fut, risk_free_rate, approx_greeks)
+        self.results = {}
+        self.cache_dir = cache_dir
+        self.fill_model = fill_model
+        self.indicators = indicators
+        self.hedger = hedger
+        self.registry = registry
+        self.tags = tags
+        self._fingerprint = None
+        if cache_dir:
+            self.snapshots.load(os.path.join(cache_dir, 'snapshots.pkl'))
+            self._load_results()
+
+    def _key(self, params, start, end, balance, stop_rule=None):
+        """結果快取鍵；stop_rule 或元件的 repr 不穩定 (含記憶體位址) 時回傳 None，該次回測不快取"""
+        parts = [stable_repr(obj) for obj in (stop_rule, self.fill_model, self.indicators, self.hedger)]
+        if None in parts:
+            return None
+        return (tuple(sorted(params.items())), pd.Timestamp(start), pd.Timestamp(end), balance, *parts)
+
+    def cached(self, params: Dict, start, end, balance=2_000_000, stop_rule=None) -> Optional[BacktestResult]:
+        key = self._key(params, start, end, balance, stop_rule)
+        return None if key is None else self.results.get(key)
+
+    def run(self, params: Dict, start, end, balance=2_000_000, stop_rule=None) -> BacktestResult:
+        key = self._key(params, start, end, balance, stop_rule)
+        result = None if key is None else self.results.get(key)
+        if result is None:
+            executor = BacktestExecutor(self.strategy_cls(**params), start, end, self.df_opt, self.df_fut, balance,
+                                        journal=EventJournal(level=WARNING), market_data=self.snapshots,
+                                        stop_rule=stop_rule, fill_model=self.fill_model,
+                                        indicators=self.indicators() if self.indicators else None,
+                                        hedger=self.hedger)
+            history = executor.run()
+            result = BacktestResult(dict(params), pd.Timestamp(start), pd.Timestamp(end), balance,
+                                    history, executor.equity_frame(), executor.stopped,
+                                    executor.hedge_frame() if self.hedger is not None else None)
+            self.store(key, result)
+        return result
+
+    @property
+    def fingerprint(self) -> str:
+        """資料指紋 (第一次使用時計算)"""
+        if self._fingerprint is None:
+            self._fingerprint = data_fingerprint(self.df_opt, self.df_fut)
+        return self._fingerprint
+
+    def store(self, key, result: BacktestResult):
+        """保存一次新的回測結果 (背景行程跑完的結果也經由此處)，有紀錄庫時一併寫入；key 為 None 時不快取"""
+        if key is not None:
+            self.results[key] = result
+        if self.registry is not None:
+            self.registry.record(self.strategy_cls, result, self.fingerprint, self.tags)
+
+    def _results_path(self):
+        return os.path.join(self.cache_dir, 'results.pkl')
+
+    def _load_results(self):
+        path = self._results_path()
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state['strategy'] == self.strategy_cls.__name__ and \
+                state['fingerprint'] == data_fingerprint(self.df_opt, self.df_fut) and \
+                state.get('approx_greeks', repr(None)) == repr(self.snapshots.approx_greeks):
+            self.results.update(state['results'])
+
+    def save(self):
+        """將快照與回測結果寫入 cache_dir"""
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.snapshots.save(os.path.join(self.cache_dir, 'snapshots.pkl'))
+        with open(self._results_path(), 'wb') as f:
+            pickle.dump({'strategy': self.strategy_cls.__name__,
+                         'fingerprint': data_fingerprint(self.df_opt, self.df_fut),
+                         'approx_greeks': repr(self.snapshots.approx_greeks),
+                         'results': self.results}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# ==========================================
+# 評分函式 (參數 BacktestResult，越大越好)
+# ==========================================
+def max_drawdown(equity) -> float:
+    """最大回撤 (比例，0 ~ 1)"""
+    equity = np.asarray(equity, dtype=float)
+    if not equity.size:
+        return 0.0
+    peak = np.maximum.accumulate(equity)
+    return float(np.max(1 - equity / peak))
+
+
+def total_pnl(result: BacktestResult) -> float:
+    return result.final_equity - result.initial_balance
+
+
+def sharpe_ratio(result: BacktestResult, periods: int = 252) -> float:
+    """年化 Sharpe (以權益曲線的逐日報酬計算，不扣無風險利率)"""
+    equity = result.equity['equity'].to_numpy(float)
+    if equity.size < 2:
+        return 0.0
+    ret = np.diff(equity) / equity[:-1]
+    std = ret.std()
+    return float(ret.mean() / std * np.sqrt(periods)) if std > 0 else 0.0
+
+
+def param_combinations(param_grid) -> List[Dict]:
+    """{'leverage': [1, 3], 'target_delta': [0.2, 0.3]} -> 所有組合的 list；已是 list of dict 則原樣回傳"""
+    if isinstance(param_grid, dict):
+        names = list(param_grid)
+        return [dict(zip(names, values)) for values in itertools.product(*(param_grid[n] for n in names))]
+    return [dict(p) for p in param_grid]
+
+
+# ==========================================
+# Walk-Forward 最佳化
+# ==========================================
+def walk_forward_windows(start_date, end_date, train_months: int = 24, test_months: int = 6,
+                         step_months: Optional[int] = None, anchored: bool = False) -> pd.DataFrame:
+    """
+    切出訓練 / 測試區間
+
+    參數:
+        step_months (int): 每次往前推進的月數 (預設 = test_months，測試區間首尾相接)
+        anchored (bool): True 則訓練區間起點固定在 start_date (擴張視窗)，否則為滾動視窗
+
+    回傳:
+        DataFrame: train_start, train_end, test_start, test_end
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    step = pd.DateOffset(months=step_months or test_months)
+    one_day = pd.Timedelta(days=1)
+    rows = []
+    train_start = start
+    test_start = start + pd.DateOffset(months=train_months)
+    while test_start <= end:
+        test_end = min(test_start + pd.DateOffset(months=test_months) - one_day, end)
+        rows.append((start if anchored else train_start, test_start - one_day, test_start, test_end))
+        train_start += step
+        test_start += step
+    return pd.DataFrame(rows, columns=['train_start', 'train_end', 'test_start', 'test_end'])
+
+
+class WalkForwardResult(NamedTuple):
+    windows: pd.DataFrame       # 每個視窗的區間、最佳參數、訓練分數與樣本外損益
+    evaluations: pd.DataFrame   # 每個視窗 x 參數組合的訓練分數
+    oos_equity: pd.DataFrame    # 串接後的樣本外權益曲線：date, equity, window
+    oos_trades: pd.DataFrame    # 樣本外交易紀錄 (含 window 欄位)
+
+
+def walk_forward(runner: BacktestRunner, param_grid, start_date, end_date, train_months: int = 24,
+                 test_months: int = 6, step_months: Optional[int] = None, anchored: bool = False,
+                 objective: Callable[[BacktestResult], float] = total_pnl, balance=2_000_000,
+                 compound: bool = True, journal=None) -> WalkForwardResult:
+    """
+    Walk-Forward 最佳化：每個訓練區間挑出 objective 最高的參數，套用到緊接的測試區間，
+    再把各測試區間的權益曲線串接成一條樣本外曲線。
+
+    Greeks 由 runner 的 SnapshotCache 共用 (整段只算一次)；相同 (參數, 區間) 的回測結果直接取用快取，
+    例如 step_months < test_months 或 anchored 造成的重複區間不會重跑。
+
+    參數:
+        compound (bool): True 則下一個測試區間以前一區間結束時的權益 (持倉以市值計) 作為起始資金
+    """
+    journal = journal or get_journal()
+    combos = param_combinations(param_grid)
+    windows = walk_forward_windows(start_date, end_date, train_months, test_months, step_months, anchored)
+    journal.info(DATA, "--- Walk-Forward | {n_windows} 個視窗 x {n_params} 組參數 ---",
+                 n_windows=len(windows), n_params=len(combos))
+
+    evaluations, window_rows, equity_parts, trade_parts = [], [], [], []
+    equity_now = balance
+    for w, win in windows.iterrows():
+        scores = []
+        for params in combos:
+            score = objective(runner.run(params, win.train_start, win.train_end, balance))
+            scores.append(score)
+            evaluations.append({'window': w, **params, 'score': score})
+        valid = ~np.isnan(np.asarray(scores, dtype=float))
+        if not valid.any():
+            # 所有參數的訓練分數都是 NaN (例如訓練區間沒有交易)：不選參數，略過樣本外區間
+            window_rows.append({**win.to_dict(), 'best_params': None, 'train_score': np.nan,
+                                'oos_pnl': np.nan, 'oos_max_drawdown': np.nan})
+            journal.warning(DATA, ">> 視窗 {window}: 訓練分數皆為 NaN，略過樣本外 {test_start:%Y-%m-%d} ~ {test_end:%Y-%m-%d}",
+                            window=w, test_start=win.test_start, test_end=win.test_end)
+            continue
+        best = combos[int(np.nanargmax(scores))]
+
+        start_balance = equity_now if compound else balance
+        oos = runner.run(best, win.test_start, win.test_end, start_balance)
+        eq = oos.equity
+        if len(eq):
+            # 以權益變動量串接，避免各視窗起始資金不同造成跳動
+            steps = np.diff(eq['equity'].to_numpy(float), prepend=start_balance)
+            equity_parts.append(pd.DataFrame({'date': eq['date'].to_numpy(), 'change': steps, 'window': w}))
+        if len(oos.history):
+            trade_parts.append(oos.history.assign(window=w))
+        equity_now += total_pnl(oos)
+        window_rows.append({**win.to_dict(), 'best_params': best, 'train_score': float(np.nanmax(scores)),
+                            'oos_pnl': total_pnl(oos), 'oos_max_drawdown': max_drawdown(eq['equity'])})
+        journal.info(DATA, ">> 視窗 {window}: {test_start:%Y-%m-%d} ~ {test_end:%Y-%m-%d} | 參數 {params} | 樣本外損益 {pnl:.0f}",
+                     window=w, test_start=win.test_start, test_end=win.test_end, params=best, pnl=total_pnl(oos))
+
+    if equity_parts:
+        oos_equity = pd.concat(equity_parts, ignore_index=True)
+        oos_equity['equity'] = balance + oos_equity.pop('change').cumsum()
+        oos_equity = oos_equity[['date', 'equity', 'window']]
+    else:
+        oos_equity = pd.DataFrame(columns=['date', 'equity', 'window'])
+    oos_trades = pd.concat(trade_parts, ignore_index=True) if trade_parts else pd.DataFrame()
+    return WalkForwardResult(pd.DataFrame(window_rows), pd.DataFrame(evaluations), oos_equity, oos_trades)
+
+
+# ==========================================
+# 提前淘汰的參數搜尋 (Successive Halving)
+# ==========================================
+class EarlyStop:
+    """
+    回測中途停止條件 (BacktestExecutor 的 stop_rule)
+
+    參數:
+        min_equity (float): 權益低於初始資金的此倍數即停止 (例如 0.5 = 虧掉一半)
+        max_drawdown (float): 自權益高點的回撤超過此比例即停止
+    """
+    def __init__(self, min_equity: float = 0.5, max_drawdown: float = 0.5):
+        self.min_equity = min_equity
+        self.max_drawdown = max_drawdown
+
+    def __call__(self, executor) -> Optional[str]:
+        equity = executor.equity[-1][2]
+        if equity < executor.initial_balance * self.min_equity:
+            return f"權益 {equity:.0f} 低於初始資金的 {self.min_equity:.0%}"
+        if executor.peak_equity > 0 and 1 - equity / executor.peak_equity > self.max_drawdown:
+            return f"回撤 {1 - equity / executor.peak_equity:.1%} 超過 {self.max_drawdown:.0%}"
+        return None
+
+    def __repr__(self):
+        return f"EarlyStop(min_equity={self.min_equity}, max_drawdown={self.max_drawdown})"
+
+
+class SearchResult(NamedTuple):
+    best_params: Dict
+    leaderboard: pd.DataFrame   # 每一輪 x 候選的分數、是否被淘汰 / 提前停止 / 分數無效
+    days_simulated: int         # 實際模擬的交易日總數 (與完整網格的 grid_days 比較)
+    grid_days: int              # 完整網格 (所有組合跑完整區間) 需要的交易日總數
+
+
+_SEARCH_RUNNER = None  # 背景行程持有的 BacktestRunner
+
+
+def _search_init(runner):
+    global _SEARCH_RUNNER
+    _SEARCH_RUNNER = runner
+    runner.registry = None  # 結果送回主行程後才寫入紀錄庫，避免重複
+    for snapshot in runner.snapshots.snapshots.values():
+        snapshot.attach_source(runner.df_opt)
+
+
+def _search_run(params, start, end, balance, stop_rule):
+    return _SEARCH_RUNNER.run(params, start, end, balance, stop_rule)
+
+
+def successive_halving(runner: BacktestRunner, param_grid, start_date, end_date, rungs=(6, 12, 24, None),
+                       eta: int = 3, n_candidates: Optional[int] = None,
+                       objective: Callable[[BacktestResult], float] = total_pnl,
+                       stop_rule=EarlyStop(), workers: int = 1, balance=2_000_000, seed: int = 0,
+                       journal=None) -> SearchResult:
+    """
+    Successive Halving 參數搜尋：
+        1. 所有候選先跑最短的區間 (start ~ start + rungs[0] 個月)
+        2. 依 objective 排名保留前 1/eta，進入下一輪更長的區間；最後一輪 (None) 為完整區間
+        3. 權益或回撤觸發 stop_rule 的候選會在回測中途停止並直接淘汰；
+           objective 回傳 NaN / inf 的候選也淘汰 (leaderboard 的 invalid 欄為 True)
+    回傳的 best_params 為最深一輪中未被停止的最高分候選 (若最後一輪全數停止，取前一輪的領先者)。
+
+    快照由 runner 的 SnapshotCache 共用，後面的輪次只補算延長的部分；
+    workers > 1 時每輪的候選以多行程平行執行：完整區間的快照在主行程先算好，
+    背景行程只在建立時收到一次 runner (含快照)，所有輪次共用同一個 pool。
+
+    參數:
+        rungs (tuple): 每輪的區間長度 (月)，None 表示到 end_date
+        eta (int): 每輪保留 1/eta 的候選
+        n_candidates (int): 從網格中隨機抽樣的候選數 (None 則使用全部組合)
+        stop_rule: 中途停止條件 (None 則不提前停止)
+    """
+    journal = journal or get_journal()
+    combos = param_combinations(param_grid)
+    if n_candidates is not None and n_candidates < len(combos):
+        pick = np.random.default_rng(seed).choice(len(combos), n_candidates, replace=False)
+        combos = [combos[i] for i in sorted(pick)]
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    rung_ends = sorted({end if m is None else min(start + pd.DateOffset(months=m) - pd.Timedelta(days=1), end)
+                        for m in rungs})
+    n_full_days = len(runner.snapshots._dates(start, end))
+
+    rows, days_simulated = [], 0
+    survivors = list(range(len(combos)))
+    leader = None  # 最深一輪中仍存活的最高分候選
+    pool = None
+    if workers > 1 and len(combos) > 1:
+        # 完整區間的快照先算好，背景行程只在建立時收到一次 runner，之後各輪共用同一個 pool
+        runner.snapshots.ensure(start, end, journal=journal)
+    try:
+        for rung, rung_end in enumerate(rung_ends):
+            runner.snapshots.ensure(start, rung_end, journal=journal)
+            todo = [i for i in survivors if runner.cached(combos[i], start, rung_end, balance, stop_rule) is None]
+            fresh = {}  # 本輪背景行程跑完的結果 (不可快取的設定也不會在主行程重跑)
+            if workers > 1 and len(todo) > 1:
+                if pool is None:
+                    pool = ProcessPoolExecutor(min(workers, len(todo)), initializer=_search_init,
+                                               initargs=(runner,))
+                futures = {i: pool.submit(_search_run, combos[i], start, rung_end, balance, stop_rule) for i in todo}
+                for i, future in futures.items():
+                    fresh[i] = future.result()
+                    runner.store(runner._key(combos[i], start, rung_end, balance, stop_rule), fresh[i])
+            results = {i: fresh[i] if i in fresh else runner.run(combos[i], start, rung_end, balance, stop_rule)
+                       for i in survivors}
+            days_simulated += sum(len(results[i].equity) for i in todo)
+
+            raw = {i: (-np.inf if r.stopped else float(objective(r))) for i, r in results.items()}
+            # 非有限的分數 (例如報酬標準差為 0 時的 Sharpe) 無法排名：與提前停止的候選同樣淘汰，另外標記 invalid
+            invalid = {i for i in survivors if not results[i].stopped and not np.isfinite(raw[i])}
+            scores = {i: raw[i] if np.isfinite(raw[i]) else -np.inf for i in survivors}
+            ranked = sorted(survivors, key=lambda i: scores[i], reverse=True)
+            alive = [i for i in ranked if scores[i] > -np.inf]
+            keep = alive if rung == len(rung_ends) - 1 else alive[:max(1, int(np.ceil(len(alive) / eta)))]
+            if alive:
+                leader = alive[0]
+            for i in survivors:
+                rows.append({'rung': rung, 'end': rung_end, **combos[i], 'score': raw[i],
+                             'stopped': results[i].stopped, 'invalid': i in invalid, 'promoted': i in keep})
+            journal.info(DATA, ">> 第 {rung} 輪 (~{end:%Y-%m-%d}): {n} 個候選，提前停止 {n_stop}，"
+                         "分數無效 {n_invalid}，晉級 {n_keep}", rung=rung, end=rung_end, n=len(survivors),
+                         n_stop=len(survivors) - len(alive) - len(invalid), n_invalid=len(invalid),
+                         n_keep=len(keep))
+            survivors = keep
+            if not survivors:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    leaderboard = pd.DataFrame(rows)
+    best = combos[leader] if leader is not None else {}
+    return SearchResult(best, leaderboard, days_simulated, n_full_days * len(combos))
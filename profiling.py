@@ -0,0 +1,173 @@
+import time
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+class StageProfiler:
+    """
+    回測各階段的計時器與計數器
+
+    使用方式 (停用時 start() 只回傳 0.0，stop()/count() 只做一次旗標檢查)：
+        t = prof.start()
+        ... 工作 ...
+        prof.stop('iv', t)
+        prof.count('solver_fail', n)
+        prof.end_day(date)          # 結束一天，寫入逐日追蹤紀錄
+
+    階段名稱:
+        data     : 等待 generator 產出快照的總時間 (包含以下 slice/expiry/iv/greeks/snapshot)
+        slice    : 日期切片與欄位取值
+        expiry   : get_expiry_date / dT 計算
+        iv       : IV 反推 (py_lets_be_rational)
+        greeks   : Greeks 計算
+        snapshot : MarketSnapshot 建構 (排序與分組)
+        strategy : 策略 on_bar / on_rollover
+        execute  : _execute_signal
+    """
+    def __init__(self, enabled: bool = False, trace_path: Optional[str] = None):
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.trace = []
+        self._day = defaultdict(float)
+        self._wall_start = None
+        self._wall = 0.0
+
+    # ==========================================
+    # 計時與計數
+    # ==========================================
+    def start(self) -> float:
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, stage: str, t0: float):
+        if not self.enabled:
+            return
+        dt = time.perf_counter() - t0
+        self.totals[stage] += dt
+        self.calls[stage] += 1
+        self._day[stage] += dt
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        self.counters[name] += n
+        self._day[name] += n
+
+    def end_day(self, date):
+        """結束一個交易日 (只在指定 trace_path 時保留逐日紀錄)"""
+        if not self.enabled:
+            return
+        if self.trace_path is not None:
+            record = {'date': date}
+            record.update(self._day)
+            self.trace.append(record)
+        self._day = defaultdict(float)
+
+    def merge(self, other: 'StageProfiler'):
+        """併入另一個計時器的累計值 (背景工作各自計時，主執行緒依序合併)"""
+        if not self.enabled:
+            return
+        for stage, total in other.totals.items():
+            self.totals[stage] += total
+            self.calls[stage] += other.calls[stage]
+            self._day[stage] += total
+        for name, n in other.counters.items():
+            self.counters[name] += n
+            self._day[name] += n
+
+    def begin_run(self):
+        if self.enabled:
+            self._wall_start = time.perf_counter()
+
+    def end_run(self):
+        if self.enabled and self._wall_start is not None:
+            self._wall += time.perf_counter() - self._wall_start
+            self._wall_start = None
+
+    # ==========================================
+    # 報表
+    # ==========================================
+    def summary(self) -> pd.DataFrame:
+        """各階段耗時統計表 (pct 為佔整體 run() 時間的比例)"""
+        wall = self._wall or sum(self.totals[s] for s in ('data', 'strategy', 'execute'))
+        rows = []
+        for stage, total in self.totals.items():
+            n = self.calls[stage]
+            rows.append({
+                'stage': stage,
+                'calls': n,
+                'total_s': total,
+                'mean_ms': total / n * 1000 if n else 0.0,
+                'pct': total / wall * 100 if wall else 0.0,
+            })
+        return pd.DataFrame(rows, columns=['stage', 'calls', 'total_s', 'mean_ms', 'pct'])
+
+    def counters_frame(self) -> pd.Series:
+        return pd.Series(dict(self.counters), dtype=float)
+
+    def trace_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.trace)
+
+    def report(self) -> str:
+        """組合成可列印的效能報告文字；若有 trace_path 同時寫出逐日追蹤檔 (CSV)"""
+        days = self.counters.get('days', 0)
+        rows = self.counters.get('rows', 0)
+        lines = [f"--- 效能報告 | 總時間 {self._wall:.2f}s | 交易日 {days} 天 | 選擇權資料 {rows} 筆 ---"]
+        if self._wall > 0:
+            lines.append(f">> 吞吐量: {days / self._wall:.1f} 天/秒, {rows / self._wall:.0f} 筆/秒")
+        if days:
+            lines.append(f">> 平均每日 {rows / days:.0f} 筆")
+        lines.append(self.summary().to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+        extra = {k: v for k, v in self.counters.items() if k not in ('days', 'rows')}
+        if extra:
+            lines.append(">> 計數器: " + ", ".join(f"{k}={v}" for k, v in extra.items()))
+        if self.trace_path is not None and self.trace:
+            self.trace_frame().to_csv(self.trace_path, index=False)
+            lines.append(f">> 逐日追蹤已寫入 {self.trace_path}")
+        return "\n".join(lines)
+
+
+class LatencyRecorder:
+    """
+    逐筆延遲樣本 (即時交易用；StageProfiler 只保留總和，這裡保留每一筆以計算分位數)
+
+        rec.record('tick_to_order', seconds)
+        rec.summary()   # stage, n, mean_ms, p50_ms, p90_ms, p99_ms, max_ms
+    """
+    def __init__(self, capacity: int = 100_000):
+        self.capacity = capacity
+        self.samples = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        samples = self.samples[stage]
+        if len(samples) >= self.capacity:
+            # 超過容量時丟棄較舊的一半，保留近期樣本
+            del samples[:self.capacity // 2]
+        samples.append(seconds)
+
+    def summary(self) -> pd.DataFrame:
+        rows = []
+        for stage, samples in self.samples.items():
+            ms = np.asarray(samples) * 1000
+            rows.append({
+                'stage': stage,
+                'n': len(ms),
+                'mean_ms': ms.mean(),
+                'p50_ms': np.percentile(ms, 50),
+                'p90_ms': np.percentile(ms, 90),
+                'p99_ms': np.percentile(ms, 99),
+                'max_ms': ms.max(),
+            })
+        return pd.DataFrame(rows, columns=['stage', 'n', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'])
+
+    def report(self) -> str:
+        return "--- 延遲統計 (ms) ---\n" + self.summary().to_string(index=False, float_format=lambda x: f"{x:.3f}")
+
+
+# 停用狀態的共用實例 (generator 未指定 profiler 時使用)
+NULL_PROFILER = StageProfiler(enabled=False)
@@ -0,0 +1,151 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# ==========================================
+# 報酬序列 (由回測結果取得)
+# ==========================================
+def trade_returns(history: pd.DataFrame) -> np.ndarray:
+    """
+    每筆交易的報酬率 = pnl / 建倉前資金
+    (history['balance'] 為平倉後資金，建倉前資金 = balance - pnl)
+    """
+    pnl = history['pnl'].to_numpy(float)
+    before = history['balance'].to_numpy(float) - pnl
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = np.where(before > 0, pnl / before, 0.0)
+    return ret[np.isfinite(ret)]
+
+
+def daily_returns(equity: pd.DataFrame, column: str = 'equity') -> np.ndarray:
+    """權益曲線 (BacktestExecutor.equity_frame()) 的逐日報酬率"""
+    values = equity[column].to_numpy(float)
+    if values.size < 2:
+        return np.zeros(0)
+    ret = np.diff(values) / values[:-1]
+    return ret[np.isfinite(ret)]
+
+
+# ==========================================
+# 路徑模擬 (整批陣列運算)
+# ==========================================
+def _resample_index(rng, n_obs, n_paths, horizon, method, block):
+    """產生 [n_paths, horizon] 的抽樣位置"""
+    if method == 'reshuffle':
+        # 每條路徑是原序列的一個排列 (horizon 固定為 n_obs)
+        return np.argsort(rng.random((n_paths, n_obs)), axis=1)
+    if method == 'bootstrap':
+        return rng.integers(0, n_obs, size=(n_paths, horizon))
+    if method == 'block_bootstrap':
+        # 移動區塊 (循環)：每個區塊隨機起點，區塊內連續，保留報酬的自相關與波動聚集
+        block = max(1, min(block, n_obs))
+        n_blocks = -(-horizon // block)
+        starts = rng.integers(0, n_obs, size=(n_paths, n_blocks, 1))
+        idx = (starts + np.arange(block)) % n_obs
+        return idx.reshape(n_paths, n_blocks * block)[:, :horizon]
+    raise ValueError(f"未知的 method: {method}")
+
+
+def _simulate_chunk(returns, n_paths, horizon, method, block, ruin_level, seed):
+    """
+    模擬一批路徑 (權益以起始 = 1 計)
+
+    回傳:
+        (final[n], max_drawdown[n], ruined[n])
+    """
+    rng = np.random.default_rng(seed)
+    idx = _resample_index(rng, len(returns), n_paths, horizon, method, block)
+    equity = np.cumprod(1.0 + returns[idx], axis=1)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), 1.0)
+    drawdown = 1.0 - equity / peak
+    return equity[:, -1], drawdown.max(axis=1), equity.min(axis=1) <= ruin_level
+
+
+class RobustnessReport(NamedTuple):
+    method: str
+    final_balance: np.ndarray   # 每條路徑的期末資金
+    max_drawdown: np.ndarray    # 每條路徑的最大回撤 (比例)
+    ruined: np.ndarray          # 每條路徑是否曾跌破 ruin_level
+    initial_balance: float
+
+    @property
+    def ruin_probability(self) -> float:
+        return float(self.ruined.mean()) if self.ruined.size else 0.0
+
+    def summary(self, percentiles=(1, 5, 25, 50, 75, 95, 99)) -> pd.DataFrame:
+        """期末資金與最大回撤的分位數表"""
+        return pd.DataFrame({
+            'final_balance': np.percentile(self.final_balance, percentiles),
+            'max_drawdown': np.percentile(self.max_drawdown, percentiles),
+        }, index=pd.Index([f"p{p}" for p in percentiles], name='percentile'))
+
+    def report(self) -> str:
+        lines = [f"--- Monte Carlo ({self.method}) | {self.final_balance.size} 條路徑 ---",
+                 f">> 破產機率: {self.ruin_probability:.2%}",
+                 f">> 期末資金中位數: {np.median(self.final_balance):,.0f} (起始 {self.initial_balance:,.0f})",
+                 f">> 虧損機率: {(self.final_balance < self.initial_balance).mean():.2%}",
+                 self.summary().to_string(float_format=lambda x: f"{x:,.3f}")]
+        return "\n".join(lines)
+
+
+def monte_carlo(returns, n_paths: int = 20_000, method: str = 'block_bootstrap', block: int = 20,
+                horizon: Optional[int] = None, initial_balance: float = 2_000_000, ruin_level: float = 0.5,
+                chunk_size: int = 2_000, workers: int = 1, seed: int = 0) -> RobustnessReport:
+    """
+    以重抽樣的報酬序列模擬大量權益路徑
+
+    參數:
+        returns (array): 報酬率序列 (trade_returns() 或 daily_returns())
+        method (str):
+            'block_bootstrap': 移動區塊重抽樣 (適合逐日報酬，保留自相關)
+            'bootstrap'      : 逐筆重抽樣 (可重複)
+            'reshuffle'      : 重新排列順序 (期末資金不變，只看路徑風險，例如回撤)
+        block (int): 區塊長度
+        horizon (int): 每條路徑的長度 (None 則與原序列等長；reshuffle 固定為原長)
+        ruin_level (float): 權益跌破起始資金的此比例視為破產
+        chunk_size (int): 每批路徑數，記憶體約為 chunk_size x horizon x 8 bytes 的數倍
+        workers (int): 平行行程數 (各批使用獨立的亂數種子，結果與 workers 無關)
+    """
+    returns = np.asarray(returns, dtype=float)
+    if returns.size == 0:
+        raise ValueError("returns 為空，無法模擬")
+    horizon = len(returns) if horizon is None or method == 'reshuffle' else horizon
+
+    sizes = [min(chunk_size, n_paths - i) for i in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(returns, n, horizon, method, block, ruin_level, s) for n, s in zip(sizes, seeds)]
+    workers = min(workers, len(args), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(_simulate_chunk, *zip(*args)))
+    else:
+        parts = [_simulate_chunk(*a) for a in args]
+
+    final = np.concatenate([p[0] for p in parts]) * initial_balance
+    mdd = np.concatenate([p[1] for p in parts])
+    ruined = np.concatenate([p[2] for p in parts])
+    return RobustnessReport(method, final, mdd, ruined, initial_balance)
+
+
+def robustness_analysis(history: pd.DataFrame, equity: pd.DataFrame, n_paths: int = 20_000, block: int = 20,
+                        initial_balance: Optional[float] = None, ruin_level: float = 0.5, workers: int = 1,
+                        seed: int = 0) -> dict:
+    """
+    對一次回測結果做三種模擬：逐日報酬區塊重抽樣、交易重抽樣、交易重排
+
+    回傳:
+        dict: {'daily_block_bootstrap': RobustnessReport, 'trade_bootstrap': ..., 'trade_reshuffle': ...}
+    """
+    if initial_balance is None:
+        initial_balance = float(equity['equity'].iloc[0]) if len(equity) else 2_000_000
+    common = dict(n_paths=n_paths, initial_balance=initial_balance, ruin_level=ruin_level, workers=workers, seed=seed)
+    reports = {'daily_block_bootstrap': monte_carlo(daily_returns(equity), method='block_bootstrap', block=block, **common)}
+    trades = trade_returns(history)
+    if trades.size:
+        reports['trade_bootstrap'] = monte_carlo(trades, method='bootstrap', **common)
+        reports['trade_reshuffle'] = monte_carlo(trades, method='reshuffle', **common)
+    return reports
@@ -0,0 +1,273 @@
+import datetime
+import hashlib
+import inspect
+import json
+import os
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from intraday import check_fmt
+from optimization import BacktestResult, data_fingerprint, max_drawdown, sharpe_ratio
+
+
+# ==========================================
+# 回測紀錄庫 (Append-only，分區存放)
+# ==========================================
+# 目錄結構：
+#   <root>/index.jsonl                                      每次回測一行 (只附加不改寫)
+#   <root>/strategy=<策略>/data=<資料指紋>/<run_id>.equity.<fmt>   逐日權益曲線
+#   <root>/strategy=<策略>/data=<資料指紋>/<run_id>.trades.<fmt>   交易紀錄 (history)
+#   <root>/strategy=<策略>/data=<資料指紋>/<run_id>.hedges.<fmt>   期貨避險紀錄 (有避險時)
+# 索引只有參數與摘要 (每筆約 1 KB)，曲線與交易紀錄在查詢指定的 run 時才讀取。
+
+INDEX_FILE = 'index.jsonl'
+TABLES = ('equity', 'trades', 'hedges')
+_DATE_COLUMNS = {'equity': ['date'], 'trades': ['entry_date', 'exit_date'], 'hedges': ['date']}
+
+
+def strategy_version(strategy_cls) -> str:
+    """
+    策略版本：類別的 VERSION 屬性，沒有則為策略模組原始碼的雜湊 (程式修改後版本自動改變)
+    """
+    version = getattr(strategy_cls, 'VERSION', None)
+    if version is not None:
+        return str(version)
+    try:
+        source = inspect.getsource(inspect.getmodule(strategy_cls))
+    except (OSError, TypeError):
+        return 'unknown'
+    return hashlib.sha1(source.encode()).hexdigest()[:12]
+
+
+def strategy_params(strategy) -> Dict:
+    """由策略建構子的參數名稱取出目前的參數值 (只保留可寫入索引的純量)"""
+    params = {}
+    for name in inspect.signature(type(strategy).__init__).parameters:
+        value = getattr(strategy, name, None)
+        if name != 'self' and isinstance(value, (int, float, str, bool, type(None))):
+            params[name] = value
+    return params
+
+
+def run_summary(result: BacktestResult) -> Dict:
+    """寫入索引的摘要指標"""
+    history, equity = result.history, result.equity
+    pnl = history['pnl'].to_numpy(float) if len(history) else np.zeros(0)
+    return {
+        'final_equity': result.final_equity,
+        'total_pnl': result.final_equity - result.initial_balance,
+        'max_drawdown': max_drawdown(equity['equity']) if len(equity) else 0.0,
+        'sharpe': sharpe_ratio(result),
+        'n_trades': int(pnl.size),
+        'win_rate': float((pnl > 0).mean()) if pnl.size else 0.0,
+        'fees': float(history['fees'].sum()) if 'fees' in history else 0.0,
+        'n_days': int(len(equity)),
+    }
+
+
+def _json_default(value):
+    # 參數中的 Timestamp / numpy 純量
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+class RunRegistry:
+    """
+    回測紀錄庫：每次回測寫入參數、策略版本、資料指紋、權益曲線與交易紀錄
+
+    寫入只新增檔案並在索引尾端附加一行，不改寫既有資料 (多次掃描可共用同一個目錄)。
+    查詢時 runs() 只讀索引；curves() / equity() / trades() 只讀取指定的 run。
+
+    參數:
+        root (str): 紀錄庫目錄
+        fmt (str): 'csv' 或 'parquet' (需要 pyarrow 或 fastparquet；與 intraday.IntradayStore 相同)
+    """
+    def __init__(self, root: str, fmt: str = 'csv'):
+        check_fmt(fmt)
+        self.root = root
+        self.fmt = fmt
+        self._rows = []      # 已讀入的索引
+        self._offset = 0     # 索引檔已讀到的位置 (其他行程附加的新紀錄只讀增加的部分)
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.root, INDEX_FILE)
+
+    def path(self, entry: Dict, table: str) -> str:
+        return os.path.join(self.root, f"strategy={entry['strategy']}", f"data={entry['fingerprint']}",
+                            f"{entry['run_id']}.{table}.{self.fmt}")
+
+    # ==========================================
+    # 寫入
+    # ==========================================
+    def record(self, strategy_cls, result: BacktestResult, fingerprint: str, tags: Optional[Dict] = None) -> str:
+        """
+        寫入一次回測，回傳 run_id
+
+        參數:
+            strategy_cls: 策略類別 (名稱與版本)
+            result (BacktestResult): 回測結果 (參數、區間、交易紀錄、權益曲線、期貨避險紀錄)
+            fingerprint (str): 資料指紋 (optimization.data_fingerprint)
+            tags (dict): 自訂標籤 (例如 {'sweep': 'wf-2024'})，與參數一起寫入索引
+        """
+        created = datetime.datetime.now()
+        version = strategy_version(strategy_cls)
+        params = dict(result.params)
+        digest = hashlib.sha1(json.dumps([params, fingerprint, version, str(result.start), str(result.end),
+                                          result.initial_balance, created.isoformat()],
+                                         sort_keys=True, default=_json_default).encode()).hexdigest()[:10]
+        entry = {
+            'run_id': f"{created:%Y%m%d-%H%M%S}-{digest}",
+            'created': created.isoformat(timespec='seconds'),
+            'strategy': strategy_cls.__name__,
+            'version': version,
+            'fingerprint': fingerprint,
+            'start': str(result.start.date()),
+            'end': str(result.end.date()),
+            'initial_balance': result.initial_balance,
+            'stopped': result.stopped,
+            'params': params,
+            'tags': dict(tags or {}),
+            'summary': run_summary(result),
+        }
+
+        # 先寫資料檔，最後才附加索引：中途中斷時索引不會指向不完整的 run
+        trades = result.history.copy()
+        if 'legs' in trades:
+            trades['legs'] = [json.dumps(legs, default=_json_default) for legs in trades['legs']]
+        frames = {'equity': result.equity, 'trades': trades}
+        if result.hedges is not None and len(result.hedges):
+            frames['hedges'] = result.hedges
+        for table, df in frames.items():
+            self._write(df, self.path(entry, table))
+        entry['tables'] = list(frames)
+
+        os.makedirs(self.root, exist_ok=True)
+        line = json.dumps(entry, ensure_ascii=False, default=_json_default) + '\n'
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+        return entry['run_id']
+
+    def record_executor(self, executor, params: Optional[Dict] = None, fingerprint: Optional[str] = None,
+                        tags: Optional[Dict] = None) -> str:
+        """
+        寫入一個已執行完的 BacktestExecutor
+
+        參數:
+            params (dict): 策略參數 (None 則由策略建構子的參數名稱取出)
+            fingerprint (str): 資料指紋 (None 則由 executor.df_opt / df_fut 計算)
+        """
+        if params is None:
+            params = strategy_params(executor.strategy)
+        if fingerprint is None:
+            fingerprint = data_fingerprint(executor.df_opt, executor.df_fut)
+        result = BacktestResult(params, executor.start_date, executor.end_date, executor.initial_balance,
+                                pd.DataFrame(executor.history), executor.equity_frame(), executor.stopped,
+                                executor.hedge_frame())
+        return self.record(type(executor.strategy), result, fingerprint, tags)
+
+    def _write(self, df: pd.DataFrame, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        if self.fmt == 'parquet':
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    # ==========================================
+    # 查詢
+    # ==========================================
+    def entries(self) -> List[Dict]:
+        """索引中的所有紀錄 (dict)，只讀取上次之後附加的部分"""
+        if not os.path.exists(self.index_path):
+            return self._rows
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # 只處理完整的行 (其他行程可能正在寫入最後一行)
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._rows.append(json.loads(line))
+        self._offset += end
+        return self._rows
+
+    def entry(self, run_id: str) -> Dict:
+        for entry in reversed(self.entries()):
+            if entry['run_id'] == run_id:
+                return entry
+        raise KeyError(f"查無 run: {run_id}")
+
+    def runs(self, strategy: Optional[str] = None, fingerprint: Optional[str] = None,
+             version: Optional[str] = None, **params) -> pd.DataFrame:
+        """
+        回測摘要表 (只讀索引)：每個 run 一列，參數欄位為 param.<名稱>、標籤為 tag.<名稱>
+
+        參數:
+            strategy / fingerprint / version: 篩選條件 (None 則不篩選)
+            params: 參數篩選，例如 runs(leverage=3.0)
+        """
+        rows = []
+        for entry in self.entries():
+            if strategy is not None and entry['strategy'] != strategy:
+                continue
+            if fingerprint is not None and entry['fingerprint'] != fingerprint:
+                continue
+            if version is not None and entry['version'] != version:
+                continue
+            if any(entry['params'].get(k) != v for k, v in params.items()):
+                continue
+            row = {k: entry[k] for k in ('run_id', 'created', 'strategy', 'version', 'fingerprint', 'start', 'end',
+                                         'initial_balance', 'stopped')}
+            row.update(entry['summary'])
+            row.update({f"param.{k}": v for k, v in entry['params'].items()})
+            row.update({f"tag.{k}": v for k, v in entry['tags'].items()})
+            rows.append(row)
+        df = pd.DataFrame(rows)
+        if len(df):
+            df['created'] = pd.to_datetime(df['created'])
+            df = df.set_index('run_id')
+        return df
+
+    def load(self, run_id: str, table: str = 'equity') -> pd.DataFrame:
+        """讀取單一 run 的資料表 ('equity', 'trades', 'hedges')；沒有該表時回傳空的 DataFrame"""
+        if table not in TABLES:
+            raise ValueError(f"未知的 table: {table}")
+        entry = self.entry(run_id)
+        path = self.path(entry, table)
+        if table not in entry.get('tables', TABLES) or not os.path.exists(path):
+            return pd.DataFrame()
+        if self.fmt == 'parquet':
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, dtype={'contract': str})
+        for col in _DATE_COLUMNS[table]:
+            if col in df:
+                df[col] = pd.to_datetime(df[col])
+        if table == 'trades' and 'legs' in df:
+            df['legs'] = [json.loads(legs) for legs in df['legs']]
+        return df
+
+    def equity(self, run_id: str) -> pd.DataFrame:
+        return self.load(run_id, 'equity')
+
+    def trades(self, run_id: str) -> pd.DataFrame:
+        return self.load(run_id, 'trades')
+
+    def hedges(self, run_id: str) -> pd.DataFrame:
+        return self.load(run_id, 'hedges')
+
+    def iter_curves(self, run_ids, column: str = 'equity') -> Iterator[pd.Series]:
+        """逐一讀取權益曲線 (一次只有一條在記憶體中)，Series 名稱為 run_id、index 為日期"""
+        for run_id in run_ids:
+            df = self.equity(run_id)
+            yield pd.Series(df[column].to_numpy(float), index=pd.DatetimeIndex(df['date']), name=run_id)
+
+    def curves(self, run_ids, column: str = 'equity') -> pd.DataFrame:
+        """指定 run 的權益曲線併成一張表 (欄為 run_id)，例如 curves(registry.runs().nlargest(20, 'sharpe').index)"""
+        series = list(self.iter_curves(run_ids, column))
+        return pd.concat(series, axis=1) if series else pd.DataFrame()
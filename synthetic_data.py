@@ -0,0 +1,272 @@
+import math
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from utils import get_expiry_date_cached as get_expiry_date
+from fill_model import txo_tick_size
+
+
+# ==========================================
+# 合成 TX 期貨 / TXO 選擇權資料 (與原始 TAIFEX 檔案相同欄位)
+# ==========================================
+# 產出的資料為「尚未清洗」的格式：數值欄位為字串、缺價以 '-' 表示、
+# 期貨含價差單 (到期月份含 '/')、選擇權含盤後時段資料，
+# 可直接丟進 clean_futures_data / clean_options_data。
+
+_erf = np.frompyfunc(math.erf, 1, 1)
+
+
+def _norm_cdf(x):
+    return 0.5 * (1.0 + _erf(np.asarray(x, float) / math.sqrt(2.0)).astype(float))
+
+
+def black76_price(F, K, T, sigma, is_call):
+    """未折現 Black-76 價格 (與 get_greeks 反推 IV 時使用的定價一致)"""
+    F, K, T, sigma = (np.asarray(a, float) for a in (F, K, T, sigma))
+    sqrt_T = np.sqrt(T)
+    with np.errstate(all='ignore'):
+        d1 = (np.log(F / K) + 0.5 * sigma ** 2 * T) / (sigma * sqrt_T)
+    d2 = d1 - sigma * sqrt_T
+    call = F * _norm_cdf(d1) - K * _norm_cdf(d2)
+    put = K * _norm_cdf(-d2) - F * _norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def _round_tick(price):
+    tick = txo_tick_size(price)
+    return np.round(np.round(price / tick) * tick, 1)
+
+
+def _to_text(values, missing):
+    """數值轉成原始檔的字串格式，缺價填 '-'"""
+    text = np.asarray(values, float).round(1).astype(str)
+    text = np.char.replace(text, '.0', '') if text.size else text
+    return np.where(missing, '-', text).astype(object)
+
+
+def simulate_index_path(dates, spot0=15000.0, vol=0.18, seed=0):
+    """
+    模擬指數路徑與 ATM 波動度 (跳躍 + 波動度與報酬負相關)
+
+    回傳:
+        (open, close, atm_vol): 皆為長度 len(dates) 的陣列
+    """
+    rng = np.random.default_rng(seed)
+    n = len(dates)
+    dt = 1 / 252
+    atm_vol = np.empty(n)
+    close = np.empty(n)
+    v, s = vol, spot0
+    for i in range(n):
+        shock = rng.standard_normal()
+        jump = rng.normal(-0.03, 0.02) if rng.random() < 0.01 else 0.0
+        ret = -0.5 * v ** 2 * dt + v * math.sqrt(dt) * shock + jump
+        s *= math.exp(ret)
+        # 波動度均值回歸，下跌時升高
+        v = max(0.08, v + 2.0 * (vol - v) * dt - 0.6 * ret + 0.02 * rng.standard_normal() * math.sqrt(dt))
+        close[i] = s
+        atm_vol[i] = v
+    gap = rng.normal(0, 0.003, n)
+    open_ = np.concatenate(([spot0], close[:-1])) * np.exp(gap)
+    return open_, close, atm_vol
+
+
+def _month_code(ts):
+    return f"{ts.year:04d}{ts.month:02d}"
+
+
+def _listed_expiries(date, n_months=3, weekly_days=14, fridays=True):
+    """
+    當日掛牌的到期月份(週別)：近 n_months 個月選 + 未來 weekly_days 天內到期的週選
+    (週三 W1~W5，第 3 個週三與月選重複故略過；週五 F1~F5)
+    """
+    codes = []
+    month = pd.Timestamp(date.year, date.month, 1)
+    while len(codes) < n_months:
+        code = _month_code(month)
+        if get_expiry_date(code) >= date:
+            codes.append(code)
+        month += pd.DateOffset(months=1)
+
+    horizon = date + timedelta(days=weekly_days)
+    for month in (pd.Timestamp(date.year, date.month, 1), pd.Timestamp(date.year, date.month, 1) + pd.DateOffset(months=1)):
+        symbols = ['W'] + (['F'] if fridays else [])
+        for symbol in symbols:
+            for count in range(1, 6):
+                if symbol == 'W' and count == 3:
+                    continue
+                code = f"{_month_code(month)}{symbol}{count}"
+                expiry = get_expiry_date(code)
+                if pd.isna(expiry) or expiry.month != month.month:
+                    continue
+                if date <= expiry <= horizon:
+                    codes.append(code)
+    return codes
+
+
+def make_synthetic_market(start_date='2020-01-01', end_date='2020-12-31', spot0=15000.0, vol=0.18,
+                          n_strikes=20, n_months=3, fridays=True, missing_rate=0.05,
+                          after_hours_rate=0.10, spread_rows=True, risk_free_rate=0.01, seed=0):
+    """
+    產生合成的 TX 期貨與 TXO 選擇權原始資料
+
+    參數:
+        n_strikes (int): 價平上下各幾檔履約價 (近月 50 點間距，遠月 100 點)
+        n_months (int): 掛牌的月選數量
+        fridays (bool): 是否包含週五到期的 F 週選
+        missing_rate (float): 額外隨機缺價的比例 (深價外無成交的缺價另外產生)
+        after_hours_rate (float): 複製為盤後時段資料的比例 (清洗時應被移除)
+        spread_rows (bool): 期貨是否加入價差單 (清洗時應被移除)
+
+    回傳:
+        (df_opt_raw, df_fut_raw)
+    """
+    rng = np.random.default_rng(seed + 1)
+    dates = pd.bdate_range(start_date, end_date)
+    open_, close, atm_vol = simulate_index_path(dates, spot0, vol, seed)
+
+    # --- 1. 期貨 (近 3 個月 + 價差單) ---
+    fut_rows = []
+    for d, o, c in zip(dates, open_, close):
+        months = _listed_expiries(d, n_months=3, weekly_days=-1)
+        for j, code in enumerate(months):
+            basis = 1 - 0.001 * j
+            fut_rows.append((d, 'TX', code, o * basis, max(o, c) * basis * 1.003, min(o, c) * basis * 0.997,
+                             c * basis, c * basis))
+        if spread_rows and len(months) >= 2:
+            fut_rows.append((d, 'TX', f"{months[0]}/{months[1]}", 10.0, 12.0, 8.0, 11.0, np.nan))
+    fut = pd.DataFrame(fut_rows, columns=['交易日期', '契約', '到期月份(週別)', '開盤價', '最高價', '最低價', '收盤價', '結算價'])
+    n_fut = len(fut)
+    for col in ['開盤價', '最高價', '最低價', '收盤價', '結算價']:
+        fut[col] = _to_text(np.round(fut[col].to_numpy(float)), fut[col].isna().to_numpy())
+    fut['成交量'] = rng.integers(20_000, 150_000, n_fut)
+    fut['交易時段'] = '一般'
+    fut['交易日期'] = fut['交易日期'].dt.strftime('%Y/%m/%d')
+
+    # --- 2. 選擇權鏈 ---
+    parts = {k: [] for k in ('date', 'code', 'K', 'is_call', 'F', 'T', 'atm')}
+    for d, c, v in zip(dates, close, atm_vol):
+        for code in _listed_expiries(d, n_months, fridays=fridays):
+            T = max((get_expiry_date(code) - d).days / 365.0, 1e-5)
+            step = 50 if T <= 35 / 365 else 100
+            F = c * math.exp(risk_free_rate * T)
+            center = round(c / step) * step
+            strikes = center + step * np.arange(-n_strikes, n_strikes + 1)
+            m = len(strikes)
+            for is_call in (True, False):
+                parts['date'].append(np.full(m, d))
+                parts['code'].append(np.full(m, code, dtype=object))
+                parts['K'].append(strikes.astype(float))
+                parts['is_call'].append(np.full(m, is_call))
+                parts['F'].append(np.full(m, F))
+                parts['T'].append(np.full(m, T))
+                parts['atm'].append(np.full(m, v))
+    cols = {k: np.concatenate(v) for k, v in parts.items()}
+    K, F, T, is_call = cols['K'], cols['F'], cols['T'], cols['is_call']
+    n = len(K)
+
+    # 微笑曲線：以標準化價內外程度 x = ln(K/F) / sqrt(T) 描述 skew 與 curvature
+    x = np.log(K / F) / np.sqrt(np.maximum(T, 1 / 365))
+    sigma = np.maximum(cols['atm'] * (1 - 0.6 * x + 1.2 * x ** 2), 0.05)
+    theo = black76_price(F, K, T, sigma, is_call)
+    settle = np.maximum(_round_tick(theo), 0.1)
+
+    # 收盤價 = 理論價 + 雜訊；深價外無成交 (volume = 0) 以及隨機缺價填 '-'
+    noise = 1 + rng.normal(0, 0.02, n)
+    price = _round_tick(np.maximum(theo * noise, 0.0))
+    volume = rng.poisson(np.maximum(3000 * np.exp(-3 * np.abs(x)), 0.01))
+    missing = (price < 0.1) | (volume == 0) | (rng.random(n) < missing_rate)
+    half_spread = np.maximum(txo_tick_size(price), price * 0.02)
+    bid = _round_tick(np.maximum(price - half_spread, 0.0))
+    ask = _round_tick(price + half_spread)
+
+    opt = pd.DataFrame({
+        '交易日期': pd.DatetimeIndex(cols['date']).strftime('%Y/%m/%d'),
+        '契約': 'TXO',
+        '到期月份(週別)': cols['code'],
+        '履約價': K.astype(int).astype(str),
+        '買賣權': np.where(is_call, '買權', '賣權'),
+        '開盤價': _to_text(price, missing),
+        '最高價': _to_text(price, missing),
+        '最低價': _to_text(price, missing),
+        '收盤價': _to_text(price, missing),
+        '成交量': np.where(missing, 0, volume),
+        '結算價': _to_text(settle, np.zeros(n, bool)),
+        '未沖銷契約數': rng.poisson(np.maximum(8000 * np.exp(-2 * np.abs(x)), 0.01)),
+        '最後最佳買價': _to_text(bid, missing | (bid <= 0)),
+        '最後最佳賣價': _to_text(ask, missing),
+        '交易時段': '一般',
+    })
+
+    # 盤後時段資料 (清洗時應被過濾)
+    if after_hours_rate > 0:
+        extra = opt.sample(frac=after_hours_rate, random_state=seed).assign(交易時段='盤後')
+        opt = pd.concat([opt, extra], ignore_index=True)
+
+    return opt, fut
+
+
+def make_synthetic_intraday(start_date='2020-01-01', end_date='2020-01-31', spot0=15000.0, vol=0.18,
+                            n_strikes=10, n_months=2, fridays=False, bars_per_day=300, trade_rate=0.3,
+                            risk_free_rate=0.01, seed=0):
+    """
+    產生合成的盤中 1 分 K (欄位與 intraday.IntradayStore 相同，可用 store.write(df, 'TX' / 'TXO') 存檔)
+
+    每日的開盤價 / 收盤價與相同 spot0, vol, seed 的 make_synthetic_market 一致，日內以布朗橋連接；
+    選擇權每分鐘依 trade_rate (價外遞減) 隨機成交，成交價為 Black-76 理論價 (微笑曲線與日資料相同)。
+
+    參數:
+        n_strikes (int): 開盤價平上下各幾檔履約價 (近月 50 點間距，遠月 100 點)
+        n_months (int): 掛牌的月選數量
+        bars_per_day (int): 每日 1 分 K 數量 (08:46 起)
+        trade_rate (float): 價平合約每分鐘有成交的機率
+
+    回傳:
+        (df_tx, df_txo)
+    """
+    rng = np.random.default_rng(seed + 2)
+    dates = pd.bdate_range(start_date, end_date)
+    open_, close, atm_vol = simulate_index_path(dates, spot0, vol, seed)
+    steps = np.arange(1, bars_per_day + 1) / bars_per_day
+    offsets = pd.Timedelta(hours=8, minutes=45) + pd.to_timedelta(np.arange(1, bars_per_day + 1), 'min')
+
+    tx_parts, txo_parts = [], []
+    for d, o, c, v in zip(dates, open_, close, atm_vol):
+        times = d + offsets
+        # 布朗橋：由開盤價走到收盤價
+        walk = np.cumsum(rng.normal(0, v / math.sqrt(252 * bars_per_day), bars_per_day))
+        path = o * np.exp(np.log(c / o) * steps + walk - steps * walk[-1])
+
+        months = _listed_expiries(d, n_months=3, weekly_days=-1)
+        for j, code in enumerate(months):
+            tx_parts.append(pd.DataFrame({'時間': times, '到期月份(週別)': code,
+                                          '收盤價': np.round(path * (1 - 0.001 * j)), '成交量': 10}))
+
+        codes, strikes, calls, T = [], [], [], []
+        for code in _listed_expiries(d, n_months, fridays=fridays):
+            t = max((get_expiry_date(code) - d).days / 365.0, 1e-5)
+            step = 50 if t <= 35 / 365 else 100
+            k = round(o / step) * step + step * np.arange(-n_strikes, n_strikes + 1)
+            for is_call in (True, False):
+                codes.extend([code] * len(k))
+                strikes.append(k.astype(float))
+                calls.append(np.full(len(k), is_call))
+                T.append(np.full(len(k), t))
+        K, is_call, T = np.concatenate(strikes), np.concatenate(calls), np.concatenate(T)
+        codes = np.asarray(codes, dtype=object)
+
+        # [合約 x K 棒] 的理論價，依成交機率挑出有成交的分鐘
+        F = path[None, :] * np.exp(risk_free_rate * T[:, None])
+        x = np.log(K / o) / np.sqrt(np.maximum(T, 1 / 365))
+        sigma = np.maximum(v * (1 - 0.6 * x + 1.2 * x ** 2), 0.05)
+        price = _round_tick(black76_price(F, K[:, None], T[:, None], sigma[:, None], is_call[:, None]))
+        traded = (rng.random(price.shape) < trade_rate * np.exp(-np.abs(x))[:, None]) & (price >= 0.1)
+        row, bar = np.nonzero(traded)
+        txo_parts.append(pd.DataFrame({
+            '時間': times[bar], '到期月份(週別)': codes[row], '履約價': K[row],
+            '買賣權': np.where(is_call[row], '買權', '賣權'), '收盤價': price[row, bar],
+            '成交量': rng.integers(1, 20, row.size),
+        }))
+    return pd.concat(tx_parts, ignore_index=True), pd.concat(txo_parts, ignore_index=True)
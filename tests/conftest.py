@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_journal import EventJournal, WARNING  # noqa: E402
+from synthetic_data import make_synthetic_market  # noqa: E402
+from market_snapshot import FRAME_COLUMN_MAP, MarketSnapshot  # noqa: E402
+from utils import clean_futures_data, clean_options_data  # noqa: E402
+
+START, END = '2020-01-01', '2020-06-30'
+
+
+@pytest.fixture(scope='session')
+def market():
+    """半年的合成 TXO / TX 資料 (已清洗)：(df_opt, df_fut)"""
+    df_opt, df_fut = make_synthetic_market(START, END, n_strikes=12, missing_rate=0, seed=3)
+    return clean_options_data(df_opt), clean_futures_data(df_fut)
+
+
+@pytest.fixture
+def journal():
+    """只記錄警告以上的事件日誌 (測試不輸出到終端機)"""
+    return EventJournal(level=WARNING)
+
+
+def make_snapshot(expiry, strikes, opt_types, S=12000.0, date='2020-01-02', **columns):
+    """
+    手動組一個單一到期月份的 MarketSnapshot (未給的數值欄位為 NaN)
+
+    參數:
+        opt_types (list): 每列 'call' / 'put'
+        columns: 其他欄位 (close, settle, bid, ask, volume, oi ...) -> 每列的值
+    """
+    n = len(strikes)
+    cols = {name: np.full(n, np.nan) for name in FRAME_COLUMN_MAP}
+    cols['strike'] = np.asarray(strikes, dtype=float)
+    cols.update({name: np.asarray(values, dtype=float) for name, values in columns.items()})
+    return MarketSnapshot(pd.Timestamp(date), S, cols, np.full(n, expiry),
+                          np.asarray([t == 'call' for t in opt_types]))
@@ -0,0 +1,45 @@
+import pytest
+
+import EnhancedWheelStrategy2 as v2
+from conftest import END, START
+from hedging import DeltaHedger
+from utils import BacktestExecutor
+
+
+def _executor(market, journal, strategy=None, **kwargs):
+    df_opt, df_fut = market
+    return BacktestExecutor(strategy or v2.EnhancedWheelStrategy(leverage=3.0), START, END, df_opt, df_fut,
+                            journal=journal, hedger=DeltaHedger(), **kwargs)
+
+
+def _interrupt(market, journal, path, days=60):
+    """跑到第 days 根 K 棒中斷 (之前每 20 根存檔一次)"""
+    part = _executor(market, journal, checkpoint_dir=path, checkpoint_every=20,
+                     stop_rule=lambda ex: 'stop' if len(ex.equity) == days else None)
+    part.run()
+    assert len(part.equity) == days
+
+
+def test_resume_matches_uninterrupted_run(market, journal, tmp_path):
+    full = _executor(market, journal)
+    expected = full.run()
+
+    _interrupt(market, journal, tmp_path)
+    resumed = _executor(market, journal, checkpoint_dir=tmp_path, resume=True)
+    assert resumed.load_checkpoint() and 0 < len(resumed.equity) <= 60
+    actual = resumed.run()
+
+    assert len(expected)
+    assert actual.drop(columns='legs').equals(expected.drop(columns='legs'))
+    assert actual['legs'].tolist() == expected['legs'].tolist()
+    assert resumed.equity_frame().equals(full.equity_frame())
+    assert resumed.hedge_frame().equals(full.hedge_frame())
+    assert resumed.balance == full.balance
+    assert resumed.hedge_pnl == full.hedge_pnl
+
+
+def test_resume_rejects_changed_strategy_params(market, journal, tmp_path):
+    _interrupt(market, journal, tmp_path)
+    with pytest.raises(ValueError):
+        _executor(market, journal, strategy=v2.EnhancedWheelStrategy(leverage=2.0),
+                  checkpoint_dir=tmp_path, resume=True).run()
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from conftest import make_snapshot
+from fill_model import MULTIPLIER, FillModel, TaifexFillModel, txo_tick_size
+
+SIDES = np.array([-1.0, 1.0])   # 賣出 12000P、買進 11900P
+
+
+def _snapshot(**columns):
+    base = dict(close=[60.0, 8.0], settle=[0.0, 0.0], volume=[30, 50], oi=[1_000, 1_000])
+    base.update(columns)
+    return make_snapshot('202001', [12000, 11900], ['put', 'put'], **base)
+
+
+def _fill(model, snapshot, sides, qty, **kwargs):
+    rows = snapshot.locate('202001', [12000, 11900], ['put', 'put'])
+    return model.fill(snapshot, rows, sides, qty, **kwargs)
+
+
+def test_tick_size():
+    assert txo_tick_size([5, 10, 49.5, 50, 499, 500, 999, 1000]).tolist() == [0.1, 0.5, 0.5, 1, 1, 5, 5, 10]
+
+
+def test_default_model_fills_at_close():
+    fill = _fill(FillModel(), _snapshot(), SIDES, 10)
+    assert fill.prices.tolist() == [60.0, 8.0] and fill.qty == 10 and fill.fees == 0.0
+
+
+def test_volume_cap_limits_opens():
+    model = TaifexFillModel(slippage='none', volume_cap=0.1)
+    fill = _fill(model, _snapshot(), SIDES, 10)
+    assert fill.qty == 3   # min(floor(30 x 0.1), floor(50 x 0.1))
+    assert fill.prices.tolist() == [60.0, 8.0]
+    assert fill.fees == pytest.approx(3 * (25.0 * 2 + 0.001 * MULTIPLIER * 68.0))
+    assert not fill.settled
+
+
+def test_oi_cap_limits_opens():
+    model = TaifexFillModel(slippage='none', volume_cap=None, oi_cap=0.004)
+    assert _fill(model, _snapshot(), SIDES, 10).qty == 4
+
+
+def test_closes_fill_in_full_with_penalty():
+    """平倉不受上限：全部成交，超量部分 (7/10) 每口多付 close_penalty_ticks 個升降單位"""
+    model = TaifexFillModel(slippage='none', volume_cap=0.1, close_penalty_ticks=2.0)
+    fill = _fill(model, _snapshot(), -SIDES, 10, closing=True)
+    assert fill.qty == 10
+    excess = 7 / 10
+    assert fill.prices == pytest.approx([60.0 + 2 * 1.0 * excess, 8.0 - 2 * 0.1 * excess])   # 買回較貴、賣出較便宜
+
+    free = TaifexFillModel(slippage='none', volume_cap=0.1, close_penalty_ticks=0)
+    fill = _fill(free, _snapshot(), -SIDES, 10, closing=True)
+    assert fill.qty == 10 and fill.prices.tolist() == [60.0, 8.0]
+
+
+def test_quote_slippage_uses_bid_ask_and_falls_back_when_crossed():
+    model = TaifexFillModel(volume_cap=None)
+    fill = _fill(model, _snapshot(bid=[59.0, 7.9], ask=[61.0, 8.2]), SIDES, 1)
+    assert fill.prices.tolist() == [59.0, 8.2]
+    crossed = _fill(model, _snapshot(bid=[62.0, 7.9], ask=[61.0, 8.2]), SIDES, 1)
+    assert crossed.prices == pytest.approx([60.0 - 1.0, 8.2])   # 賣出改以收盤價減半個估計價差
+
+
+def test_missing_quote_leg_is_not_charged():
+    model = TaifexFillModel(slippage='none', volume_cap=None, tax_rate=0.0)
+    snapshot = _snapshot()
+    fill = model.fill(snapshot, [snapshot.locate('202001', [12000], ['put'])[0], -1], SIDES, 2)
+    assert fill.prices[0] == 60.0 and np.isnan(fill.prices[1])
+    assert fill.fees == pytest.approx(2 * 25.0)
+
+
+def test_expiry_settles_at_settle_price_with_exercise_tax():
+    """最後結算日：以結算價成交、不受成交量限制，只有價內腳 (結算價 > 0) 課履約稅"""
+    model = TaifexFillModel(volume_cap=0.1)
+    snapshot = _snapshot(settle=[150.0, 0.0], volume=[0, 0])
+    fill = _fill(model, snapshot, -SIDES, 10, expiring=True, closing=True)
+    assert fill.settled and fill.qty == 10
+    assert fill.prices.tolist() == [150.0, 0.0]
+    assert fill.fees == pytest.approx(10 * (25.0 * 2 + 0.00002 * MULTIPLIER * 12000))
+
+
+def test_settle_falls_back_to_close():
+    model = TaifexFillModel()
+    fill = _fill(model, _snapshot(settle=[np.nan, 0.0]), -SIDES, 1, expiring=True)
+    assert fill.prices.tolist() == [60.0, 0.0]
+
+
+def test_settle_on_expiry_disabled_uses_regular_fill():
+    model = TaifexFillModel(slippage='none', settle_on_expiry=False, volume_cap=None)
+    fill = _fill(model, _snapshot(settle=[150.0, 0.0]), -SIDES, 1, expiring=True)
+    assert not fill.settled and fill.prices.tolist() == [60.0, 8.0]
+
+
+def test_unknown_slippage():
+    with pytest.raises(ValueError):
+        TaifexFillModel(slippage='mid')
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import EnhancedWheelStrategy2 as v2
+from conftest import END, START
+from hedging import DeltaHedger, hedge_quantity
+from utils import BacktestExecutor, BaseStrategy, Leg, TradeSignal, get_expiry_date_cached
+
+
+class RecordingHedger(DeltaHedger):
+    """每根 K 棒調整後記下組合 Delta"""
+    def rebalance(self, book, snapshot):
+        super().rebalance(book, snapshot)
+        self.after = getattr(self, 'after', [])
+        self.after.append(self.portfolio_delta(book, snapshot))
+
+
+class ShortFutures(BaseStrategy):
+    """第一根 K 棒放空 2 口近月小台，之後不再下單 (到期由 executor 結算)"""
+    def on_bar(self, context, snapshot):
+        if getattr(self, 'done', False):
+            return []
+        self.done = True
+        contract = [e for e in snapshot.expiries if len(e) == 6][0]
+        return [TradeSignal('OPEN', contract, [Leg('sell', 0, 'MTX')], 'short futures', 2)]
+
+    def on_rollover(self, context, snapshot, info):
+        return self.on_bar(context, snapshot)
+
+
+class HoldPut(BaseStrategy):
+    """第一根 K 棒賣出 10 口次月價平賣權並持有 (持倉跨過近月期貨的結算日)"""
+    def on_bar(self, context, snapshot):
+        if context['position'] is not None or getattr(self, 'done', False):
+            return []
+        self.done = True
+        contract = [e for e in snapshot.expiries if len(e) == 6][1]
+        strikes = snapshot.chain(contract, 'put').strike
+        strike = float(strikes[np.argmin(np.abs(strikes - snapshot.S))])
+        return [TradeSignal('OPEN', contract, [Leg('sell', strike, 'put')], 'hold put', 10)]
+
+    def on_rollover(self, context, snapshot, info):
+        return self.on_bar(context, snapshot)
+
+
+def _run(market, journal, strategy=None, hedger=None):
+    df_opt, df_fut = market
+    executor = BacktestExecutor(strategy or v2.EnhancedWheelStrategy(leverage=3.0), START, END, df_opt, df_fut,
+                                journal=journal, hedger=hedger)
+    return executor, executor.run()
+
+
+def _assert_reconciles(executor, history):
+    """已實現資金 = 起始資金 + 選擇權已平倉損益 + 未平倉的建倉權利金 + 期貨損益"""
+    pnl = history['pnl'].sum() if len(history) else 0.0
+    pos = executor.current_position
+    open_cash = pos['total_premium'] - pos['fees'] if pos else 0.0
+    assert executor.balance == pytest.approx(executor.initial_balance + pnl + open_cash + executor.hedge_pnl)
+    frame = executor.hedge_frame()
+    if len(frame):
+        assert executor.hedge_pnl == pytest.approx((frame['realized_pnl'] - frame['fees']).sum())
+
+
+def test_hedge_quantity():
+    assert hedge_quantity([-3.2, 1.5, 5.0, -0.4], 2.0).tolist() == [3, 0, -5, 0]
+    assert hedge_quantity([-3.2, 5.0], 2.0, to='edge').tolist() == [1, -3]
+    assert hedge_quantity([-9.0], 2.0, lot_delta=4).tolist() == [2]
+    with pytest.raises(ValueError):
+        hedge_quantity([1.0], 2.0, to='middle')
+
+
+@pytest.mark.parametrize('band, product, to, slack', [(1.0, 'MTX', 'center', 0.0),
+                                                       (2.0, 'MTX', 'edge', 0.5),
+                                                       (1.0, 'TX', 'center', 2.0)])
+def test_delta_stays_within_band(market, journal, band, product, to, slack):
+    """調整後的組合 Delta 在 ±band 內 (整口數的四捨五入最多差半口)"""
+    hedger = RecordingHedger(band=band, product=product, to=to)
+    executor, history = _run(market, journal, hedger=hedger)
+    assert len(executor.hedge_frame())
+    assert np.abs(hedger.after).max() <= band + slack + 1e-9
+    assert {product} == set(executor.hedge_frame()['product'])
+
+
+def test_hedger_rolls_expiring_futures(market, journal):
+    executor, history = _run(market, journal, strategy=HoldPut(), hedger=DeltaHedger(band=1.0))
+    frame = executor.hedge_frame()
+    rolls = frame[frame['reason'] == 'roll']
+    assert len(rolls) and len(rolls) % 2 == 0
+    for (_, out), (_, into) in zip(rolls.iloc[::2].iterrows(), rolls.iloc[1::2].iterrows()):
+        assert out['qty'] == -into['qty'] and out['position'] == 0 and out['date'] == into['date']
+        assert pd.Timestamp(get_expiry_date_cached(out['contract'])).normalize() <= out['date'].normalize()
+        assert into['contract'] > out['contract']
+    last = executor.equity_frame()['date'].iloc[-1].normalize()
+    for product, contract in executor.futures:
+        assert pd.Timestamp(get_expiry_date_cached(contract)).normalize() > last
+
+
+def test_hedged_balance_reconciles(market, journal):
+    executor, history = _run(market, journal, hedger=DeltaHedger())
+    _assert_reconciles(executor, history)
+    assert executor.hedge_fees > 0
+
+
+def test_strategy_futures_legs_settle_at_expiry(market, journal):
+    executor, history = _run(market, journal, strategy=ShortFutures())
+    frame = executor.hedge_frame()
+    assert frame['reason'].tolist() == ['short futures', 'settle']
+    assert frame['qty'].tolist() == [-2, 2] and not executor.futures
+    assert frame['date'].iloc[1].normalize() == \
+        pd.Timestamp(get_expiry_date_cached(frame['contract'].iloc[0])).normalize()
+    _assert_reconciles(executor, history)
@@ -0,0 +1,63 @@
+import math
+from collections import deque
+
+import numpy as np
+import pytest
+
+from conftest import START
+from indicators import MarketIndicators, RollingRank, RollingWindow, indicator_series
+from utils import market_data_generator
+
+
+def test_rolling_rank_matches_brute_force():
+    """每次 push 後與視窗內 (量化後) 數值的排序結果比較，包含超出 [lo, hi] 的值"""
+    rng = np.random.default_rng(7)
+    values = np.concatenate([rng.uniform(0.05, 0.6, 400), [-0.1, 3.5, 0.2, 0.2, 0.2]])
+    rank = RollingRank(size=60, lo=0.0, hi=3.0, resolution=1e-3)
+    window = deque(maxlen=60)
+    for x in values:
+        rank.push(x)
+        window.append(rank.lo + rank._bin(x) * rank.resolution)
+        ordered = sorted(window)
+        assert rank.count == len(window)
+        assert rank.min() == pytest.approx(ordered[0]) and rank.max() == pytest.approx(ordered[-1])
+        for k in (1, len(ordered) // 2 + 1, len(ordered)):
+            assert rank.kth(k) == pytest.approx(ordered[k - 1])
+        for probe in (x, 0.3, ordered[0], ordered[-1] + 1e-3):
+            q = rank.lo + rank._bin(probe) * rank.resolution
+            expected = sum(v < q - rank.resolution / 2 for v in window) / len(window)
+            assert rank.percentile(probe) == pytest.approx(expected)
+
+
+def test_empty_rolling_rank_is_nan():
+    rank = RollingRank(10)
+    assert math.isnan(rank.min()) and math.isnan(rank.max()) and math.isnan(rank.percentile(0.2))
+
+
+def test_rolling_window_matches_numpy():
+    rng = np.random.default_rng(3)
+    window = RollingWindow(20)
+    values = rng.normal(size=75)
+    for i, x in enumerate(values):
+        window.push(x)
+        recent = values[max(0, i - 19):i + 1]
+        assert np.allclose(window.values(), recent)
+        assert window.mean() == pytest.approx(recent.mean())
+        assert window.mean_square() == pytest.approx((recent ** 2).mean())
+
+
+def test_incremental_indicators_resume(market):
+    """中途存檔再載入的指標序列與一次算完相同"""
+    df_opt, df_fut = market
+    snapshots = list(market_data_generator(START, '2020-03-31', df_opt, df_fut))
+    expected = indicator_series(snapshots, rank_window=20, rv_window=5)
+    first = MarketIndicators(rank_window=20, rv_window=5)
+    for snapshot in snapshots[:30]:
+        first.update(snapshot)
+    resumed = MarketIndicators(rank_window=20, rv_window=5)
+    resumed.set_state(first.get_state())
+    for snapshot in snapshots[30:]:
+        resumed.update(snapshot)
+    assert resumed.frame().equals(expected)
+    assert expected['atm_iv'].notna().all()
+    assert expected['iv_rank'].dropna().between(0, 1).all()
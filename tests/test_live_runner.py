@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+import EnhancedWheelStrategy2 as v2
+from conftest import END, START
+from live_runner import LiveRunner, MockBroker, MockMarketServer, compare_replay
+from utils import BaseStrategy, Leg, TradeSignal
+
+BALANCE = 2_000_000
+
+
+class Eager(BaseStrategy):
+    """沒有持倉就賣一口近月最低履約價的賣權，有持倉就送出兩張平倉單"""
+    def on_bar(self, context, snapshot):
+        pos = context['position']
+        if pos is None:
+            contract = [e for e in snapshot.expiries if len(e) == 6][0]
+            strike = float(snapshot.chain(contract, 'put').strike[0])
+            return [TradeSignal('OPEN', contract, [Leg('sell', strike, 'put')], 'open', 1)]
+        return [TradeSignal('CLOSE', pos['contract'], [], 'close', 1),
+                TradeSignal('CLOSE', pos['contract'], [], 'close again', 1)]
+
+    def on_rollover(self, context, snapshot, info):
+        return self.on_bar(context, snapshot)
+
+
+class BrokenBroker(MockBroker):
+    async def next_fill(self):
+        raise ConnectionError("broker disconnected")
+
+
+def _run(market, journal, latency=0.0, fill_timeout=1.0, broker=MockBroker):
+    df_opt, df_fut = market
+    server = MockMarketServer(df_opt, df_fut, START, '2020-01-20')
+    runner = LiveRunner(Eager(), broker(server, latency), server.stream(), fill_timeout=fill_timeout,
+                        balance=BALANCE, journal=journal)
+    history = asyncio.run(runner.run())
+    return history, runner
+
+
+def _assert_booked_once(history, runner):
+    """每筆平倉後的餘額 = 起始資金 + 累計損益 (同一筆成交沒有重複記帳)"""
+    expected = BALANCE + history['pnl'].cumsum()
+    assert history['balance'].to_numpy() == pytest.approx(expected.to_numpy())
+    if runner.current_position is None:
+        assert runner.balance == pytest.approx(BALANCE + history['pnl'].sum())
+
+
+def test_replay_matches_backtest(market, journal):
+    df_opt, df_fut = market
+    diff = compare_replay(lambda: v2.EnhancedWheelStrategy(leverage=3.0), df_opt, df_fut, START, END,
+                          journal=journal)
+    assert diff.empty, diff.to_string()
+
+
+def test_duplicate_close_is_not_booked_twice(market, journal):
+    history, runner = _run(market, journal)
+    assert len(history) and not runner.unmatched_fills
+    _assert_booked_once(history, runner)
+
+
+def test_late_fills_are_rejected(market, journal):
+    """回報晚於 fill_timeout 到達時，持倉已與下單時不同，不可記到別的持倉上"""
+    history, runner = _run(market, journal, latency=0.05, fill_timeout=0.005)
+    assert runner.unmatched_fills
+    assert '[成交不符]' in ' '.join(journal.to_frame()['message'])
+    _assert_booked_once(history, runner)
+    if len(history):
+        assert (history['exit_date'] >= history['entry_date']).all()
+
+
+def test_background_task_error_stops_run(market, journal):
+    with pytest.raises(RuntimeError):
+        _run(market, journal, broker=BrokenBroker)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import EnhancedWheelStrategy2 as v2
+from conftest import END, START
+from utils import BacktestExecutor, market_data_generator, prefetch_market_data_generator
+
+
+@pytest.mark.parametrize('mode', ['thread', 'process'])
+def test_prefetch_snapshots_match(market, mode):
+    df_opt, df_fut = market
+    expected = list(market_data_generator(START, '2020-02-15', df_opt, df_fut))
+    actual = list(prefetch_market_data_generator(START, '2020-02-15', df_opt, df_fut, depth=3, mode=mode))
+    assert [s.date for s in actual] == [s.date for s in expected]
+    for a, b in zip(actual, expected):
+        assert a.S == b.S and a.expiries == b.expiries
+        for name in ('strike', 'close', 'iv', 'delta', 'theta'):
+            assert np.array_equal(a.column(name), b.column(name), equal_nan=True)
+        for x, y in zip(a.to_frame(), b.to_frame()):
+            assert x.equals(y)
+
+
+@pytest.mark.parametrize('mode', ['thread', 'process'])
+def test_prefetch_backtest_matches(market, journal, mode):
+    df_opt, df_fut = market
+    runs = [BacktestExecutor(v2.EnhancedWheelStrategy(leverage=3.0), START, END, df_opt, df_fut,
+                             journal=journal, prefetch=prefetch, prefetch_mode=mode)
+            for prefetch in (0, 4)]
+    expected, actual = (ex.run() for ex in runs)
+    assert len(expected) and actual.equals(expected)
+    assert runs[1].equity_frame().equals(runs[0].equity_frame())
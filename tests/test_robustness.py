@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import EnhancedWheelStrategy2 as v2
+from conftest import END, START
+from robustness import _resample_index, daily_returns, monte_carlo, robustness_analysis, trade_returns
+from utils import BacktestExecutor
+
+RETURNS = np.random.default_rng(1).normal(0.001, 0.02, 120)
+
+
+def test_reshuffle_keeps_final_balance():
+    report = monte_carlo(RETURNS, n_paths=500, method='reshuffle', initial_balance=1_000.0)
+    assert report.final_balance == pytest.approx(1_000.0 * np.prod(1 + RETURNS))
+    assert (report.max_drawdown >= 0).all() and (report.max_drawdown < 1).all()
+
+
+@pytest.mark.parametrize('method', ['bootstrap', 'block_bootstrap', 'reshuffle'])
+def test_drawdown_matches_brute_force(method):
+    """以固定種子重算第一批路徑，逐條用迴圈算最大回撤與破產"""
+    report = monte_carlo(RETURNS, n_paths=50, method=method, block=7, horizon=80, ruin_level=0.9,
+                         initial_balance=1.0, chunk_size=50)
+    rng = np.random.default_rng(np.random.SeedSequence(0).spawn(1)[0])
+    horizon = len(RETURNS) if method == 'reshuffle' else 80
+    idx = _resample_index(rng, len(RETURNS), 50, horizon, method, 7)
+    for path, i in enumerate(idx):
+        equity, peak, mdd, low = 1.0, 1.0, 0.0, 1.0
+        for r in RETURNS[i]:
+            equity *= 1 + r
+            peak = max(peak, equity)
+            mdd = max(mdd, 1 - equity / peak)
+            low = min(low, equity)
+        assert report.final_balance[path] == pytest.approx(equity)
+        assert report.max_drawdown[path] == pytest.approx(mdd)
+        assert report.ruined[path] == (low <= 0.9)
+
+
+def test_workers_do_not_change_results():
+    one = monte_carlo(RETURNS, n_paths=3_000, chunk_size=1_000, workers=1)
+    two = monte_carlo(RETURNS, n_paths=3_000, chunk_size=1_000, workers=2)
+    assert np.array_equal(one.final_balance, two.final_balance)
+    assert np.array_equal(one.max_drawdown, two.max_drawdown)
+
+
+def test_ruin_and_empty_returns():
+    report = monte_carlo(np.full(10, -0.1), n_paths=100, method='bootstrap')
+    assert report.ruin_probability == 1.0
+    with pytest.raises(ValueError):
+        monte_carlo([], n_paths=10)
+
+
+def test_robustness_analysis_on_backtest(market, journal):
+    df_opt, df_fut = market
+    executor = BacktestExecutor(v2.EnhancedWheelStrategy(leverage=3.0), START, END, df_opt, df_fut, journal=journal)
+    history = executor.run()
+    equity = executor.equity_frame()
+    assert len(trade_returns(history)) == len(history)
+    assert len(daily_returns(equity)) == len(equity) - 1
+    reports = robustness_analysis(history, equity, n_paths=1_000)
+    assert set(reports) == {'daily_block_bootstrap', 'trade_bootstrap', 'trade_reshuffle'}
+    assert reports['trade_reshuffle'].final_balance == pytest.approx(
+        equity['equity'].iloc[0] * np.prod(1 + trade_returns(history)))
@@ -0,0 +1,45 @@
+import numpy as np
+
+from conftest import START, make_snapshot
+from market_snapshot import MarketSnapshot
+from utils import get_greeks, market_data_generator
+
+GREEK_COLUMNS = ['dT', 'Implied_Volatility', 'Delta', 'Gamma', 'Theta', 'Vega', 'Itm_Prob']
+
+
+def test_snapshot_matches_get_greeks(market):
+    """MarketSnapshot 與舊版 get_greeks 的 IV / Greeks 相同 (列順序、index 一致)"""
+    df_opt, df_fut = market
+    snapshots = list(market_data_generator(START, '2020-02-15', df_opt, df_fut))
+    assert snapshots
+    worst = 0.0
+    for snapshot in snapshots:
+        calls, puts = snapshot.to_frame()
+        base_calls, base_puts = get_greeks(df_opt, snapshot.date, snapshot.S, 0.01)
+        for frame, base in ((calls, base_calls), (puts, base_puts)):
+            assert frame.index.equals(base.index)
+            a = frame[GREEK_COLUMNS].to_numpy(dtype=float)
+            b = base[GREEK_COLUMNS].to_numpy(dtype=float)
+            assert np.array_equal(np.isnan(a), np.isnan(b))
+            worst = max(worst, float(np.nanmax(np.abs(a - b), initial=0.0)))
+    assert worst <= 2e-10
+
+
+def test_snapshot_unpacks_like_legacy_tuple(market):
+    df_opt, df_fut = market
+    snapshot = next(iter(market_data_generator(START, '2020-01-10', df_opt, df_fut)))
+    date, S, calls, puts = snapshot
+    assert date == snapshot.date and S == snapshot.S
+    assert (calls['買賣權'] == '買權').all() and (puts['買賣權'] == '賣權').all()
+    assert MarketSnapshot.coerce(snapshot) is snapshot
+
+
+def test_quote_and_locate():
+    snapshot = make_snapshot('202001', [12100, 11900, 12000], ['call', 'put', 'call'], close=[30, 40, 50])
+    assert snapshot.expiries == ['202001']
+    assert snapshot.chain('202001', 'call').strike.tolist() == [12000.0, 12100.0]
+    assert snapshot.quote('202001', 11900, 'put').close == 40.0
+    assert snapshot.quote('202001', 11900, 'call') is None
+    rows = snapshot.locate('202001', [12100, 11800], ['call', 'put'])
+    assert rows[1] == -1
+    assert snapshot.take('close', rows)[0] == 30.0 and np.isnan(snapshot.take('close', rows)[1])
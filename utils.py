@@ -1,7 +1,16 @@
+import os
+import re
+import copy
+import inspect
+import pickle
 import pandas as pd
 import numpy as np
 from abc import ABC, abstractmethod
 from typing import List, Dict, Tuple, Optional
+from event_journal import (EventJournal, get_journal, set_journal, new_journal_like,
+                           DEBUG, INFO, WARNING, ERROR,
+                           FILL, SIGNAL, MODE_CHANGE, MISSING_QUOTE, SOLVER_FAILURE, HEDGE, DATA, STRATEGY,
+                           ERROR_EVENT)
 
 
 
@@ -17,14 +26,15 @@ def clean_numeric_col(series):
         errors='coerce'
     )
 
-def clean_futures_data(df_raw):
+def clean_futures_data(df_raw, journal=None):
     """
     清洗期貨資料
     1. 轉換日期格式
     2. 排除價差單 (含有 '/' 的合約)
     3. 轉換價格欄位為浮點數
     """
-    print("--- 開始清洗期貨資料 (Futures) ---")
+    journal = journal or get_journal()
+    journal.info(DATA, "--- 開始清洗期貨資料 (Futures) ---")
     df = df_raw.copy()
     
     # 1. 日期標準化
@@ -38,7 +48,7 @@ def clean_futures_data(df_raw):
     before_len = len(df)
     df = df[~(mask_spread_month | mask_spread_contract)]
     after_len = len(df)
-    print(f">> 已排除價差單: {before_len - after_len} 筆")
+    journal.info(DATA, ">> 已排除價差單: {n} 筆", n=before_len - after_len)
 
     # 3. 數值欄位清洗 (去除逗號, 轉 float)
     target_cols = ['開盤價', '最高價', '最低價', '收盤價', '結算價']
@@ -50,17 +60,18 @@ def clean_futures_data(df_raw):
     df.sort_values(by=['交易日期', '契約', '到期月份(週別)'], inplace=True)
     df.reset_index(drop=True, inplace=True)
     
-    print(f">> 期貨資料清洗完成，共 {len(df)} 筆。")
+    journal.info(DATA, ">> 期貨資料清洗完成，共 {n} 筆。", n=len(df))
     return df
 
-def clean_options_data(df_raw):
+def clean_options_data(df_raw, journal=None):
     """
     清洗選擇權資料
     1. 過濾非一般交易時段
     2. 轉換日期與履約價格式
     3. 轉換價格欄位
     """
-    print("--- 開始清洗選擇權資料 (Options) ---")
+    journal = journal or get_journal()
+    journal.info(DATA, "--- 開始清洗選擇權資料 (Options) ---")
     df = df_raw.copy()
     for col in df.select_dtypes(include=['object']).columns:
         df[col] = df[col].astype(str).str.strip()
@@ -69,7 +80,7 @@ def clean_options_data(df_raw):
     if '交易時段' in df.columns:
         before_len = len(df)
         df = df[df['交易時段'] == '一般']
-        print(f">> 已過濾盤後資料: {before_len - len(df)} 筆")
+        journal.info(DATA, ">> 已過濾盤後資料: {n} 筆", n=before_len - len(df))
     
     # 2. 日期標準化
     df['交易日期'] = pd.to_datetime(df['交易日期'])
@@ -77,8 +88,9 @@ def clean_options_data(df_raw):
     # 3. 履約價轉數值 (重要：用於排序與查找)
     df['履約價'] = clean_numeric_col(df['履約價'])
     
-    # 4. 價格欄位清洗
-    target_cols = ['開盤價', '最高價', '最低價', '收盤價', '結算價']
+    # 4. 價格欄位清洗 (含成交模型用的買賣價、成交量、未沖銷契約數)
+    target_cols = ['開盤價', '最高價', '最低價', '收盤價', '結算價',
+                   '最後最佳買價', '最後最佳賣價', '成交量', '未沖銷契約數']
     for col in target_cols:
         if col in df.columns:
             df[col] = clean_numeric_col(df[col])
@@ -91,7 +103,7 @@ def clean_options_data(df_raw):
     df.sort_values(by=['交易日期', '到期月份(週別)', '履約價'], inplace=True)
     df.reset_index(drop=True, inplace=True)
     
-    print(f">> 選擇權資料清洗完成，共 {len(df)} 筆。")
+    journal.info(DATA, ">> 選擇權資料清洗完成，共 {n} 筆。", n=len(df))
     return df
 
 
@@ -103,7 +115,7 @@ class Leg:
     def __init__(self, side: str, strike: float, opt_type: str):
         self.side = side        # 'buy' or 'sell'
         self.strike = strike
-        self.opt_type = opt_type # 'call' or 'put'
+        self.opt_type = opt_type # 'call' or 'put'；期貨腳為 'TX' / 'MTX' (strike 不使用，月份為 signal.contract)
 
     def __repr__(self):
         return f"{self.side.upper()} {self.opt_type.upper()} @ {self.strike}"
@@ -124,6 +136,13 @@ class BaseStrategy(ABC):
     def on_rollover(self, context, market_data, rollover_info) -> List[TradeSignal]:
         pass
 
+    def get_state(self) -> dict:
+        """策略的可續跑狀態 (預設為所有屬性的深複製，例如 mode / virtual_cost)"""
+        return copy.deepcopy(vars(self))
+
+    def set_state(self, state: dict):
+        vars(self).update(copy.deepcopy(state))
+
 # --- 輔助函式 ---
 def get_rollover_info(date, rollover_map):
     """從 map 取得換倉資訊，確保回傳 3 個值"""
@@ -172,221 +191,442 @@ def get_expiry_date(contract_str):
         return pd.NaT
 import numpy as np
 import pandas as pd
+import math
 import py_lets_be_rational as lj
+from functools import lru_cache
+from market_snapshot import MarketSnapshot, OptionChain, OptionQuote, CALL_LABEL, PUT_LABEL, QUOTE_COLUMN_MAP
+from fill_model import FillModel
+from profiling import StageProfiler, NULL_PROFILER
 
-def get_greeks(df_opt, nowDate, S, R):
-    now_df = df_opt[df_opt['交易日期'] == nowDate]
-    call_df = now_df[now_df['買賣權']=='買權']
-    put_df  = now_df[now_df['買賣權']=='賣權']
-    
-    
-    """
-    1. 先計算 Implied Volatility (IV)
-    2. 再使用 IV 計算 Greeks
-    """
-    # 避免 SettingWithCopyWarning
-    call_df = call_df.copy()
-    put_df = put_df.copy()
 
-    # ==========================================
-    # 1. 時間前處理 (T & dT)
-    # ==========================================
-    # 假設 get_expiry_date 函式已定義
-    call_df['T'] = call_df['到期月份(週別)'].apply(get_expiry_date)
-    put_df['T'] = put_df['到期月份(週別)'].apply(get_expiry_date)
+@lru_cache(maxsize=None)
+def get_expiry_date_cached(contract_str):
+    """get_expiry_date 的快取版本 (同一個合約字串只解析一次)"""
+    return get_expiry_date(contract_str)
 
-    # 計算年化剩餘時間，並設定極小值避免除以零
-    call_df['dT'] = ((call_df['T'] - call_df['交易日期']).dt.days / 365.0).clip(lower=1e-5)
-    put_df['dT'] = ((put_df['T'] - put_df['交易日期']).dt.days / 365.0).clip(lower=1e-5)
 
-    # ==========================================
-    # 2. 定義 IV 計算函式
-    # ==========================================
-    def calculate_iv(row, option_type_flag):
-        """
-        option_type_flag: 1.0 for Call, -1.0 for Put
-        """
-        price = row['收盤價']
-        K = row['履約價']
-        T = row['dT']
-        
-        # 簡易檢查：價格異常或時間歸零直接回傳 0
-        if price <= 0 or T <= 0:
-            return 0.0
+def expiry_dT_array(expiry, now_date):
+    """
+    計算年化剩餘時間 dT (天數 / 365，最小 1e-5)
+    到期月份字串先取唯一值再解析，避免每列都呼叫 get_expiry_date
+    """
+    uniq, inv = np.unique(np.asarray(expiry, dtype=str), return_inverse=True)
+    T = pd.to_datetime([get_expiry_date_cached(e) for e in uniq])
+    days = np.asarray((T - pd.Timestamp(now_date)).days, dtype=float)
+    return np.clip(days / 365.0, 1e-5, None)[inv]
 
-        # 計算遠期價格 F = S * exp(R*T)
-        F = S * np.exp(R * T)
 
+def implied_volatility_array(price, K, T, S, R, flag, return_failures=False):
+    """
+    逐列以 py_lets_be_rational 反推 IV
+
+    參數:
+        price, K, T (ndarray): 權利金、履約價、年化剩餘時間
+        flag (ndarray): 1.0 為 Call, -1.0 為 Put
+        return_failures (bool): 是否一併回傳解算失敗筆數 (例外或非有限值)
+    回傳:
+        ndarray: IV (價格異常、低於內含價值或無解時為 0)
+        (iv, n_fail): 當 return_failures=True
+    """
+    iv = np.zeros(len(price))
+    n_fail = 0
+    for i, (p, k, t, q) in enumerate(zip(np.asarray(price, float).tolist(), np.asarray(K, float).tolist(),
+                                         np.asarray(T, float).tolist(), np.asarray(flag, float).tolist())):
+        # 簡易檢查：價格異常 (含缺價 NaN) 或時間歸零直接回傳 0
+        if not (p > 0 and t > 0):
+            continue
+        # 計算遠期價格 F = S * exp(R*T)
+        F = S * math.exp(R * t)
         # 檢查內含價值 (Intrinsic Value) 防止套利違規導致錯誤
-        intrinsic = max(0, F - K) if option_type_flag == 1 else max(0, K - F)
-        if price <= intrinsic:
-            return 0.0  # 價格低於內含價值，理論上 IV 為 0 或無解
-
+        intrinsic = max(0, F - k) if q == 1 else max(0, k - F)
+        if p <= intrinsic:
+            continue
         try:
-            # 使用 py_lets_be_rational 反推 IV
-            # 參數順序: price, F, K, T, q
-            iv = lj.implied_volatility_from_a_transformed_rational_guess(
-                price, F, K, T, option_type_flag
-            )
-            return iv
-        except:
-            return 0.0
+            iv[i] = lj.implied_volatility_from_a_transformed_rational_guess(p, F, k, t, q)
+            if not math.isfinite(iv[i]):
+                n_fail += 1
+        except Exception:
+            n_fail += 1
+    if return_failures:
+        return iv, n_fail
+    return iv
 
-    # ==========================================
-    # 3. 執行 IV 計算
-    # ==========================================
-    # Call: q = 1.0
-    call_df['Implied_Volatility'] = call_df.apply(lambda row: calculate_iv(row, 1.0), axis=1)
-    
-    # Put: q = -1.0
-    put_df['Implied_Volatility'] = put_df.apply(lambda row: calculate_iv(row, -1.0), axis=1)
 
-    # ==========================================
-    # 4. 定義 Greeks 計算函式 (Black-Scholes)
-    # ==========================================
-    def calculate_bs_greeks(row, option_type_str):
-        K = row['履約價']
-        T = row['dT']
-        sigma = row['Implied_Volatility']
-        
-        if sigma <= 0 or T <= 0:
-            return 0.0, 0.0, 0.0, 0.0, 0.0
-            
-        sqrt_T = np.sqrt(T)
-        d1 = (np.log(S / K) + (R + 0.5 * sigma ** 2) * T) / (sigma * sqrt_T)
-        d2 = d1 - sigma * sqrt_T
+_norm_cdf_ufunc = np.frompyfunc(lj.norm_cdf, 1, 1)
+
+
+def bs_greeks_array(K, T, sigma, S, R, is_call, cdf=None):
+    """
+    向量化 Black-Scholes Greeks (公式與舊版逐列計算相同)
+
+    參數:
+        cdf (callable): 標準常態 CDF (None 則逐列呼叫 py_lets_be_rational.norm_cdf；近似模式傳入查表版本)
 
-        # 使用 lj.norm_cdf
-        nd1 = lj.norm_cdf(d1)
-        nd2 = lj.norm_cdf(d2)
+    回傳:
+        tuple: (delta, gamma, theta, vega, itm_prob)，sigma <= 0 或 T <= 0 的列皆為 0
+    """
+    K = np.asarray(K, float)
+    T = np.asarray(T, float)
+    sigma = np.asarray(sigma, float)
+    is_call = np.asarray(is_call, bool)
+    out = [np.zeros(len(K)) for _ in range(5)]
+
+    idx = np.flatnonzero(~((sigma <= 0) | (T <= 0)))
+    if len(idx) == 0:
+        return tuple(out)
+    k, t, s, c = K[idx], T[idx], sigma[idx], is_call[idx]
+
+    with np.errstate(all='ignore'):
+        sqrt_T = np.sqrt(t)
+        d1 = (np.log(S / k) + (R + 0.5 * s ** 2) * t) / (s * sqrt_T)
+        d2 = d1 - s * sqrt_T
+
+        if cdf is None:
+            nd1 = _norm_cdf_ufunc(d1).astype(float)
+            nd2 = _norm_cdf_ufunc(d2).astype(float)
+        else:
+            nd1, nd2 = cdf(d1), cdf(d2)
         n_prime_d1 = (1.0 / np.sqrt(2 * np.pi)) * np.exp(-0.5 * d1 ** 2)
 
         # Delta, Itm Probability
-        if option_type_str == 'call':
-            delta = nd1
-            itm_prob = nd2
-        else:
-            delta = nd1 - 1.0
-            itm_prob = 1.0 - nd2
+        out[0][idx] = np.where(c, nd1, nd1 - 1.0)
+        out[4][idx] = np.where(c, nd2, 1.0 - nd2)
         # Gamma
-        gamma = n_prime_d1 / (S * sigma * sqrt_T)
-
+        out[1][idx] = n_prime_d1 / (S * s * sqrt_T)
+        # Theta
+        theta_common = -(S * s * n_prime_d1) / (2 * sqrt_T)
+        carry = R * k * np.exp(-R * t)
+        out[2][idx] = np.where(c, theta_common - carry * nd2, theta_common + carry * (1.0 - nd2))
         # Vega
-        vega = S * sqrt_T * n_prime_d1
+        out[3][idx] = S * sqrt_T * n_prime_d1
+    return tuple(out)
 
-        # Theta
-        theta_common = -(S * sigma * n_prime_d1) / (2 * sqrt_T)
-        if option_type_str == 'call':
-            theta = theta_common - R * K * np.exp(-R * T) * nd2
+
+def get_greeks(df_opt, nowDate, S, R, approx_greeks=None):
+    """
+    計算單日的 IV 與 Greeks (DataFrame 版本，保留給舊程式使用)
+    1. 先計算 Implied Volatility (IV)
+    2. 再使用 IV 計算 Greeks
+
+    approx_greeks (greeks_grid.ApproxGreeks): 近似模式 (查表反推 IV)，None 則為精確解
+
+    回測主迴圈請改用 market_data_generator (直接產出 MarketSnapshot，不建立 DataFrame)
+    """
+    now_df = df_opt[df_opt['交易日期'] == nowDate]
+    # 避免 SettingWithCopyWarning
+    call_df = now_df[now_df['買賣權']=='買權'].copy()
+    put_df  = now_df[now_df['買賣權']=='賣權'].copy()
+
+    for df, flag in ((call_df, 1.0), (put_df, -1.0)):
+        # 時間前處理 (T & dT)
+        df['T'] = df['到期月份(週別)'].apply(get_expiry_date_cached)
+        df['dT'] = ((df['T'] - df['交易日期']).dt.days / 365.0).clip(lower=1e-5)
+
+        K = df['履約價'].to_numpy(dtype=float)
+        T = df['dT'].to_numpy(dtype=float)
+        if approx_greeks is None:
+            iv = implied_volatility_array(df['收盤價'].to_numpy(dtype=float), K, T, S, R, np.full(len(df), flag))
+            greeks = bs_greeks_array(K, T, iv, S, R, np.full(len(df), flag > 0))
         else:
-            n_neg_d2 = 1.0 - nd2
-            theta = theta_common + R * K * np.exp(-R * T) * n_neg_d2
-            
-        return delta, gamma, theta, vega, itm_prob
+            iv = approx_greeks.implied_volatility(df['收盤價'].to_numpy(dtype=float), K, T, S, R, np.full(len(df), flag))
+            greeks = approx_greeks.greeks(K, T, iv, S, R, np.full(len(df), flag > 0))
+        df['Implied_Volatility'] = iv
 
-    # ==========================================
-    # 5. 執行 Greeks 計算
-    # ==========================================
-    # Call Greeks
-    greeks_call = call_df.apply(lambda row: calculate_bs_greeks(row, 'call'), axis=1, result_type='expand')
-    call_df[['Delta', 'Gamma', 'Theta', 'Vega', 'Itm_Prob']] = greeks_call
+        df[['Delta', 'Gamma', 'Theta', 'Vega', 'Itm_Prob']] = np.column_stack(greeks)
 
-    # Put Greeks
-    greeks_put = put_df.apply(lambda row: calculate_bs_greeks(row, 'put'), axis=1, result_type='expand')
-    put_df[['Delta', 'Gamma', 'Theta', 'Vega', 'Itm_Prob']] = greeks_put
-    
     return call_df, put_df
 
 
-def market_data_generator(start_date, end_date, df_opt, df_fut, risk_free_rate=0.01):
+class OptionDataIndex:
+    """
+    選擇權資料的逐日索引 (整個回測只建立一次)
+
+    將 df_opt 依交易日期分組並抽出 NumPy 欄位，之後每天只需切片，
+    不必再對整張大表做 df_opt['交易日期'] == date 的布林遮罩。
+    """
+    def __init__(self, df_opt):
+        self.source = df_opt
+        cp = df_opt['買賣權'].to_numpy()
+        is_call = cp == CALL_LABEL
+        keep = np.flatnonzero(is_call | (cp == PUT_LABEL))
+
+        dates = df_opt['交易日期'].to_numpy()[keep]
+        order = np.argsort(dates, kind='stable')
+        self.rows = keep[order]
+        sorted_dates = dates[order]
+        uniq, starts = np.unique(sorted_dates, return_index=True)
+        ends = np.append(starts[1:], len(sorted_dates))
+        self._bounds = {pd.Timestamp(d): slice(int(a), int(b)) for d, a, b in zip(uniq, starts, ends)}
+
+        self.expiry = df_opt['到期月份(週別)'].astype(str).to_numpy()[self.rows]
+        self.is_call = is_call[self.rows]
+        self.columns = {}
+        for name, col in (('strike', '履約價'), ('close', '收盤價'), ('settle', '結算價')):
+            if col in df_opt.columns:
+                self.columns[name] = df_opt[col].to_numpy(dtype=float)[self.rows]
+            else:
+                self.columns[name] = np.full(len(self.rows), np.nan)
+        # 買賣價、成交量、未沖銷契約數 (成交模型用)，原始資料沒有的欄位就不建立
+        for name, col in QUOTE_COLUMN_MAP.items():
+            if col in df_opt.columns:
+                self.columns[name] = pd.to_numeric(df_opt[col], errors='coerce').to_numpy(dtype=float)[self.rows]
+
+    @property
+    def dates(self):
+        return list(self._bounds.keys())
+
+    def day(self, date) -> Optional[slice]:
+        """當日資料在索引中的切片，無資料回傳 None"""
+        return self._bounds.get(pd.Timestamp(date))
+
+
+def build_market_snapshot(opt_index, date, S, R, profiler=NULL_PROFILER, journal=None,
+                          approx_greeks=None) -> Optional[MarketSnapshot]:
+    """
+    由逐日索引切出當日資料，計算 IV/Greeks 後組成 MarketSnapshot (當日無資料回傳 None)
+    approx_greeks (greeks_grid.ApproxGreeks): 近似模式 (查表反推 IV)，None 則為精確解
+    """
+    t = profiler.start()
+    sl = opt_index.day(date)
+    if sl is None:
+        return None
+    expiry = opt_index.expiry[sl]
+    is_call = opt_index.is_call[sl]
+    strike = opt_index.columns['strike'][sl]
+    close = opt_index.columns['close'][sl]
+    profiler.stop('slice', t)
+    profiler.count('rows', len(strike))
+
+    t = profiler.start()
+    dT = expiry_dT_array(expiry, date)
+    profiler.stop('expiry', t)
+
+    t = profiler.start()
+    if approx_greeks is None:
+        iv, n_fail = implied_volatility_array(close, strike, dT, S, R, np.where(is_call, 1.0, -1.0),
+                                              return_failures=True)
+    else:
+        iv, n_fail, n_fallback = approx_greeks.implied_volatility(close, strike, dT, S, R,
+                                                                  np.where(is_call, 1.0, -1.0), return_stats=True)
+        profiler.count('iv_fallback', n_fallback)
+    profiler.stop('iv', t)
+    profiler.count('solver_fail', n_fail)
+    if n_fail and journal is not None:
+        journal.warning(SOLVER_FAILURE, ">> [IV 解算失敗] {date:%Y-%m-%d} 共 {n} 筆", date=date, n=n_fail)
+
+    t = profiler.start()
+    if approx_greeks is None:
+        delta, gamma, theta, vega, itm_prob = bs_greeks_array(strike, dT, iv, S, R, is_call)
+    else:
+        delta, gamma, theta, vega, itm_prob = approx_greeks.greeks(strike, dT, iv, S, R, is_call)
+    profiler.stop('greeks', t)
+
+    columns = {
+        'strike': strike, 'close': close, 'settle': opt_index.columns['settle'][sl],
+        'dT': dT, 'iv': iv, 'delta': delta, 'gamma': gamma, 'theta': theta,
+        'vega': vega, 'itm_prob': itm_prob,
+    }
+    for name in QUOTE_COLUMN_MAP:
+        if name in opt_index.columns:
+            columns[name] = opt_index.columns[name][sl]
+    t = profiler.start()
+    snapshot = MarketSnapshot(date, S, columns, expiry, is_call,
+                              source=opt_index.source, rows=opt_index.rows[sl])
+    profiler.stop('snapshot', t)
+    return snapshot
+
+
+def near_month_spot(df_fut):
+    """
+    每個交易日的標的價格 S (近月期貨；開盤價 > 收盤價 > 結算價)
+    回傳 dict: {pd.Timestamp: S}，查無有效價格的日子不會出現在結果中
+    """
+    # 穩定排序後每日取第一筆 = 當日依到期月份排序後的最近月合約
+    df = df_fut.sort_values(by=['交易日期', '到期月份(週別)'], kind='mergesort')
+    df = df.drop_duplicates(subset='交易日期', keep='first')
+
+    S = df['開盤價'].to_numpy(dtype=float)
+    for col in ('收盤價', '結算價'):
+        bad = np.isnan(S) | (S <= 0)
+        S = np.where(bad, df[col].to_numpy(dtype=float), S)
+    valid = ~(np.isnan(S) | (S <= 0))
+    return {pd.Timestamp(d): float(s) for d, s in zip(df['交易日期'].to_numpy()[valid], S[valid])}
+
+
+def market_data_generator(start_date, end_date, df_opt, df_fut, risk_free_rate=0.01, opt_index=None,
+                          profiler=NULL_PROFILER, journal=None, approx_greeks=None):
     """
     逐日生成市場資料生成器 (Generator)
-    
+
+    參數:
+        opt_index (OptionDataIndex): 可重複使用的選擇權逐日索引 (None 則自動建立)
+        profiler (StageProfiler): 階段計時器 (預設停用)
+        journal (EventJournal): 事件日誌 (None 則使用預設日誌)
+        approx_greeks (greeks_grid.ApproxGreeks): 近似 IV/Greeks 模式 (None 則為精確解)
+
     Yields:
-        tuple: (current_date, S, call_df, put_df)
+        MarketSnapshot: 當日市場快照
         
-        - current_date (pd.Timestamp): 當前交易日
-        - S (float): 當日標的價格 (使用近月期貨價格)
-        - call_df (pd.DataFrame): 當日 Call 資料表 (含 Greeks)
-        - put_df (pd.DataFrame): 當日 Put 資料表 (含 Greeks)
+        - snapshot.date (pd.Timestamp): 當前交易日
+        - snapshot.S (float): 當日標的價格 (使用近月期貨價格)
+        - snapshot.chain(expiry, 'call'/'put'), snapshot.quote(expiry, K, type): 含 Greeks 的報價
+        - 舊寫法 date, S, call_df, put_df = snapshot 仍可使用 (會建立 DataFrame)
     """
     
-    print(f"--- 初始化市場資料生成器 ({start_date} to {end_date}) ---")
+    journal = journal or get_journal()
+    journal.info(DATA, "--- 初始化市場資料生成器 ({start} to {end}) ---", start=start_date, end=end_date)
     
     # 1. 建立交易日曆 (只取期貨有資料的日子，並限制在回測區間內)
-    # 確保 index 重設，方便後續操作
     all_dates = df_fut['交易日期'].unique()
-    # all_dates = pd.to_datetime(all_dates).sort_values()
     all_dates = all_dates[pd.to_datetime(all_dates).argsort()]
-    # all_dates = pd.DataFrame(all_dates).sort_values(by=0)[0]
     
     mask_date = (all_dates >= pd.to_datetime(start_date)) & (all_dates <= pd.to_datetime(end_date))
     trade_dates = all_dates[mask_date]
     
-    print(f">> 預計執行交易日數: {len(trade_dates)} 天")
+    journal.info(DATA, ">> 預計執行交易日數: {n} 天", n=len(trade_dates))
 
-    # 2. 逐日迴圈
+    # 2. 預先建立索引 (只掃描大表一次)
+    t = profiler.start()
+    spot = near_month_spot(df_fut)
+    if opt_index is None:
+        opt_index = OptionDataIndex(df_opt)
+    profiler.stop('index', t)
+
+    # 3. 逐日迴圈
     for current_date in trade_dates:
-        
-        # ==========================================
-        # A. 取得當日標的價格 S (Near Month Future)
-        # ==========================================
-        # 篩選當日期貨資料
-        daily_fut = df_fut[df_fut['交易日期'] == current_date]
-        
-        if daily_fut.empty:
-            continue
-            
-        # 找出「近月合約」：排序「到期月份」，取第一筆
-        # 假設資料已清洗過，無價差單，且格式正確
-        daily_fut_sorted = daily_fut.sort_values(by='到期月份(週別)')
-        
-        # 取最近月合約
-        near_month_row = daily_fut_sorted.iloc[0]
-        
-        # 決定價格 (Open > Close > Settlement)
-        S = near_month_row['開盤價']
-        if pd.isna(S) or S <= 0:
-            S = near_month_row['收盤價']
-        if pd.isna(S) or S <= 0:
-            S = near_month_row['結算價']
-            
-        # 若仍無價格，跳過該日
-        if pd.isna(S) or S <= 0:
-            # print(f"Warning: {current_date.date()} 查無有效標的價格 S，跳過。")
-            continue
+        current_date = pd.Timestamp(current_date)
 
-        # ==========================================
-        # B. 準備當日選擇權資料
-        # ==========================================
-        # 為了效能，先從大表切出當日資料
-        daily_opt = df_opt[df_opt['交易日期'] == current_date]
-        
-        if daily_opt.empty:
+        # A. 取得當日標的價格 S (Near Month Future)，若無價格跳過該日
+        S = spot.get(current_date)
+        if S is None:
             continue
 
-        # ==========================================
-        # C. 計算 Greeks
-        # ==========================================
-        # 呼叫您提供的 get_greeks 函式
-        # 注意：get_greeks 會回傳 (call_df, put_df)
+        # B. 切出當日選擇權資料並計算 Greeks
         try:
-            # 這裡傳入 daily_opt，get_greeks 內部會再 filter 一次 date，這沒問題
-            call_greeks, put_greeks = get_greeks(daily_opt, current_date, S, risk_free_rate)
-            
-            # 簡單防呆：確保回傳不是空的
-            if call_greeks.empty and put_greeks.empty:
-                continue
-                
-            # ==========================================
-            # D. Yield 結果
-            # ==========================================
-            yield current_date, S, call_greeks, put_greeks
-            
+            snapshot = build_market_snapshot(opt_index, current_date, S, risk_free_rate, profiler, journal,
+                                             approx_greeks)
         except Exception as e:
-            print(f"Error on {current_date.date()}: {e}")
+            journal.error(ERROR_EVENT, "Error on {date:%Y-%m-%d}: {error}", date=current_date, error=repr(e))
+            continue
+
+        # 簡單防呆：確保當日有資料
+        if snapshot is None or snapshot.n_rows == 0:
             continue
 
+        # C. Yield 結果
+        yield snapshot
+
+
+# ==========================================
+# 背景預先計算 (Prefetch Pipeline)
+# ==========================================
+_PREFETCH_INDEX = None  # 行程模式下，每個背景行程持有的逐日索引
+
+
+def _prefetch_init(opt_index):
+    global _PREFETCH_INDEX
+    _PREFETCH_INDEX = opt_index
+
+
+def _prefetch_build(opt_index, date, S, R, level, profile, approx_greeks=None):
+    """
+    背景工作：建立單日快照
+    事件與計時先記在當日專屬的日誌/計時器，由主執行緒依日期順序併回 (避免跨執行緒交錯)
+    """
+    opt_index = opt_index if opt_index is not None else _PREFETCH_INDEX
+    journal = EventJournal(level=level)
+    profiler = StageProfiler(enabled=profile)
+    snapshot = build_market_snapshot(opt_index, date, S, R, profiler, journal, approx_greeks)
+    return snapshot, list(journal._events), profiler
+
+
+def prefetch_market_data_generator(start_date, end_date, df_opt, df_fut, risk_free_rate=0.01, depth=4,
+                                   mode='thread', workers=None, opt_index=None,
+                                   profiler=NULL_PROFILER, journal=None, approx_greeks=None):
+    """
+    與 market_data_generator 相同的輸出，但由背景工作預先計算接下來 depth 天的快照
+
+    主執行緒 (策略與下單) 消化第 t 天時，背景工作已在計算 t+1 ... t+depth，
+    整體耗時趨近 max(IV 計算, 策略執行) 而非兩者相加。
+    輸出順序與單執行緒版本相同；單日計算拋出的例外同樣記錄為 error 事件並跳過該日。
+
+    參數:
+        depth (int): 預先計算的天數 (佇列上限)
+        mode (str): 'thread' 或 'process'
+                    py_lets_be_rational 為純 Python，受 GIL 限制，要真正平行請用 'process'
+        workers (int): 背景工作數 (None 則為 min(depth, CPU 數))
+        approx_greeks (greeks_grid.ApproxGreeks): 近似 IV/Greeks 模式 (None 則為精確解)
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor
+
+    journal = journal or get_journal()
+    journal.info(DATA, "--- 初始化市場資料生成器 ({start} to {end}, 預先計算 {depth} 天, {mode}) ---",
+                 start=start_date, end=end_date, depth=depth, mode=mode)
+
+    all_dates = df_fut['交易日期'].unique()
+    all_dates = all_dates[pd.to_datetime(all_dates).argsort()]
+    mask_date = (all_dates >= pd.to_datetime(start_date)) & (all_dates <= pd.to_datetime(end_date))
+    trade_dates = all_dates[mask_date]
+    journal.info(DATA, ">> 預計執行交易日數: {n} 天", n=len(trade_dates))
+
+    t = profiler.start()
+    spot = near_month_spot(df_fut)
+    if opt_index is None:
+        opt_index = OptionDataIndex(df_opt)
+    profiler.stop('index', t)
+
+    days = iter([(pd.Timestamp(d), spot[pd.Timestamp(d)]) for d in trade_dates if pd.Timestamp(d) in spot])
+    if approx_greeks is not None:
+        approx_greeks.grid  # 先在主行程建表/存檔，背景工作直接讀檔
+    workers = workers or max(1, min(depth, os.cpu_count() or 1))
+    if mode == 'process':
+        # 大表不傳給背景行程，快照傳回後再掛上 source
+        light_index = copy.copy(opt_index)
+        light_index.source = None
+        pool = ProcessPoolExecutor(workers, initializer=_prefetch_init, initargs=(light_index,))
+        task_index = None
+    elif mode == 'thread':
+        pool = ThreadPoolExecutor(workers)
+        task_index = opt_index
+    else:
+        raise ValueError(f"未知的 prefetch mode: {mode}")
+
+    pending = deque()
+
+    def submit_next():
+        day = next(days, None)
+        if day is not None:
+            pending.append((day[0], pool.submit(_prefetch_build, task_index, day[0], day[1], risk_free_rate,
+                                                journal.level, profiler.enabled, approx_greeks)))
+
+    try:
+        for _ in range(max(1, depth)):
+            submit_next()
+        while pending:
+            current_date, future = pending.popleft()
+            try:
+                snapshot, events, day_profiler = future.result()
+            except BrokenExecutor:
+                raise
+            except Exception as e:
+                journal.error(ERROR_EVENT, "Error on {date:%Y-%m-%d}: {error}", date=current_date, error=repr(e))
+                submit_next()
+                continue
+            # 先補上下一個工作，讓背景在策略執行期間持續計算
+            submit_next()
+            for date, level, kind, template, fields in events:
+                journal.log(level, kind, template, date, **fields)
+            profiler.merge(day_profiler)
+
+            if snapshot is None or snapshot.n_rows == 0:
+                continue
+            if mode == 'process':
+                snapshot.attach_source(opt_index.source)
+            yield snapshot
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
 
 def build_rollover_map(df_fut, start_date, end_date, offset=3):
     """建立換倉日曆 (簡易模擬: 每月第3個週三為結算日)"""
@@ -547,9 +787,262 @@ def build_rollover_map(df_fut, start_date, end_date, offset=3):
 #             # print(f"[{date.date()}] CLOSE {qty} lots. Balance: {self.balance:.0f}")
 
 
-class BacktestExecutor:
-    def __init__(self, strategy, start_date, end_date, df_opt, df_fut, balance=2_000_000):
+class PositionBook:
+    """
+    資金與持倉帳 (成交後的記帳邏輯)
+
+    BacktestExecutor 以當日快照查價、live_runner.LiveRunner 以券商回報的成交價，
+    兩者都呼叫 _fill_open / _fill_close 記帳。
+    子類別需提供 strategy, balance, current_position, history, journal 屬性；
+    使用期貨部位 (_fill_futures) 時另需 futures, hedges, hedge_pnl, hedge_fees 屬性。
+    """
+    def _fill_open(self, signal, prices, date, S, qty=None, fees=0.0):
+        """
+        建倉記帳
+        參數:
+            prices (list): 與 signal.legs 對齊的成交價，None 表示該腳查無報價 (略過)
+            qty (int): 實際成交口數 (None 則為 signal.quantity；成交模型限量時可能較少)
+            fees (float): 手續費 + 交易稅 (元)
+        """
+        net_cash_flow = 0.0
+        legs_record = []
+        qty = signal.quantity if qty is None else qty
+        
+        for leg, price in zip(signal.legs, prices):
+            if price is None:
+                self.journal.warning(MISSING_QUOTE, ">> [缺資料] 無法建倉: {leg}", date=date,
+                                     contract=signal.contract, leg=repr(leg))
+                continue
+            
+            direction = 1 if leg.side == 'sell' else -1
+            net_cash_flow += (price * direction)
+            
+            legs_record.append({
+                'side': leg.side, 'type': leg.opt_type, 
+                'strike': leg.strike, 'entry_price': price
+            })
+
+        if not legs_record: return 
+
+        total_premium = net_cash_flow * 50 * qty
+        self.balance += total_premium - fees
+        
+        self.current_position = {
+            'contract': signal.contract, # 記住這個合約月份！
+            'legs': legs_record,
+            'qty': qty,
+            'total_premium': total_premium,
+            'fees': fees,
+            'entry_date': date,
+            'entry_index': S,
+            'strategy_mode': getattr(self.strategy, 'mode', 'N/A')
+        }
+        self.journal.info(FILL, ">> [成交 OPEN] {date:%Y-%m-%d} {contract} | 口數: {qty} | 收權利金: {premium:.0f}",
+                          date=date, action='OPEN', contract=signal.contract, qty=qty, premium=total_premium,
+                          fees=fees, reason=signal.reason)
+        if qty < signal.quantity:
+            self.journal.warning(FILL, ">> [部分成交 OPEN] {date:%Y-%m-%d} {contract} | 成交 {qty} / 委託 {requested} 口",
+                                 date=date, contract=signal.contract, qty=qty, requested=signal.quantity)
+
+    def _fill_close(self, signal, prices, date, S, qty=None, fees=0.0):
+        """
+        平倉記帳
+        參數:
+            prices (list): 與持倉 legs 對齊的成交價，None 表示結算或查無報價 (以內含價值計算)
+            qty (int): 實際平倉口數 (None 則全部平倉；少於持倉口數時剩餘部位保留，依比例分攤權利金與建倉費用)
+            fees (float): 平倉的手續費 + 交易稅 (元)
+        """
+        position = self.current_position
+        close_contract = position['contract']
+        close_cash_flow = 0.0
+        legs_detail_str = []
+        legs_closed = []
+        qty = position['qty'] if qty is None else min(qty, position['qty'])
+        ratio = qty / position['qty']
+        premium = position['total_premium'] * ratio
+        open_fees = position.get('fees', 0.0) * ratio
+        
+        for leg_data, exit_price in zip(self.current_position['legs'], prices):
+            if exit_price is None:
+                # 結算或查無報價，使用內含價值計算
+                strike = leg_data['strike']
+                if leg_data['type'] == 'call': exit_price = max(0, S - strike)
+                else: exit_price = max(0, strike - S)
+
+            direction = -1 if leg_data['side'] == 'sell' else 1
+            close_cash_flow += (exit_price * direction)
+            
+            legs_detail_str.append(f"{leg_data['type']} {leg_data['strike']} ({leg_data['entry_price']}->{exit_price})")
+            legs_closed.append({**leg_data, 'exit_price': exit_price})
+
+        close_amount = close_cash_flow * 50 * qty
+        pnl = premium + close_amount - open_fees - fees  # 淨損益 (扣除建倉與平倉費用)
+        self.balance += close_amount - fees
+        
+        self.history.append({
+            'entry_date': position['entry_date'],
+            'exit_date': date,
+            'pnl': pnl,
+            'roi': pnl / abs(premium) if premium!=0 else 0,
+            'fees': open_fees + fees,
+            'trade_detail': " | ".join(legs_detail_str),
+            'balance': self.balance,
+            'contract': close_contract,
+            'qty': qty,
+            'legs': legs_closed,  # 結構化的各腳明細 (side, type, strike, entry_price, exit_price)
+        })
+        
+        self.journal.info(FILL, ">> [成交 CLOSE] {date:%Y-%m-%d} PnL: {pnl:.0f} | Detail: {detail}",
+                          date=date, action='CLOSE', contract=close_contract, qty=qty, pnl=pnl,
+                          fees=open_fees + fees, detail=legs_detail_str, reason=signal.reason)
+        if qty < position['qty']:
+            # 部分平倉：剩餘口數續抱
+            position['qty'] -= qty
+            position['total_premium'] -= premium
+            position['fees'] = position.get('fees', 0.0) - open_fees
+            self.journal.warning(FILL, ">> [部分成交 CLOSE] {date:%Y-%m-%d} {contract} | 剩餘 {qty} 口",
+                                 date=date, contract=close_contract, qty=position['qty'])
+        else:
+            self.current_position = None
+
+    def _position_value(self, snapshot) -> float:
+        """持倉以當前報價平倉的現金流 (查無報價以內含價值計算)；無持倉為 0"""
+        pos = self.current_position
+        if not pos:
+            return 0.0
+        value = 0.0
+        for leg_data in pos['legs']:
+            quote = snapshot.quote(pos['contract'], leg_data['strike'], leg_data['type'])
+            if quote is not None and quote.close == quote.close:
+                price = quote.close
+            elif leg_data['type'] == 'call':
+                price = max(0, snapshot.S - leg_data['strike'])
+            else:
+                price = max(0, leg_data['strike'] - snapshot.S)
+            value += price * (-1 if leg_data['side'] == 'sell' else 1)
+        return value * 50 * pos['qty']
+
+    # ==========================================
+    # 期貨部位 (避險腳)
+    # ==========================================
+    def _fill_futures(self, product, contract, qty, price, date, fees=0.0, reason=''):
+        """
+        期貨成交記帳 (與選擇權持倉分開保存，損益另計於 hedge_pnl)
+        參數:
+            product (str): 'TX' 或 'MTX'
+            contract (str): 到期月份 (YYYYMM)
+            qty (int): 成交口數，買進為正、賣出為負
+            price (float): 成交價
+            fees (float): 手續費 + 交易稅 (元)
+            reason (str): 'rebalance' (Delta 調整) / 'roll' (轉倉) ...
+        """
+        mult = FUTURES_MULTIPLIER[product]
+        key = (product, contract)
+        pos = self.futures.get(key, {'qty': 0, 'avg_price': 0.0})
+        old = pos['qty']
+        new = old + qty
+
+        # 反向成交先沖銷既有部位，沖銷部分實現損益
+        realized = 0.0
+        if old and (old > 0) != (qty > 0):
+            closed = min(abs(qty), abs(old)) * (1 if old > 0 else -1)
+            realized = (price - pos['avg_price']) * closed * mult
+        if new == 0:
+            self.futures.pop(key, None)
+        elif old == 0 or (old > 0) != (new > 0):
+            self.futures[key] = {'qty': new, 'avg_price': float(price)}
+        elif abs(new) > abs(old):
+            avg = (pos['avg_price'] * old + price * qty) / new
+            self.futures[key] = {'qty': new, 'avg_price': float(avg)}
+        else:
+            self.futures[key] = {'qty': new, 'avg_price': pos['avg_price']}
+
+        self.balance += realized - fees
+        self.hedge_pnl += realized - fees
+        self.hedge_fees += fees
+        self.hedges.append({
+            'date': date, 'product': product, 'contract': contract, 'qty': qty, 'price': price,
+            'fees': fees, 'realized_pnl': realized, 'position': new, 'reason': reason, 'balance': self.balance,
+        })
+        self.journal.info(HEDGE, ">> [期貨 {reason}] {date:%Y-%m-%d} {product} {contract} {qty:+d} 口 @ {price:.0f}"
+                                 " | 部位 {position:+d} 口 | 實現損益: {realized:.0f}",
+                          date=date, reason=reason, product=product, contract=contract, qty=qty, price=price,
+                          position=new, realized=realized, fees=fees)
+
+    def _futures_value(self, price_of) -> float:
+        """
+        期貨部位的未實現損益 (元)
+        參數:
+            price_of (callable): (product, contract) -> 當前價格
+        """
+        return sum((price_of(product, contract) - pos['avg_price']) * pos['qty'] * FUTURES_MULTIPLIER[product]
+                   for (product, contract), pos in self.futures.items())
+
+
+FUTURES_MULTIPLIER = {'TX': 200, 'MTX': 50}  # 大台每點 200 元、小台每點 50 元
+
+
+def _fill_prices(fill) -> list:
+    """成交價 (成交模型的陣列或券商回報的 list) 轉成 PositionBook 的 list (NaN -> None，視為查無報價)"""
+    prices = fill.prices.tolist() if isinstance(fill.prices, np.ndarray) else fill.prices
+    return [None if p is None or p != p else p for p in prices]
+
+
+_ADDRESS = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def stable_repr(obj) -> Optional[str]:
+    """
+    快取鍵用的 repr：含記憶體位址時 (lambda、未定義 __repr__ 的物件) 每次執行都不同，
+    存檔後也無法再命中，回傳 None 表示不可快取
+    """
+    text = repr(obj)
+    return None if _ADDRESS.search(text) else text
+
+
+def strategy_key(strategy) -> dict:
+    """策略建構子參數的目前值 (stable_repr；無法穩定表示的值只記型別名稱)，用來區分不同的策略設定"""
+    params = {}
+    for name in inspect.signature(type(strategy).__init__).parameters:
+        if name != 'self' and hasattr(strategy, name):
+            value = getattr(strategy, name)
+            params[name] = stable_repr(value) or type(value).__name__
+    return params
+
+
+class BacktestExecutor(PositionBook):
+    def __init__(self, strategy, start_date, end_date, df_opt, df_fut, balance=2_000_000,
+                 profile=False, trace_path=None, journal=None,
+                 checkpoint_dir=None, checkpoint_every=20, resume=False, market_data=None,
+                 prefetch=0, prefetch_mode='thread', stop_rule=None, fill_model=None, indicators=None,
+                 approx_greeks=None, hedger=None):
+        """
+        參數:
+            profile (bool): 是否啟用階段計時，run() 結束時印出效能報告
+            trace_path (str): 逐日追蹤檔 (CSV) 路徑，需搭配 profile=True
+            journal (EventJournal): 事件日誌 (None 則建立一個與預設日誌相同設定的新日誌)
+            checkpoint_dir (str): 存檔目錄 (None 則不存檔)
+            checkpoint_every (int): 每幾個交易日存檔一次 (回測結束時也會存檔)
+            resume (bool): 若存檔目錄中有同一回測的存檔，從存檔的下一根 K 棒續跑
+            market_data (callable): 資料來源 (start_date, end_date, profiler=, journal=) -> MarketSnapshot 迭代器
+                                    None 則使用 market_data_generator (日資料)；盤中回測用 intraday.IntradayBarSource
+                                    (資料來源有 get_state / set_state 時一併存檔續跑)
+            prefetch (int): > 0 時改用 prefetch_market_data_generator，背景預先計算的天數
+            prefetch_mode (str): 'thread' 或 'process'
+            stop_rule (callable): 每根 K 棒結束後呼叫 stop_rule(executor)，回傳非空字串 (原因) 則提前結束回測
+                                  例如 optimization.EarlyStop(min_equity=0.5, max_drawdown=0.4)
+            fill_model (FillModel): 成交模型 (成交價、口數與交易成本)，None 則以收盤價成交、不計費用
+                                    例如 fill_model.TaifexFillModel(commission=25, volume_cap=0.1)
+            indicators (MarketIndicators): 逐日指標層 (IV rank、期限結構、實現波動率...)，
+                                           每個交易日更新一次並放入 context['indicators']
+            approx_greeks (ApproxGreeks): 近似 IV/Greeks 模式 (greeks_grid，參數掃描用)，None 則為精確解
+                                          (market_data 自訂資料來源時不適用)
+            hedger (DeltaHedger): 期貨 Delta 避險 (hedging 模組)，每根 K 棒執行完訊號後調整期貨部位，
+                                  None 則不避險。策略訊號中的期貨腳 (Leg.opt_type 為 'TX' / 'MTX')
+                                  以 hedger 的成本設定成交，沒有 hedger 時以 FuturesExecution() (不計成本) 成交
+        """
         self.strategy = strategy
+        self.strategy_params = strategy_key(strategy)  # 建構時的策略參數 (存檔會覆蓋策略狀態，續跑前先比對)
         self.start_date = pd.Timestamp(start_date)
         self.end_date = pd.Timestamp(end_date)
         self.df_opt = df_opt
@@ -557,147 +1050,340 @@ class BacktestExecutor:
         
         self.current_position = None 
         self.history = []
+        self.equity = []  # 每根 K 棒收盤後的 (date, balance, equity)，equity 含持倉市值
         self.balance = balance 
+        self.initial_balance = balance
+        self.profiler = StageProfiler(enabled=profile, trace_path=trace_path)
+        self.journal = journal if journal is not None else new_journal_like(get_journal())
+
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = checkpoint_every
+        self.resume = resume
+        self.last_date = None  # 最後一個處理完成的 K 棒時間 (generator 游標)
+        self.market_data = market_data
+        self.prefetch = prefetch
+        self.prefetch_mode = prefetch_mode
+        self.stop_rule = stop_rule
+        self.fill_model = fill_model if fill_model is not None else FillModel()
+        self.indicators = indicators
+        self.approx_greeks = approx_greeks
+        self.hedger = hedger
+        self.futures = {}       # (product, contract) -> {'qty', 'avg_price'}，避險與策略期貨腳的期貨部位
+        self.hedges = []        # 期貨成交紀錄 (hedge_frame())
+        self.hedge_pnl = 0.0    # 期貨已實現損益 (已扣費用，已計入 balance)
+        self.hedge_fees = 0.0
+        self._futures_exec = None    # 沒有 hedger 時，策略期貨腳使用的 FuturesExecution
+        self.stopped = None          # 提前結束的原因 (None 表示跑完全程)
+        self.peak_equity = balance   # 權益高點 (計算回撤用)
         
     def run(self):
-        print(f"--- Executor Start | Balance: {self.balance} ---")
+        journal = self.journal
+        prof = self.profiler
+
+        # 續跑：載入存檔並從存檔的下一根 K 棒開始
+        start_date = self.start_date
+        resume_after = None
+        if self.resume and self.checkpoint_dir and self.load_checkpoint():
+            if self.last_date is not None:
+                resume_after = self.last_date
+                start_date = self.last_date.normalize()
+            journal.info(DATA, "--- Executor Resume from {date} | Balance: {balance} ---",
+                         date=self.last_date, balance=self.balance)
+        else:
+            journal.info(DATA, "--- Executor Start | Balance: {balance} ---", balance=self.balance)
+        prof.begin_run()
         
         # 建立換倉地圖
         rollover_map = build_rollover_map(self.df_fut, self.start_date, self.end_date)
-        # 資料生成器
-        market_gen = market_data_generator(self.start_date, self.end_date, self.df_opt, self.df_fut)
+        if self.hedger is not None:
+            self.hedger.bind(self.df_fut)
+        # 資料生成器 (逐日或逐 K 棒產出 MarketSnapshot)
+        if self.market_data is None and self.prefetch > 0:
+            market_gen = prefetch_market_data_generator(start_date, self.end_date, self.df_opt, self.df_fut,
+                                                        depth=self.prefetch, mode=self.prefetch_mode,
+                                                        profiler=prof, journal=journal,
+                                                        approx_greeks=self.approx_greeks)
+        elif self.market_data is None:
+            market_gen = market_data_generator(start_date, self.end_date, self.df_opt, self.df_fut,
+                                               profiler=prof, journal=journal, approx_greeks=self.approx_greeks)
+        else:
+            market_gen = self.market_data(start_date, self.end_date, profiler=prof, journal=journal)
+        days_since_checkpoint = 0
+        last_day = None if resume_after is None else resume_after.normalize()
         
-        for date, S, calls, puts in market_gen:
-            market_data = (date, S, calls, puts)
+        while True:
+            t = prof.start()
+            snapshot = next(market_gen, None)
+            if snapshot is None:
+                break
+            prof.stop('data', t)
+            date = snapshot.date
+            if resume_after is not None and date <= resume_after:
+                continue
             
             # Context 傳遞
             context = {
                 'position': self.current_position,
-                'balance': self.balance
+                'balance': self.balance,
+                'journal': journal
             }
+            if self.indicators is not None:
+                t = prof.start()
+                context['indicators'] = self.indicators.update(snapshot)
+                prof.stop('indicators', t)
             
-            # 取得換倉資訊
-            is_rollover, close_contract, open_contract = get_rollover_info(date, rollover_map)
+            # 取得換倉資訊 (盤中模式只在當日第一根 K 棒觸發)
+            day = date.normalize()
+            if day != last_day:
+                is_rollover, close_contract, open_contract = get_rollover_info(day, rollover_map)
+                last_day = day
+            else:
+                is_rollover, close_contract, open_contract = False, None, None
             rollover_info = (is_rollover, close_contract, open_contract)
             
             signals = []
+            t = prof.start()
             if is_rollover:
-                signals = self.strategy.on_rollover(context, market_data, rollover_info)
+                signals = self.strategy.on_rollover(context, snapshot, rollover_info)
             else:
-                signals = self.strategy.on_bar(context, market_data)
+                signals = self.strategy.on_bar(context, snapshot)
+            prof.stop('strategy', t)
                 
+            t = prof.start()
             for sig in signals:
-                self._execute_signal(sig, market_data)
+                if journal.debug_on:
+                    journal.debug(SIGNAL, ">> [訊號] {date:%Y-%m-%d} {action} {contract} x{qty} ({reason})", date=date,
+                                  action=sig.action, contract=sig.contract, qty=sig.quantity, reason=sig.reason)
+                self._execute_signal(sig, snapshot)
+            prof.stop('execute', t)
+            if self.futures:
+                self._settle_futures(snapshot)
+            if self.hedger is not None:
+                t = prof.start()
+                self.hedger.rebalance(self, snapshot)
+                prof.stop('hedge', t)
+
+            equity = self.balance + self._position_value(snapshot)
+            if self.futures:
+                execution = self._futures_execution()
+                equity += self._futures_value(lambda product, contract: execution.price(snapshot, contract))
+            self.equity.append((date, self.balance, equity))
+            self.peak_equity = max(self.peak_equity, equity)
+            prof.count('signals', len(signals))
+            prof.count('days')
+            prof.end_day(date)
+
+            # 當日處理完成才更新游標並存檔
+            self.last_date = date
+            days_since_checkpoint += 1
+            if self.checkpoint_dir and days_since_checkpoint >= self.checkpoint_every:
+                self.save_checkpoint()
+                days_since_checkpoint = 0
+
+            if self.stop_rule is not None:
+                reason = self.stop_rule(self)
+                if reason:
+                    self.stopped = reason
+                    journal.warning(STRATEGY, ">> [提前結束] {date} {reason}", date=date, reason=reason)
+                    break
                 
+        if hasattr(market_gen, 'close'):
+            market_gen.close()  # 提前結束時釋放 generator (例如 prefetch 的背景工作)
+        if self.checkpoint_dir and days_since_checkpoint:
+            self.save_checkpoint()
+        prof.end_run()
+        if prof.enabled:
+            print(prof.report())
         return pd.DataFrame(self.history)
 
-    def _execute_signal(self, signal, market_data):
-        date, S, calls, puts = market_data
-        df_prices = pd.concat([calls, puts])
-        
-        # [關鍵修正] 這裡必須先過濾出正確的合約月份，避免查到週選
-        # 如果 signal 有指定 contract (通常都有)，就只看那個 contract
-        if signal.contract:
-            df_prices = df_prices[df_prices['到期月份(週別)'] == signal.contract]
+    def equity_frame(self) -> pd.DataFrame:
+        """逐日 (盤中模式為逐 K 棒) 權益曲線：date, balance (已實現), equity (含持倉市值)"""
+        return pd.DataFrame(self.equity, columns=['date', 'balance', 'equity'])
 
-        if df_prices.empty:
-            print(f">> [下單失敗] {date.date()} 找不到月份為 {signal.contract} 的報價資料")
-            return
+    def hedge_frame(self) -> pd.DataFrame:
+        """
+        期貨成交紀錄 (避險單與策略訊號的期貨腳)：date, product, contract, qty (買正賣負), price, fees,
+        realized_pnl, position (成交後口數), reason, balance
+        """
+        return pd.DataFrame(self.hedges, columns=['date', 'product', 'contract', 'qty', 'price', 'fees',
+                                                  'realized_pnl', 'position', 'reason', 'balance'])
 
-        if signal.action == 'OPEN':
-            net_cash_flow = 0.0
-            legs_record = []
-            qty = signal.quantity
-            
-            for leg in signal.legs:
-                # 精準查價：履約價 + 買賣權
-                mask = (df_prices['履約價'] == leg.strike) & \
-                       (df_prices['買賣權'] == ('買權' if leg.opt_type == 'call' else '賣權'))
-                
-                target_rows = df_prices[mask]
-                
-                if target_rows.empty:
-                    print(f">> [缺資料] 無法建倉: {leg}")
+    # ==========================================
+    # 存檔與續跑 (Checkpoint / Resume)
+    # ==========================================
+    def _run_key(self) -> dict:
+        """用來確認存檔屬於同一個回測設定 (策略參數、資料來源與各模型的設定都需相同)"""
+        market_data = self.market_data
+        return {
+            'strategy': type(self.strategy).__name__,
+            'strategy_params': self.strategy_params,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'initial_balance': self.initial_balance,
+            'market_data': None if market_data is None else stable_repr(market_data) or type(market_data).__name__,
+            'approx_greeks': repr(self.approx_greeks),
+            'indicators': repr(self.indicators),
+            'fill_model': repr(self.fill_model),
+            'hedger': repr(self.hedger),
+        }
+
+    def get_state(self) -> dict:
+        """Executor 的完整可續跑狀態"""
+        if hasattr(self.strategy, 'get_state'):
+            strategy_state = self.strategy.get_state()
+        else:
+            strategy_state = copy.deepcopy(vars(self.strategy))
+        return {
+            'run_key': self._run_key(),
+            'last_date': self.last_date,
+            'balance': self.balance,
+            'current_position': copy.deepcopy(self.current_position),
+            'history': copy.deepcopy(self.history),
+            'equity': list(self.equity),
+            'peak_equity': self.peak_equity,
+            'strategy_state': strategy_state,
+            'indicator_state': None if self.indicators is None else self.indicators.get_state(),
+            'market_data_state': self.market_data.get_state() if hasattr(self.market_data, 'get_state') else None,
+            'futures': copy.deepcopy(self.futures),
+            'hedges': list(self.hedges),
+            'hedge_pnl': self.hedge_pnl,
+            'hedge_fees': self.hedge_fees,
+            'journal_events': list(self.journal._events),
+        }
+
+    def set_state(self, state: dict):
+        self.last_date = state['last_date']
+        self.balance = state['balance']
+        self.current_position = copy.deepcopy(state['current_position'])
+        self.history = copy.deepcopy(state['history'])
+        self.equity = list(state.get('equity', []))
+        self.peak_equity = state.get('peak_equity', self.initial_balance)
+        if hasattr(self.strategy, 'set_state'):
+            self.strategy.set_state(state['strategy_state'])
+        else:
+            vars(self.strategy).update(copy.deepcopy(state['strategy_state']))
+        if self.indicators is not None and state.get('indicator_state') is not None:
+            self.indicators.set_state(state['indicator_state'])
+        if hasattr(self.market_data, 'set_state') and state.get('market_data_state') is not None:
+            self.market_data.set_state(state['market_data_state'])
+        self.futures = copy.deepcopy(state.get('futures', {}))
+        self.hedges = list(state.get('hedges', []))
+        self.hedge_pnl = state.get('hedge_pnl', 0.0)
+        self.hedge_fees = state.get('hedge_fees', 0.0)
+        self.journal.clear()
+        self.journal._events.extend(state['journal_events'])
+
+    @property
+    def checkpoint_path(self) -> str:
+        return os.path.join(self.checkpoint_dir, 'checkpoint.pkl')
+
+    def save_checkpoint(self):
+        """寫入最新存檔 (先寫暫存檔再替換，避免中途中斷留下損毀的檔案)"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.get_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self) -> bool:
+        """載入最新存檔，沒有存檔回傳 False；存檔屬於不同回測設定時拋出 ValueError"""
+        if not os.path.exists(self.checkpoint_path):
+            return False
+        with open(self.checkpoint_path, 'rb') as f:
+            state = pickle.load(f)
+        if state['run_key'] != self._run_key():
+            raise ValueError(f"存檔 {self.checkpoint_path} 屬於不同的回測設定: {state['run_key']}")
+        self.set_state(state)
+        return True
+
+    def _futures_execution(self):
+        """期貨成交者：有 hedger 時即為 hedger，否則建立不計成本的 FuturesExecution"""
+        if self.hedger is not None:
+            return self.hedger
+        if self._futures_exec is None:
+            from hedging import FuturesExecution  # hedging 匯入 utils，延後匯入避免循環
+            self._futures_exec = FuturesExecution()
+            self._futures_exec.bind(self.df_fut)
+        return self._futures_exec
+
+    def _execute_futures_legs(self, signal, legs, snapshot):
+        """
+        訊號中的期貨腳：OPEN 依 leg.side 買賣 signal.quantity 口；
+        CLOSE 的 leg.side 為持倉方向，反向沖銷 (最多沖銷到持倉口數)
+        """
+        execution = self._futures_execution()
+        for leg in legs:
+            direction = 1 if leg.side == 'buy' else -1
+            qty = direction * signal.quantity
+            if signal.action == 'CLOSE':
+                held = self.futures.get((leg.opt_type, signal.contract), {}).get('qty', 0)
+                if held * direction <= 0:
+                    self.journal.warning(MISSING_QUOTE, ">> [平倉失敗] {date:%Y-%m-%d} 沒有 {product} {contract} 的{side}部位",
+                                         date=snapshot.date, product=leg.opt_type, contract=signal.contract,
+                                         side='多頭' if direction > 0 else '空頭')
                     continue
-                    
-                price = target_rows.iloc[0]['收盤價']
-                
-                direction = 1 if leg.side == 'sell' else -1
-                net_cash_flow += (price * direction)
-                
-                legs_record.append({
-                    'side': leg.side, 'type': leg.opt_type, 
-                    'strike': leg.strike, 'entry_price': price
-                })
+                qty = -direction * min(signal.quantity, abs(held))
+            execution.trade(self, snapshot, leg.opt_type, signal.contract, qty, signal.reason)
+
+    def _settle_futures(self, snapshot):
+        """策略期貨腳到期 (最後結算日) 時以當前價格結算平倉；hedger 商品的部位由 hedger 轉倉"""
+        day = snapshot.date.normalize()
+        hedged = self.hedger.product if self.hedger is not None else None
+        execution = None
+        for (product, contract), pos in list(self.futures.items()):
+            if product == hedged or pd.Timestamp(get_expiry_date_cached(contract)).normalize() > day:
+                continue
+            execution = execution or self._futures_execution()
+            execution.trade(self, snapshot, product, contract, -pos['qty'], 'settle')
 
-            if not legs_record: return 
+    def _execute_signal(self, signal, market_data):
+        # 相容舊版 (date, S, calls, puts) tuple
+        snapshot = MarketSnapshot.coerce(market_data)
+        date, S = snapshot.date, snapshot.S
+
+        # 期貨腳另外成交 (記在 futures / hedges)，其餘選擇權腳照原流程；只有期貨腳時不動選擇權持倉
+        futures_legs = [leg for leg in signal.legs if leg.opt_type in FUTURES_MULTIPLIER]
+        if futures_legs:
+            self._execute_futures_legs(signal, futures_legs, snapshot)
+            option_legs = [leg for leg in signal.legs if leg.opt_type not in FUTURES_MULTIPLIER]
+            if not option_legs:
+                return
+            signal = TradeSignal(signal.action, signal.contract, option_legs, signal.reason, signal.quantity)
+        
+        # [關鍵修正] 只查 signal 指定的合約月份，避免查到週選
+        if not snapshot.has_expiry(signal.contract):
+            self.journal.warning(MISSING_QUOTE, ">> [下單失敗] {date:%Y-%m-%d} 找不到月份為 {contract} 的報價資料",
+                                 date=date, contract=signal.contract)
+            return
 
-            total_premium = net_cash_flow * 50 * qty
-            self.balance += total_premium
-            
-            self.current_position = {
-                'contract': signal.contract, # 記住這個合約月份！
-                'legs': legs_record,
-                'qty': qty,
-                'total_premium': total_premium,
-                'entry_date': date,
-                'entry_index': S,
-                'strategy_mode': getattr(self.strategy, 'mode', 'N/A')
-            }
-            print(f">> [成交 OPEN] {date.date()} {signal.contract} | 口數: {qty} | 收權利金: {total_premium:.0f}")
+        if signal.action == 'OPEN':
+            # 精準查價：月份 + 履約價 + 買賣權 (整張單的各腳一次查完，交給成交模型)
+            rows = snapshot.locate(signal.contract, [leg.strike for leg in signal.legs],
+                                   [leg.opt_type for leg in signal.legs])
+            sides = [1.0 if leg.side == 'buy' else -1.0 for leg in signal.legs]
+            fill = self.fill_model.fill(snapshot, rows, sides, signal.quantity,
+                                        self._is_expiring(signal.contract, date))
+            if fill.qty <= 0:
+                self.journal.warning(MISSING_QUOTE, ">> [流動性不足] {date:%Y-%m-%d} {contract} 無法建倉",
+                                     date=date, contract=signal.contract)
+                return
+            self._fill_open(signal, _fill_prices(fill), date, S, fill.qty, fill.fees)
 
         elif signal.action == 'CLOSE' and self.current_position:
-            # 確保平倉也是平同一個合約
-            if self.current_position['contract'] != signal.contract:
-                 # 若換倉日時，signal.contract 可能是新合約，但我們要平的是舊合約
-                 # 這裡為了查價，我們應該要查 "持倉的合約"
-                 # 所以即使 signal 寫的是 open_contract，我們查價要用 current_position['contract']
-                 # 但這需要重新抓取該舊合約的報價 (可能不在 df_prices 篩選範圍內)
-                 # 解決方案：重新從 calls/puts 篩選舊合約
-                 df_prices_close = pd.concat([calls, puts])
-                 df_prices_close = df_prices_close[df_prices_close['到期月份(週別)'] == self.current_position['contract']]
-            else:
-                 df_prices_close = df_prices
-
-            close_cash_flow = 0.0
-            legs_detail_str = []
-            qty = self.current_position['qty']
-            
-            for leg_data in self.current_position['legs']:
-                # 精準查價
-                mask = (df_prices_close['履約價'] == leg_data['strike']) & \
-                       (df_prices_close['買賣權'] == ('買權' if leg_data['type'] == 'call' else '賣權'))
-                
-                exit_price = 0
-                if not mask.empty and mask.sum() > 0:
-                    exit_price = df_prices_close[mask].iloc[0]['收盤價']
-                else:
-                    # 結算或查無報價，使用內含價值計算
-                    strike = leg_data['strike']
-                    if leg_data['type'] == 'call': exit_price = max(0, S - strike)
-                    else: exit_price = max(0, strike - S)
-                    # print(f">> [平倉提示] {date.date()} 查無報價，使用結算價: {exit_price}")
-
-                direction = -1 if leg_data['side'] == 'sell' else 1
-                close_cash_flow += (exit_price * direction)
-                
-                legs_detail_str.append(f"{leg_data['type']} {leg_data['strike']} ({leg_data['entry_price']}->{exit_price})")
-
-            close_amount = close_cash_flow * 50 * qty
-            pnl = self.current_position['total_premium'] + close_amount
-            self.balance += close_amount
-            
-            self.history.append({
-                'entry_date': self.current_position['entry_date'],
-                'exit_date': date,
-                'pnl': pnl,
-                'roi': pnl / abs(self.current_position['total_premium']) if self.current_position['total_premium']!=0 else 0,
-                'trade_detail': " | ".join(legs_detail_str),
-                'balance': self.balance
-            })
-            
-            print(f">> [成交 CLOSE] {date.date()} PnL: {pnl:.0f} | Detail: {legs_detail_str}")
-            self.current_position = None
-
-
-
+            # 平倉一律查「持倉的合約」(換倉日 signal.contract 可能與持倉不同)
+            close_contract = self.current_position['contract']
+            legs = self.current_position['legs']
+            rows = snapshot.locate(close_contract, [leg['strike'] for leg in legs], [leg['type'] for leg in legs])
+            sides = [1.0 if leg['side'] == 'sell' else -1.0 for leg in legs]
+            fill = self.fill_model.fill(snapshot, rows, sides, self.current_position['qty'],
+                                        self._is_expiring(close_contract, date), closing=True)
+            if fill.qty <= 0:
+                self.journal.warning(MISSING_QUOTE, ">> [流動性不足] {date:%Y-%m-%d} {contract} 無法平倉",
+                                     date=date, contract=close_contract)
+                return
+            self._fill_close(signal, _fill_prices(fill), date, S, fill.qty, fill.fees)
+
+    @staticmethod
+    def _is_expiring(contract, date) -> bool:
+        """當日是否為該合約的最後結算日 (或已過期)"""
+        return pd.Timestamp(get_expiry_date_cached(contract)).normalize() <= date.normalize()